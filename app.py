@@ -8,7 +8,7 @@ import sys
 import threading
 from os import getpid, unlink
 from os.path import exists
-from typing import Any
+from typing import Any, Dict
 
 import colorlog
 import epdb
@@ -31,6 +31,42 @@ def control_center() -> None:
             pass
 
 
+def load_config(f_path: str) -> Dict[str, Any]:
+    """loads a config file. Configs generated by prove-backtesting are
+    JSON, which parses much faster as JSON than as YAML."""
+    with open(f_path, encoding="utf-8") as _f:
+        contents: str = _f.read()
+    try:
+        return json.loads(contents)
+    except ValueError:
+        return yaml.safe_load(contents)
+
+
+def backtest(
+    config_file: str,
+    config: Dict[str, Any],
+    credentials: Dict[str, Any],
+    logs_dir: str = "log",
+) -> Any:
+    """runs a backtesting session of a config in this process, without
+    reading it from config_file, returns the bot"""
+    strategy: Any = getattr(
+        importlib.import_module(f"strategies.{config['STRATEGY']}"),
+        "Strategy",
+    )
+    backtesting_bot: Any = strategy(
+        cached_binance_client(
+            credentials["ACCESS_KEY"], credentials["SECRET_KEY"]
+        ),
+        config_file,
+        dict(config, MODE="backtesting"),
+        logs_dir=logs_dir,
+    )
+    backtesting_bot.backtesting()
+    backtesting_bot.print_final_balance_report()
+    return backtesting_bot
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("-c", "--config", help="config.yaml file")
@@ -43,8 +79,7 @@ if __name__ == "__main__":
     )
     args = parser.parse_args()
 
-    with open(args.config, encoding="utf-8") as _f:
-        cfg = yaml.safe_load(_f.read())
+    cfg = load_config(args.config)
     with open(args.secrets, encoding="utf-8") as _f:
         secrets = yaml.safe_load(_f.read())
     cfg["MODE"] = args.mode
@@ -98,7 +133,7 @@ if __name__ == "__main__":
     module = importlib.import_module(f"strategies.{cfg['STRATEGY']}")
     Strategy = getattr(module, "Strategy")
 
-    bot: Any = Strategy(client, args.config, cfg)
+    bot: Any = Strategy(client, args.config, cfg, logs_dir=args.logs_dir)
 
     logging.info(
         f"running in {bot.mode} mode with "
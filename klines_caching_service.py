@@ -3,28 +3,70 @@ import json
 import logging
 import sys
 import threading
-from datetime import datetime
-from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 from hashlib import md5
-from os import getpid, mkdir
+from os import environ, getpid, makedirs, remove, replace, stat, utime
 from os.path import exists
-from time import sleep
+from time import sleep, time, time_ns
+from typing import Dict, Tuple
+from urllib.parse import parse_qs, urlparse
 
 import colorlog  # pylint: disable=E0401
+import numpy as np
 import requests
-from flask import Flask, request  # pylint: disable=E0401
+from flask import (  # pylint: disable=E0401
+    Flask,
+    Response,
+    request,
+    stream_with_context,
+)
 from pyrate_limiter import Duration, Limiter, RequestRate
 from tenacity import retry, wait_exponential
 
+from lib.klines_codec import (
+    KLINES_BINARY,
+    KLINES_BINARY_STREAM,
+    encode_klines,
+    encode_klines_frame,
+    prune_shared_klines,
+    publish_klines,
+    wants_binary,
+)
+from lib import price_log_klines
+from lib.klines_store import ATIME_RESOLUTION, read_from_store
+
 rate: RequestRate = RequestRate(
     600, Duration.MINUTE
 )  # 600 requests per minute
 limiter: Limiter = Limiter(rate)
 
 DEBUG = False
+NDJSON = "application/x-ndjson"
+# where we get our klines from, either 'binance' or 'price_logs' to build
+# them out of the local log/SYMBOL/DATE.log.gz files without any network calls
+KLINES_PROVIDER = environ.get("KLINES_PROVIDER", "binance")
+# a directory, typically on /dev/shm, shared with co-located Bots where we
+# publish the klines of every coin we serve, for those Bots to read directly
+KLINES_SHARED_MEMORY_DIR = environ.get("KLINES_SHARED_MEMORY_DIR", "")
+# how much of the KLINES_SHARED_MEMORY_DIR we use, in bytes
+KLINES_SHARED_MEMORY_SIZE = int(
+    environ.get("KLINES_SHARED_MEMORY_SIZE", 1024 * 1024 * 1024)
+)
+# how often, in seconds, we prune the KLINES_SHARED_MEMORY_DIR back under
+# KLINES_SHARED_MEMORY_SIZE, starting with the first coin we publish
+SHARED_MEMORY_PRUNE_INTERVAL = 60
+SHARED_MEMORY_PRUNED_AT: Dict[str, float] = {"at": 0.0}
 PID = getpid()
 
 LOCK = threading.Lock()
+# unix time until which binance has asked us to stop calling it
+BACKOFF_UNTIL: Dict[str, float] = {"binance": 0.0}
+
+# binance calls currently in progress, keyed by the cache file they will
+# populate. Concurrent requests for the exact same klines wait on the first
+# request instead of calling binance and writing the same cache file again.
+INFLIGHT: Dict[str, "InFlight"] = {}
+INFLIGHT_LOCK = threading.Lock()
 
 c_handler = colorlog.StreamHandler(sys.stdout)
 c_handler.setFormatter(
@@ -65,19 +107,42 @@ else:
     )
 
 
+# number of klines to keep, and how many minutes before the coin date
+# we request them from, for each unit
+UNIT_VALUES = {
+    "m": (60, 1),
+    "h": (24, 60),
+    # for 'Days' we retrieve 1000 days, binance API default
+    "d": (1000, 60 * 24),
+}
+
+# resolves the m, h, d lookups of a request concurrently
+UNITS_POOL = ThreadPoolExecutor(max_workers=24, thread_name_prefix="klines")
+
 app = Flask(__name__)
 
 
-@lru_cache(64)
-def c_from_timestamp(date: float) -> datetime:
-    """returns a cached datetime.fromtimestamp()"""
-    return datetime.fromtimestamp(date)
+class InFlight:  # pylint: disable=too-few-public-methods
+    """a pending klines lookup which other requests can wait on"""
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Tuple[bool, list] = (False, [])
 
 
 @retry(wait=wait_exponential(multiplier=1, max=3))
-@limiter.ratelimit("binance", delay=True)
 def requests_with_backoff(query: str):
     """retry wrapper for requests calls"""
+
+    # only the rate limiting and any binance ban are serialized across
+    # threads, the requests themselves are allowed to run concurrently.
+    with LOCK:
+        wait_for = BACKOFF_UNTIL["binance"] - time()
+        if wait_for > 0:
+            sleep(wait_for)
+        with limiter.ratelimit("binance", delay=True):
+            pass
+
     response = requests.get(query, timeout=30)
 
     # 418 is a binance api limits response
@@ -87,21 +152,19 @@ def requests_with_backoff(query: str):
     if status in [418, 429]:
         backoff = int(response.headers["Retry-After"])
         logging.warning(f"HTTP {status} from binance, sleeping for {backoff}s")
+        BACKOFF_UNTIL["binance"] = time() + backoff
         sleep(backoff)
         response.raise_for_status()
     return response
 
 
-def process_klines_line(kline):
-    """returns date, low, avg, high from a kline"""
-    (_, _, high, low, _, _, closetime, _, _, _, _, _) = kline
-
-    date = float(c_from_timestamp(closetime / 1000).timestamp())
-    low = float(low)
-    high = float(high)
-    avg = (low + high) / 2
-
-    return date, low, avg, high
+def touch_cache_file(path):
+    """updates the access time of a cache file, which is what cache_manager
+    evicts on, as most hosts mount their filesystems with relatime/noatime"""
+    f_stat = stat(path)
+    now = time_ns()
+    if f_stat.st_atime_ns < now - ATIME_RESOLUTION * 1_000_000_000:
+        utime(path, ns=(now, f_stat.st_mtime_ns))
 
 
 def read_from_local_cache(f_path, symbol):
@@ -110,86 +173,77 @@ def read_from_local_cache(f_path, symbol):
     # wrap results in a try call, in case our cached files are corrupt
     # and attempt to pull the required fields from our data.
 
-    if exists(f"cache/{symbol}/{f_path}"):
-        try:
+    try:
+        if exists(f"cache/{symbol}/{f_path}"):
             with open(f"cache/{symbol}/{f_path}", "r") as f:
                 results = json.load(f)
-        except Exception as err:  # pylint: disable=W0703
-            logging.critical(err)
-            return (False, [])
+            touch_cache_file(f"cache/{symbol}/{f_path}")
+        else:
+            # cache_manager compacts cache files into a per-symbol store
+            blob = read_from_store(symbol, f_path)
+            if blob is None:
+                logging.info(f"no file cache/{symbol}/{f_path}")
+                return (False, [])
+            results = json.loads(blob)
+    except Exception as err:  # pylint: disable=W0703
+        logging.critical(err)
+        return (False, [])
+
+    # new listed coins will return an empty array
+    # so we bail out early here
+    if not results:
+        return (True, [])
 
-        # new listed coins will return an empty array
-        # so we bail out early here
-        if not results:
-            return (True, [])
-
-        # check for valid values by reading one line
-        try:
-            # pylint: disable=W0612
-            (
-                _,
-                _,
-                high,
-                low,
-                _,
-                _,
-                closetime,
-                _,
-                _,
-                _,
-                _,
-                _,
-            ) = results[0]
-        except Exception as err:  # pylint: disable=W0703
-            logging.critical(err)
-            return (False, [])
-
-        return (True, results)
-    logging.info(f"no file cache/{symbol}/{f_path}")
-    return (False, [])
+    # check for valid values by reading one line
+    try:
+        # pylint: disable=W0612
+        (
+            _,
+            _,
+            high,
+            low,
+            _,
+            _,
+            closetime,
+            _,
+            _,
+            _,
+            _,
+            _,
+        ) = results[0]
+    except Exception as err:  # pylint: disable=W0703
+        logging.critical(err)
+        return (False, [])
+
+    return (True, results)
 
 
 def populate_values(klines, unit):
     """builds averages[], lowest[], highest[] out of klines"""
-    _lowest = []
-    _averages = []
-    _highest = []
-
-    # retrieve and calculate the lowest, highest, averages
-    # from the klines data.
-    # we need to transform the dates into consumable timestamps
-    # that work for our bot.
-    for line in klines:
-        date, low, avg, high = process_klines_line(line)
-        _lowest.append((date, low))
-        _averages.append((date, avg))
-        _highest.append((date, high))
-
-    # finally, populate all the data coin buckets
     values = {}
     for metric in ["lowest", "averages", "highest"]:
         values[metric] = []
 
-    unit_values = {
-        "m": 60,
-        "h": 24,
-        # for 'Days' we retrieve 1000 days, binance API default
-        "d": 1000,
-    }
-
-    timeslice = unit_values[unit]
-    # we gather all the data we collected and only populate
-    # the required number of records we require.
-    # this could possibly be optimized, but at the same time
-    # this only runs the once when we initialise a coin
-    for d, v in _lowest[-timeslice:]:
-        values["lowest"].append((d, v))
-
-    for d, v in _averages[-timeslice:]:
-        values["averages"].append((d, v))
+    # we only populate the number of records we require for this unit,
+    # so discard any older klines before doing any work on them.
+    timeslice, _ = UNIT_VALUES[unit]
+    klines = klines[-timeslice:]
+    if not klines:
+        return (True, values)
+
+    # retrieve and calculate the lowest, highest, averages from the klines
+    # data in one go, binance returns prices as strings and the closetime in
+    # milliseconds.
+    closetime, high, low = (
+        np.array(klines, dtype=object)[:, [6, 2, 3]].astype(np.float64).T
+    )
+    date = closetime / 1000
+    avg = (low + high) / 2
 
-    for d, v in _highest[-timeslice:]:
-        values["highest"].append((d, v))
+    # and return them as [date, value] lists, ready to be serialised
+    values["lowest"] = np.column_stack((date, low)).tolist()
+    values["averages"] = np.column_stack((date, avg)).tolist()
+    values["highest"] = np.column_stack((date, high)).tolist()
 
     return (True, values)
 
@@ -197,8 +251,7 @@ def populate_values(klines, unit):
 def call_binance_for_klines(query):
     """calls upstream binance and retrieves the klines for a coin"""
     logging.info(f"calling binance on {query}")
-    with LOCK:
-        response = requests_with_backoff(query)
+    response = requests_with_backoff(query)
     if response.status_code == 400:
         # 400 typically means binance has no klines for this coin
         logging.warning(f"got a 400 from binance for {query}")
@@ -206,24 +259,82 @@ def call_binance_for_klines(query):
     return (True, response.json())
 
 
+def call_price_logs_for_klines(query):
+    """builds the klines for a binance query out of the local price logs"""
+    params = parse_qs(urlparse(query).query)
+    unit = params["interval"][0][-1]
+    timeslice, _ = UNIT_VALUES[unit]
+    klines = price_log_klines.klines_for(
+        params["symbol"][0],
+        int(params["endTime"][0]) / 1000,
+        unit,
+        timeslice,
+    )
+    return (True, klines)
+
+
 def save_binance_klines(query, f_path, klines, mode, symbol):
     """saves binance klines for a coin locally"""
     logging.info(f"caching binance {query} on cache/{symbol}/{f_path}")
     if mode == "backtesting":
-        if not exists(f"cache/{symbol}"):
-            mkdir(f"cache/{symbol}")
-
-        with open(f"cache/{symbol}/{f_path}", "w") as f:
-            f.write(json.dumps(klines))
+        makedirs(f"cache/{symbol}", exist_ok=True)
 
+        # write to a temporary file first and rename it into place, so that
+        # readers never consume a partially written json file.
+        tmp_path = (
+            f"cache/{symbol}/.{f_path}.{PID}.{threading.get_ident()}.tmp"
+        )
+        try:
+            with open(tmp_path, "w") as f:
+                f.write(json.dumps(klines))
+            replace(tmp_path, f"cache/{symbol}/{f_path}")
+        except BaseException:
+            if exists(tmp_path):
+                remove(tmp_path)
+            raise
+
+
+def fetch_klines(query, f_path, mode, symbol):
+    """returns klines from the local cache or from binance, only calling
+    binance once for concurrent requests of the same klines"""
+    # klines built from the price logs are cheap to build, and are kept out
+    # of the cache/ so that they never get mixed with the binance ones.
+    if KLINES_PROVIDER == "price_logs":
+        return call_price_logs_for_klines(query)
+
+    ok, klines = read_from_local_cache(f_path, symbol)
+    if ok:
+        return (ok, klines)
+
+    with INFLIGHT_LOCK:
+        leader = f_path not in INFLIGHT
+        if leader:
+            INFLIGHT[f_path] = InFlight()
+        flight = INFLIGHT[f_path]
+
+    if not leader:
+        logging.info(f"waiting on in-flight lookup for {f_path}")
+        flight.done.wait()
+        return flight.result
+
+    try:
+        # a previous leader could have populated the cache between our
+        # first read and us registering this lookup
+        ok, klines = read_from_local_cache(f_path, symbol)
+        if not ok:
+            ok, klines = call_binance_for_klines(query)
+            if ok:
+                save_binance_klines(query, f_path, klines, mode, symbol)
+        flight.result = (ok, klines)
+    finally:
+        with INFLIGHT_LOCK:
+            del INFLIGHT[f_path]
+        flight.done.set()
+    return flight.result
 
-@app.route("/")
-def load_klines_for_coin():
-    """fetches from binance or a local cache klines for a coin"""
 
-    symbol = request.args.get("symbol")
-    date = int(float(request.args.get("date")))
-    mode = request.args.get("mode")
+def klines_queries(symbol, date):
+    """returns the (unit, binance query, cache file) to lookup for a coin"""
 
     # when we initialise a coin, we pull a bunch of klines from binance
     # for that coin and save it to disk, so that if we need to fetch the
@@ -232,17 +343,11 @@ def load_klines_for_coin():
 
     api_url = f"https://api.binance.com/api/v3/klines?symbol={symbol}&"
 
-    unit_values = {
-        "m": (60, 1),
-        "h": (24, 60),
-        # for 'Days' we retrieve 1000 days, binance API default
-        "d": (1000, 60 * 24),
-    }
     unit_url_fpath = []
     for unit in ["m", "h", "d"]:
         # lets find out the from what date we need to pull klines from while in
         # backtesting mode.
-        timeslice, minutes_before_now = unit_values[unit]
+        _, minutes_before_now = UNIT_VALUES[unit]
 
         backtest_end_time = date
         end_unix_time = int(
@@ -253,33 +358,107 @@ def load_klines_for_coin():
         md5_query = md5(query.encode()).hexdigest()  # nosec
         f_path = f"{symbol}.{md5_query}"
         unit_url_fpath.append((unit, query, f_path))
+    return unit_url_fpath
+
 
+def empty_values():
+    """returns an empty set of lowest, averages, highest buckets"""
     values = {}
     for metric in ["lowest", "averages", "highest"]:
         values[metric] = {}
         for unit in ["m", "h", "d", "s"]:
             values[metric][unit] = []
+    return values
 
-    for unit, query, f_path in unit_url_fpath:
-        klines = []
-        ok, klines = read_from_local_cache(f_path, symbol)
-        if not ok:
-            ok, klines = call_binance_for_klines(query)
-            if ok:
-                save_binance_klines(query, f_path, klines, mode, symbol)
 
-        if ok:
-            ok, low_avg_high = populate_values(klines, unit)
+def add_klines_to_values(values, unit, klines):
+    """populates the unit buckets in values from a list of klines"""
+    ok, low_avg_high = populate_values(klines, unit)
+
+    if ok:
+        for metric in low_avg_high.keys():  # pylint: disable=C0201,C0206
+            values[metric][unit] = low_avg_high[metric]
+
+
+def load_klines_for_coin(symbol, date, mode):
+    """fetches from binance or a local cache klines for a coin"""
+    values = empty_values()
+
+    # the m, h, d lookups are independent of each other, on a cold cache
+    # each one is a binance call, so we run them concurrently and only
+    # assemble the response once all have completed.
+    queries = klines_queries(symbol, date)
+    lookups = [
+        UNITS_POOL.submit(fetch_klines, query, f_path, mode, symbol)
+        for _, query, f_path in queries
+    ]
+    for (unit, _, _), lookup in zip(queries, lookups):
+        ok, klines = lookup.result()
 
         if ok:
-            for metric in low_avg_high.keys():  # pylint: disable=C0201,C0206
-                values[metric][unit] = low_avg_high[metric]
-                # make sure we don't keep more values that we should
-                timeslice, _ = unit_values[unit]
-                while len(values[metric][unit]) > timeslice:
-                    values[metric][unit].pop()
+            add_klines_to_values(values, unit, klines)
+
+    if KLINES_SHARED_MEMORY_DIR:
+        share_klines(symbol, date, values)
+    return values
+
+
+def share_klines(symbol, date, values):
+    """publishes the klines of a coin into the KLINES_SHARED_MEMORY_DIR,
+    keeping it under KLINES_SHARED_MEMORY_SIZE"""
+    if not publish_klines(KLINES_SHARED_MEMORY_DIR, symbol, date, values):
+        return
+    now = time()
+    if now - SHARED_MEMORY_PRUNED_AT["at"] > SHARED_MEMORY_PRUNE_INTERVAL:
+        SHARED_MEMORY_PRUNED_AT["at"] = now
+        prune_shared_klines(
+            KLINES_SHARED_MEMORY_DIR, KLINES_SHARED_MEMORY_SIZE
+        )
+
+
+@app.route("/")
+def klines_for_coin():
+    """returns the klines for a single coin"""
+    symbol = request.args.get("symbol")
+    date = int(float(request.args.get("date")))
+    mode = request.args.get("mode")
+
+    values = load_klines_for_coin(symbol, date, mode)
+    # clients that ask for it get the klines as packed float64 arrays,
+    # everyone else gets the original json document.
+    if wants_binary(request.headers.get("Accept", "")):
+        return Response(encode_klines(values), mimetype=KLINES_BINARY)
     return values
 
 
+@app.route("/batch", methods=["POST"])
+def klines_for_coins():
+    """returns the klines for a list of [symbol, date] pairs
+
+    results are streamed back as one json document per line, in the same
+    order as requested, so that clients can start consuming them as soon as
+    the first coin is ready.
+    """
+    body = request.get_json()
+    mode = body["mode"]
+    coins = body["coins"]
+    binary = wants_binary(request.headers.get("Accept", ""))
+
+    def generate():
+        for symbol, date in coins:
+            values = load_klines_for_coin(symbol, int(float(date)), mode)
+            if binary:
+                yield encode_klines_frame(symbol, date, values)
+            else:
+                yield json.dumps(
+                    {"symbol": symbol, "date": date, "klines": values}
+                ) + "\n"
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype=KLINES_BINARY_STREAM if binary else NDJSON,
+    )
+
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=8999)
@@ -0,0 +1,212 @@
+""" asyncio variant of klines_caching_service, manages the cache/ directory """
+import asyncio
+import json
+import logging
+from time import time
+from typing import Dict, Tuple
+
+import aiohttp
+from aiohttp import web
+from tenacity import retry, wait_exponential
+
+from klines_caching_service import (
+    KLINES_PROVIDER,
+    KLINES_SHARED_MEMORY_DIR,
+    NDJSON,
+    add_klines_to_values,
+    call_price_logs_for_klines,
+    empty_values,
+    klines_queries,
+    limiter,
+    read_from_local_cache,
+    save_binance_klines,
+    share_klines,
+)
+from lib.klines_codec import (
+    KLINES_BINARY,
+    KLINES_BINARY_STREAM,
+    encode_klines,
+    encode_klines_frame,
+    wants_binary,
+)
+
+# lookups currently in progress, keyed by the cache file they will populate.
+# concurrent requests for the same klines await the first request's result.
+INFLIGHT: Dict[str, asyncio.Future] = {}
+# unix time until which binance has asked us to stop calling it
+BACKOFF_UNTIL: Dict[str, float] = {"binance": 0.0}
+
+
+@retry(wait=wait_exponential(multiplier=1, max=3))
+@limiter.ratelimit("binance", delay=True)
+async def requests_with_backoff(
+    session: aiohttp.ClientSession, query: str
+) -> Tuple[int, list]:
+    """retry wrapper for binance calls"""
+    # while binance has us banned, no coroutine gets to call it, otherwise
+    # a 429 soon turns into a 418 ban of our IP.
+    wait_for = BACKOFF_UNTIL["binance"] - time()
+    if wait_for > 0:
+        await asyncio.sleep(wait_for)
+
+    async with session.get(
+        query, timeout=aiohttp.ClientTimeout(total=30)
+    ) as response:
+        # 418 is a binance api limits response
+        # don't raise a HTTPError Exception straight away but block until we
+        # are free from the ban.
+        status = response.status
+        if status in [418, 429]:
+            backoff = int(response.headers["Retry-After"])
+            logging.warning(
+                f"HTTP {status} from binance, sleeping for {backoff}s"
+            )
+            BACKOFF_UNTIL["binance"] = time() + backoff
+            await asyncio.sleep(backoff)
+            response.raise_for_status()
+        if status == 400:
+            return (status, [])
+        return (status, await response.json())
+
+
+async def call_binance_for_klines(
+    session: aiohttp.ClientSession, query: str
+) -> Tuple[bool, list]:
+    """calls upstream binance and retrieves the klines for a coin"""
+    logging.info(f"calling binance on {query}")
+    status, klines = await requests_with_backoff(session, query)
+    if status == 400:
+        # 400 typically means binance has no klines for this coin
+        logging.warning(f"got a 400 from binance for {query}")
+    return (True, klines)
+
+
+async def fetch_klines(
+    session: aiohttp.ClientSession,
+    query: str,
+    f_path: str,
+    mode: str,
+    symbol: str,
+) -> Tuple[bool, list]:
+    """returns klines from the local cache or from binance, only calling
+    binance once for concurrent requests of the same klines"""
+    if KLINES_PROVIDER == "price_logs":
+        return await asyncio.to_thread(call_price_logs_for_klines, query)
+
+    # cache files are small, reading them inline is cheaper than handing
+    # them over to a thread.
+    ok, klines = read_from_local_cache(f_path, symbol)
+    if ok:
+        return (ok, klines)
+
+    if f_path in INFLIGHT:
+        logging.info(f"waiting on in-flight lookup for {f_path}")
+        return await asyncio.shield(INFLIGHT[f_path])
+
+    flight: asyncio.Future = asyncio.get_running_loop().create_future()
+    INFLIGHT[f_path] = flight
+    try:
+        ok, klines = await call_binance_for_klines(session, query)
+        if ok:
+            await asyncio.to_thread(
+                save_binance_klines, query, f_path, klines, mode, symbol
+            )
+    except Exception as err:  # pylint: disable=broad-except
+        logging.critical(err)
+        ok, klines = (False, [])
+    finally:
+        # always release any waiters, even if we got cancelled
+        del INFLIGHT[f_path]
+        flight.set_result((ok, klines))
+    return (ok, klines)
+
+
+async def load_klines_for_coin(
+    session: aiohttp.ClientSession, symbol: str, date: int, mode: str
+) -> Dict:
+    """fetches from binance or a local cache klines for a coin"""
+    values = empty_values()
+
+    # the m, h, d lookups are independent of each other, so we run them
+    # concurrently and only assemble the response once all have completed.
+    queries = klines_queries(symbol, date)
+    results = await asyncio.gather(
+        *[
+            fetch_klines(session, query, f_path, mode, symbol)
+            for _, query, f_path in queries
+        ]
+    )
+    for (unit, _, _), (ok, klines) in zip(queries, results):
+        if ok:
+            add_klines_to_values(values, unit, klines)
+
+    if KLINES_SHARED_MEMORY_DIR:
+        await asyncio.to_thread(share_klines, symbol, date, values)
+    return values
+
+
+async def klines_for_coin(request: web.Request) -> web.Response:
+    """returns the klines for a single coin"""
+    symbol = request.query["symbol"]
+    date = int(float(request.query["date"]))
+    mode = request.query["mode"]
+
+    values = await load_klines_for_coin(
+        request.app["session"], symbol, date, mode
+    )
+    if wants_binary(request.headers.get("Accept", "")):
+        return web.Response(
+            body=encode_klines(values), content_type=KLINES_BINARY
+        )
+    return web.json_response(values)
+
+
+async def klines_for_coins(request: web.Request) -> web.StreamResponse:
+    """returns the klines for a list of [symbol, date] pairs, streamed back
+    as one json document per line in the same order as requested"""
+    body = await request.json()
+    mode = body["mode"]
+    binary = wants_binary(request.headers.get("Accept", ""))
+
+    response = web.StreamResponse(
+        headers={"Content-Type": KLINES_BINARY_STREAM if binary else NDJSON}
+    )
+    await response.prepare(request)
+    for symbol, date in body["coins"]:
+        values = await load_klines_for_coin(
+            request.app["session"], symbol, int(float(date)), mode
+        )
+        if binary:
+            await response.write(encode_klines_frame(symbol, date, values))
+            continue
+        await response.write(
+            (
+                json.dumps({"symbol": symbol, "date": date, "klines": values})
+                + "\n"
+            ).encode()
+        )
+    await response.write_eof()
+    return response
+
+
+async def binance_session(_app: web.Application):
+    """shares a single http connection pool to binance across requests"""
+    _app["session"] = aiohttp.ClientSession()
+    yield
+    await _app["session"].close()
+
+
+def make_app() -> web.Application:
+    """returns the aiohttp application"""
+    _app = web.Application()
+    _app.cleanup_ctx.append(binance_session)
+    _app.router.add_get("/", klines_for_coin)
+    _app.router.add_post("/batch", klines_for_coins)
+    return _app
+
+
+app = make_app()
+
+
+if __name__ == "__main__":
+    web.run_app(app, host="0.0.0.0", port=8999)
@@ -4,12 +4,14 @@ import hashlib
 import json
 import logging
 import pprint
+import queue
+import threading
 from datetime import datetime
 from functools import lru_cache
-from os import fsync, unlink, rename
+from os import fsync, makedirs, unlink, rename
 from os.path import basename, exists
 from time import sleep
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 import requests
 import udatetime
@@ -24,14 +26,41 @@ from lib.helpers import (
     add_100,
     c_date_from,
     c_from_timestamp,
+    LEVERAGED_TOKENS,
     floor_value,
+    is_leveraged_token,
     mean,
     percent,
 )
+from lib.klines_codec import (
+    KLINES_BINARY,
+    KLINES_BINARY_STREAM,
+    decode_klines,
+    decode_klines_frames,
+    read_shared_klines,
+    shared_klines_path,
+)
+from lib.price_log_cache import (
+    ParsedPriceLog,
+    evict,
+    is_fresh,
+    read_cached,
+    read_cached_header,
+    read_parsed,
+    validators,
+    version_of,
+    write_cached,
+    write_parsed,
+)
+from lib.results_store import make_result, save_result, store_path
 
 rate = RequestRate(600, Duration.MINUTE)  # 600 requests per minute
 limiter = Limiter(rate)
 
+# ask the klines_caching_service for packed float64 klines, older services
+# which don't know about them will keep answering with json.
+KLINES_ACCEPT = f"{KLINES_BINARY}, application/json;q=0.9"
+
 
 def get_ticker_with_default(tickers, symbol, key) -> str:
     """returns ticker values with default if symbol doesn't exist"""
@@ -163,6 +192,13 @@ class Bot:
         # coins, those remain in our wallet.
         # Mostly used for quitting a backtesting session early
         self.stop_bot_on_stale: bool = config.get("STOP_BOT_ON_STALE", False)
+        # stops a backtesting run as soon as it has more LOSSES or STALES
+        # than these, as prove-backtesting discards those runs anyway.
+        # -1 disables the check.
+        self.max_losses: int = int(config.get("MAX_LOSSES", -1))
+        self.max_stales: int = int(config.get("MAX_STALES", -1))
+        # the reason a backtesting run was stopped early, if it was
+        self.cut_off: str = ""
         # indicates where we found a control/STOP flag file
         self.stop_flag: bool = False
         # set by the bot so to quit safely as soon as possible.
@@ -185,8 +221,26 @@ class Bot:
         self.klines_caching_service_url: str = config.get(
             "KLINES_CACHING_SERVICE_URL", "http://klines:8999"
         )
+        # directory where a co-located klines_caching_service publishes the
+        # klines it serves, see KLINES_SHARED_MEMORY_DIR
+        self.klines_shared_memory_dir: str = config.get(
+            "KLINES_SHARED_MEMORY_DIR", ""
+        )
         # price.log service
         self.price_log_service: str = config["PRICE_LOG_SERVICE_URL"]
+        # local directory where downloaded price logs are kept, so that
+        # backtesting runs over the same days don't download them again
+        self.price_log_cache_dir: str = config.get("PRICE_LOG_CACHE_DIR", "")
+        self.price_log_cache_size: int = int(
+            config.get("PRICE_LOG_CACHE_SIZE", 10 * 1024**3)
+        )
+        if self.price_log_cache_dir:
+            makedirs(self.price_log_cache_dir, exist_ok=True)
+        # how many price logs to download ahead while backtesting
+        self.price_log_prefetch: int = int(config.get("PRICE_LOG_PREFETCH", 2))
+        # klines fetched in bulk from the klines_caching_service, waiting to
+        # be consumed by load_klines_for_coin() as each coin is initialised
+        self.prefetched_klines: Dict[Tuple[str, float], Dict[str, Any]] = {}
 
     def extract_order_data(
         self, order_details: dict[str, Any], coin: Coin
@@ -865,8 +919,29 @@ class Bot:
 
     def process_coins(self) -> None:
         """processes all the prices returned by binance"""
+        binance_prices = self.get_binance_prices()
+
+        # initialise all coins we haven't seen before in one go, so that we
+        # can fetch their klines in a single request. At startup this is
+        # every single coin in binance.
+        new_coins: List[str] = []
+        if self.mode in ["live", "backtesting", "testnet"]:
+            for binance_data in binance_prices:
+                coin_symbol = binance_data["symbol"]
+                if not coin_symbol.endswith(self.pairing):
+                    continue
+                if coin_symbol in self.coins or coin_symbol in new_coins:
+                    continue
+                self.init_or_update_coin(binance_data, load_klines=False)
+                new_coins.append(coin_symbol)
+            self.prefetch_klines_for_coins(
+                [(symbol, self.coins[symbol].date) for symbol in new_coins]
+            )
+            for symbol in new_coins:
+                self.load_klines_for_coin(self.coins[symbol])
+
         # look for coins that are ready for buying, or selling
-        for binance_data in self.get_binance_prices():
+        for binance_data in binance_prices:
             coin_symbol = binance_data["symbol"]
             price = binance_data["price"]
 
@@ -883,7 +958,11 @@ class Bot:
 
             # TODO: revisit this as the function below expects to process all
             # the coins
-            self.init_or_update_coin(binance_data)
+            if coin_symbol in new_coins:
+                # initialised above, we already have its latest price
+                new_coins.remove(coin_symbol)
+            else:
+                self.init_or_update_coin(binance_data)
 
             # if a coin has been blocked due to a stop_loss, we want to make
             # sure we reset the coin stats for the duration of the ban and
@@ -960,9 +1039,29 @@ class Bot:
             if self.stop_bot_on_loss:
                 # STOP_BOT_ON_LOSS is set, set a STOP flag to stop the bot
                 self.quit = True
+                self.cut_off = "STOP_BOT_ON_LOSS"
+            self.check_cut_off()
             return True
         return False
 
+    def check_cut_off(self) -> None:
+        """stops a backtesting run that can no longer meet its MAX_LOSSES or
+        MAX_STALES"""
+        if self.mode != "backtesting" or self.cut_off:
+            return
+        for kind, count, limit in [
+            ("LOSSES", self.losses, self.max_losses),
+            ("STALES", self.stales, self.max_stales),
+        ]:
+            if 0 <= limit < count:
+                logging.info(
+                    f"stopping backtesting, {kind.lower()}:{count} "
+                    + f"over MAX_{kind}:{limit}"
+                )
+                self.cut_off = f"MAX_{kind}"
+                self.quit = True
+                return
+
     def coin_gone_up_and_dropped(self, coin: Coin) -> bool:
         """checks for a possible drop in price in a coin we hold"""
         # when we have reached the TARGET_SELL and a coin drops in price
@@ -1045,6 +1144,8 @@ class Bot:
             if self.stop_bot_on_stale:
                 # STOP_BOT_ON_STALE is set, set a STOP flag to stop the bot
                 self.quit = True
+                self.cut_off = "STOP_BOT_ON_STALE"
+            self.check_cut_off()
             return True
         return False
 
@@ -1611,13 +1712,7 @@ class Bot:
                 return
 
             # discard any BULL/BEAR tokens
-            if any(
-                f"{w}{self.cfg['PAIRING']}" in symbol
-                for w in ["UP", "DOWN", "BULL", "BEAR"]
-            ) or any(
-                f"{self.cfg['PAIRING']}{w}" in symbol
-                for w in ["UP", "DOWN", "BULL", "BEAR"]
-            ):
+            if is_leveraged_token(symbol, self.cfg["PAIRING"]):
                 return
             self.coins[symbol] = Coin(
                 symbol,
@@ -1710,7 +1805,7 @@ class Bot:
 
         else:
             with requests.Session() as session:
-                for logfile in self.cfg["PRICE_LOGS"]:
+                for logfile, response in self.fetch_price_logs(session):
                     if self.quit:
                         break
                     for w, v in [
@@ -1720,25 +1815,19 @@ class Bot:
                     ]:
                         logging.info(f"{w} {v}")
 
-                    response: Tuple[bool, List[bytes]] = self.get_price_log(
-                        session,
-                        f"{self.cfg['PRICE_LOG_SERVICE_URL']}/{logfile}",
-                    )
-                    ok, lines = response
+                    ok, price_log = response
 
                     if ok:
-                        for item in lines:
-                            line: str = item.decode()
-                            if self.cfg["PAIRING"] not in line:
+                        symbols, dates, prices = price_log
+                        self.prefetch_klines_for_new_coins(symbols, dates)
+                        for symbol, date, market_price in zip(
+                            symbols, dates, prices
+                        ):
+                            if self.cfg["PAIRING"] not in symbol:
                                 continue
-                            symbol, date, market_price = self.split_logline(
-                                str(line)
-                            )
-                            # symbol will be False if we fail to process the line fields
-                            if not symbol:
-                                continue
-
                             self.process_line(symbol, date, market_price)
+                        # drop any klines we prefetched but never consumed
+                        self.prefetched_klines = {}
 
                     current_exposure = float(0)
                     for symbol in self.wallet:
@@ -1755,6 +1844,7 @@ class Bot:
                         "losses": self.losses,
                         "stales": self.stales,
                         "wallet": self.wallet,
+                        "cut_off": self.cut_off,
                         "config_filename": basename(self.config_file),
                         "cfg": self.cfg,
                     }
@@ -1780,6 +1870,25 @@ class Bot:
 
             f.write(f"{log_entry}\n")
 
+        # and the prove-backtesting coin runs into the results store, for
+        # prove-backtesting and best_runs.py. Forwardtesting and optimized
+        # runs carry no RESULTS_TAGS and are kept out of it.
+        if self.cfg.get("RESULTS_TAGS"):
+            save_result(
+                store_path(self.logs_dir),
+                make_result(
+                    basename(self.config_file),
+                    self.cfg,
+                    days=len(self.price_logs),
+                    wins=self.wins,
+                    losses=self.losses,
+                    stales=self.stales,
+                    holds=len(self.wallet),
+                    profit=float(f"{self.profit + current_exposure:.3f}"),
+                    cut_off=self.cut_off,
+                ),
+            )
+
         with open(
             f"tmp/{basename(self.config_file)}.results.json",
             "wt",
@@ -1796,20 +1905,38 @@ class Bot:
 
         ok: bool = False
         try:
-            # fetch all the available klines for this coin, for the last
-            # 60min, 24h, and 1000 days
-            logging.debug(
-                f"calling klines_caching_service_url for {coin.symbol}"
-            )
-            response: requests.Response = requests.get(
-                self.klines_caching_service_url
-                + f"?symbol={coin.symbol}"
-                + f"&date={coin.date}"
-                + f"&mode={self.mode}"
-                + f"&debug={self.debug}",
-                timeout=30,
-            )
-            data: Dict[str, Dict[str, List[List[float]]]] = response.json()
+            # use the klines from a previous bulk request if we have them
+            data: Dict[
+                str, Dict[str, List[List[float]]]
+            ] = self.prefetched_klines.pop((coin.symbol, coin.date), {})
+            if not data and self.klines_shared_memory_dir:
+                # or from the ones a co-located klines_caching_service has
+                # already published for this coin
+                data = (
+                    read_shared_klines(
+                        self.klines_shared_memory_dir, coin.symbol, coin.date
+                    )
+                    or {}
+                )
+            if not data:
+                # fetch all the available klines for this coin, for the last
+                # 60min, 24h, and 1000 days
+                logging.debug(
+                    f"calling klines_caching_service_url for {coin.symbol}"
+                )
+                response: requests.Response = requests.get(
+                    self.klines_caching_service_url
+                    + f"?symbol={coin.symbol}"
+                    + f"&date={coin.date}"
+                    + f"&mode={self.mode}"
+                    + f"&debug={self.debug}",
+                    headers={"Accept": KLINES_ACCEPT},
+                    timeout=30,
+                )
+                if response.headers.get("Content-Type") == KLINES_BINARY:
+                    data = decode_klines(response.content)
+                else:
+                    data = response.json()
             if data:
                 logging.debug("klines_caching_service_url reponse: ok")
                 coin.lowest = data["lowest"]
@@ -1824,6 +1951,76 @@ class Bot:
             logging.debug(f"Exception: {error_msg}")
         return ok
 
+    def prefetch_klines_for_coins(
+        self, coins: List[Tuple[str, float]]
+    ) -> None:
+        """fetches klines for a list of (symbol, date) in a single request"""
+
+        # instead of issuing one request per coin as we initialise them, we
+        # ask the klines_caching_service for all of them at once. The results
+        # are kept in prefetched_klines until load_klines_for_coin() consumes
+        # them. Any coin we fail to prefetch here will be fetched on its own.
+        if self.klines_shared_memory_dir:
+            # no need to ask for the klines we can read from shared memory
+            coins = [
+                (symbol, date)
+                for symbol, date in coins
+                if not exists(
+                    shared_klines_path(
+                        self.klines_shared_memory_dir, symbol, date
+                    )
+                )
+            ]
+        if not coins:
+            return
+        try:
+            logging.debug(
+                f"calling klines_caching_service_url for {len(coins)} coins"
+            )
+            with requests.post(
+                self.klines_caching_service_url.rstrip("/") + "/batch",
+                json={"mode": self.mode, "coins": coins},
+                headers={"Accept": KLINES_ACCEPT},
+                timeout=30,
+                stream=True,
+            ) as response:
+                response.raise_for_status()
+                content_type = response.headers.get("Content-Type")
+                if content_type == KLINES_BINARY_STREAM:
+                    for symbol, date, klines in decode_klines_frames(
+                        response.content
+                    ):
+                        self.prefetched_klines[(symbol, date)] = klines
+                    return
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    item: Dict[str, Any] = json.loads(line)
+                    self.prefetched_klines[
+                        (item["symbol"], item["date"])
+                    ] = item["klines"]
+        except Exception as error_msg:  # pylint: disable=broad-except
+            logging.warning(
+                f"Error calling klines_caching_service for {len(coins)} coins"
+            )
+            logging.debug(f"Exception: {error_msg}")
+
+    def prefetch_klines_for_new_coins(
+        self, symbols: List[str], dates: List[float]
+    ) -> None:
+        """bulk fetches the klines for all new coins in a parsed price.log"""
+        new_coins: Dict[str, float] = {}
+        for symbol, date in zip(symbols, dates):
+            if symbol in self.coins or symbol in new_coins:
+                continue
+            if not symbol.endswith(self.pairing):
+                continue
+            # process_line() discards these, so we won't need their klines
+            if is_leveraged_token(symbol, self.pairing):
+                continue
+            new_coins[symbol] = date
+        self.prefetch_klines_for_coins(list(new_coins.items()))
+
     @retry(wait=wait_exponential(multiplier=1, max=3))
     def requests_with_backoff(
         self, session: requests.Session, query: str
@@ -1899,6 +2096,8 @@ class Bot:
             f"wins:{self.wins} losses:{self.losses} "
             + f"stales:{self.stales} holds:{len(self.wallet)}"
         )
+        if self.cut_off:
+            logging.info(f"stopped early on {self.cut_off}")
 
     def print_current_balance_report(self) -> None:
         """calculates and current balance"""
@@ -2311,20 +2510,192 @@ class Bot:
             return True
         return False
 
+    def fetch_price_logs(
+        self, session: requests.Session
+    ) -> Iterator[Tuple[str, Tuple[bool, ParsedPriceLog]]]:
+        """yields each of the PRICE_LOGS in order, as (logfile, response).
+        The next PRICE_LOG_PREFETCH price logs are downloaded and parsed on a
+        background thread while we backtest the current one."""
+        if self.price_log_prefetch < 1:
+            for logfile in self.price_logs:
+                yield (
+                    logfile,
+                    self.get_parsed_price_log(
+                        session, f"{self.price_log_service}/{logfile}"
+                    ),
+                )
+            return
+
+        # bounded, so that we never hold more than PRICE_LOG_PREFETCH
+        # downloaded price logs in memory, plus the one we are backtesting
+        # and the one being downloaded.
+        fetched: queue.Queue = queue.Queue(maxsize=self.price_log_prefetch)
+        stop: threading.Event = threading.Event()
+
+        def fetcher() -> None:
+            for logfile in self.price_logs:
+                try:
+                    item: Any = (
+                        logfile,
+                        self.get_parsed_price_log(
+                            session, f"{self.price_log_service}/{logfile}"
+                        ),
+                    )
+                except Exception as error:  # pylint: disable=broad-except
+                    # hand it over to be raised in the main thread
+                    item = error
+                while not stop.is_set():
+                    try:
+                        fetched.put(item, timeout=1)
+                        break
+                    except queue.Full:
+                        continue
+                if stop.is_set() or isinstance(item, Exception):
+                    return
+
+        thread: threading.Thread = threading.Thread(
+            target=fetcher, daemon=True
+        )
+        thread.start()
+        try:
+            for _ in self.price_logs:
+                item = fetched.get()
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # release the fetcher if we stopped early, such as on a
+            # STOP_BOT_ON_LOSS
+            stop.set()
+            thread.join()
+
+    def parse_lines(self, lines: List[bytes]) -> ParsedPriceLog:
+        """splits the lines of a price log into symbols, dates and prices,
+        for the coins of our PAIRING only"""
+        symbols: List[str] = []
+        dates: List[float] = []
+        prices: List[float] = []
+        pairing: bytes = self.pairing.encode()
+        # the BULL/BEAR tokens process_line() would discard, the symbol is
+        # the only part of a line with any letters in it.
+        leveraged: List[bytes] = [
+            token.encode()
+            for w in LEVERAGED_TOKENS
+            for token in [f"{w}{self.pairing}", f"{self.pairing}{w}"]
+        ]
+        for item in lines:
+            # splitting a line is much slower than looking into it, so we
+            # discard the lines of any other coins first.
+            if pairing not in item or any(t in item for t in leveraged):
+                continue
+            symbol, date, market_price = self.split_logline(item.decode())
+            # symbol will be False if we fail to process the line fields
+            if not symbol:
+                continue
+            symbols.append(symbol)
+            dates.append(date)
+            prices.append(market_price)
+        return (symbols, dates, prices)
+
+    def get_parsed_price_log(
+        self, session: requests.Session, query: str
+    ) -> Tuple[bool, ParsedPriceLog]:
+        """downloads and parses a price log. With a PRICE_LOG_CACHE_DIR, the
+        parsed price log is kept next to the cached price log, and reused for
+        as long as the price log doesn't change."""
+        if self.price_log_cache_dir:
+            header = read_cached_header(self.price_log_cache_dir, query)
+            if header is not None and is_fresh(header):
+                parsed = read_parsed(
+                    self.price_log_cache_dir,
+                    query,
+                    version_of(header),
+                    self.pairing,
+                )
+                if parsed is not None:
+                    return (True, parsed)
+
+        ok, lines = self.get_price_log(session, query)
+        if not ok:
+            return (False, ([], [], []))
+        if not self.price_log_cache_dir:
+            return (True, self.parse_lines(lines))
+
+        # the price log might have been revalidated, and not changed
+        header = read_cached_header(self.price_log_cache_dir, query)
+        version: str = version_of(header) if header else ""
+        if version:
+            parsed = read_parsed(
+                self.price_log_cache_dir, query, version, self.pairing
+            )
+            if parsed is not None:
+                return (True, parsed)
+
+        price_log: ParsedPriceLog = self.parse_lines(lines)
+        if version:
+            try:
+                write_parsed(
+                    self.price_log_cache_dir,
+                    query,
+                    version,
+                    self.pairing,
+                    price_log,
+                )
+            except OSError as error:
+                logging.warning(f"failed to cache parsed {query}: {error}")
+        return (True, price_log)
+
+    def cache_price_log(
+        self,
+        query: str,
+        response: requests.Response,
+        contents: bytes,
+        previous: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        """saves a downloaded price log in the PRICE_LOG_CACHE_DIR"""
+        try:
+            write_cached(
+                self.price_log_cache_dir,
+                query,
+                response.headers,
+                contents,
+                previous,
+            )
+            evict(self.price_log_cache_dir, self.price_log_cache_size)
+        except OSError as error:
+            # the cache is only an optimisation, carry on without it
+            logging.warning(f"failed to cache {query}: {error}")
+
     def get_price_log(
         self, session: requests.Session, query: str
     ) -> Tuple[bool, List[bytes]]:
         """retry wrapper for requests calls"""
 
+        cached: Optional[Tuple[Dict[str, Any], bytes]] = None
+        headers: Dict[str, str] = {}
+        if self.price_log_cache_dir:
+            cached = read_cached(self.price_log_cache_dir, query)
+            if cached is not None:
+                if is_fresh(cached[0]):
+                    return (True, cached[1].splitlines())
+                headers = validators(cached[0])
+
         for w in [1, 2, 3, 4]:
             try:
-                response: requests.Response = session.get(query, timeout=30)
+                response: requests.Response = session.get(
+                    query, headers=headers, timeout=30
+                )
                 status: int = response.status_code
+                if status == 304 and cached is not None:
+                    self.cache_price_log(query, response, cached[1], cached[0])
+                    return (True, cached[1].splitlines())
                 if status == 404:
                     return (False, [])
                 if status != 200:
                     response.raise_for_status()
                 else:
+                    if self.price_log_cache_dir:
+                        self.cache_price_log(query, response, response.content)
                     return (True, (response.content).splitlines())
 
             except requests.exceptions.RequestException as e:
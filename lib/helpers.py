@@ -44,6 +44,19 @@ def c_from_timestamp(date: float) -> datetime:
     return datetime.fromtimestamp(date)
 
 
+# the leveraged tokens, such as BTCUPUSDT, which the bot doesn't trade
+LEVERAGED_TOKENS: list[str] = ["UP", "DOWN", "BULL", "BEAR"]
+
+
+@lru_cache(4096)
+def is_leveraged_token(symbol: str, pairing: str) -> bool:
+    """checks if a symbol is one of the UP/DOWN/BULL/BEAR tokens"""
+    return any(
+        f"{w}{pairing}" in symbol or f"{pairing}{w}" in symbol
+        for w in LEVERAGED_TOKENS
+    )
+
+
 @retry(wait=wait_fixed(2), stop=stop_after_delay(10))
 def cached_binance_client(access_key: str, secret_key: str) -> Client:
     """retry wrapper for binance client first call"""
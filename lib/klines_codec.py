@@ -0,0 +1,180 @@
+""" binary encoding of klines between the klines_caching_service and Bot """
+import mmap
+import struct
+import os
+import threading
+from os import getpid, replace
+from time import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+
+# content-type used when the client asks for binary encoded klines
+KLINES_BINARY: str = "application/x-cryptobot-klines"
+# content-type used by the /batch endpoint for a stream of binary klines
+KLINES_BINARY_STREAM: str = "application/x-cryptobot-klines-stream"
+
+METRICS: List[str] = ["lowest", "averages", "highest"]
+UNITS: List[str] = ["m", "h", "d", "s"]
+
+# a klines blob is a small header followed by raw little-endian float64
+# [date, value] pairs, one array per metric and unit:
+#
+#   b"KLN1" | uint32 rows for each of the 12 metric/unit pairs |
+#   float64 lowest[m] ... float64 highest[s]
+MAGIC: bytes = b"KLN1"
+HEADER: struct.Struct = struct.Struct(f"<4s{len(METRICS) * len(UNITS)}I")
+# each frame in a batch stream is prefixed by the coin date, the size of its
+# klines blob and the length of the coin symbol which follows.
+FRAME: struct.Struct = struct.Struct("<dIH")
+# how old a temporary klines blob gets before we take it as left behind by a
+# writer that died, rather than one still being written
+TMP_BLOB_AGE: float = 60
+
+
+def wants_binary(accept: str) -> bool:
+    """checks if an Accept header asks for binary encoded klines"""
+    return KLINES_BINARY in accept
+
+
+def encode_klines(values: Dict[str, Dict[str, Any]]) -> bytes:
+    """encodes a {metric: {unit: [[date, value], ...]}} dict"""
+    arrays: List[np.ndarray] = []
+    for metric in METRICS:
+        for unit in UNITS:
+            arrays.append(
+                np.asarray(
+                    values.get(metric, {}).get(unit, []), dtype="<f8"
+                ).reshape(-1, 2)
+            )
+    header: bytes = HEADER.pack(MAGIC, *[len(a) for a in arrays])
+    return header + b"".join(a.tobytes() for a in arrays)
+
+
+def decode_klines(
+    data: Union[bytes, memoryview, mmap.mmap]
+) -> Dict[str, Dict[str, List[List[float]]]]:
+    """decodes a klines blob into {metric: {unit: [[date, value], ...]}}"""
+    magic, *rows = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError(f"not a klines blob: {bytes(magic)!r}")
+
+    floats: np.ndarray = np.frombuffer(
+        data, dtype="<f8", count=sum(rows) * 2, offset=HEADER.size
+    )
+    values: Dict[str, Dict[str, List[List[float]]]] = {}
+    offset: int = 0
+    for metric in METRICS:
+        values[metric] = {}
+        for unit in UNITS:
+            count: int = rows.pop(0) * 2
+            values[metric][unit] = (
+                floats[offset : offset + count].reshape(-1, 2).tolist()
+            )
+            offset = offset + count
+    return values
+
+
+def encode_klines_frame(
+    symbol: str, date: float, values: Dict[str, Dict[str, Any]]
+) -> bytes:
+    """encodes the klines for a coin as a frame of a batch stream"""
+    blob: bytes = encode_klines(values)
+    name: bytes = symbol.encode()
+    return FRAME.pack(float(date), len(blob), len(name)) + name + blob
+
+
+def decode_klines_frames(
+    data: bytes,
+) -> Iterator[Tuple[str, float, Dict[str, Dict[str, List[List[float]]]]]]:
+    """decodes a batch stream into (symbol, date, klines) tuples"""
+    view: memoryview = memoryview(data)
+    offset: int = 0
+    while offset < len(view):
+        date, size, length = FRAME.unpack_from(view, offset)
+        offset = offset + FRAME.size
+        symbol: str = bytes(view[offset : offset + length]).decode()
+        offset = offset + length
+        yield (symbol, date, decode_klines(view[offset : offset + size]))
+        offset = offset + size
+
+
+def shared_klines_path(directory: str, symbol: str, date: float) -> str:
+    """returns the path of the shared klines blob for a coin"""
+    return f"{directory}/{symbol}.{int(date)}.klines"
+
+
+def publish_klines(
+    directory: str, symbol: str, date: float, values: Dict[str, Dict[str, Any]]
+) -> bool:
+    """publishes the klines for a coin into a shared directory, typically on
+    /dev/shm, for any co-located Bot to read them from. A coin already
+    published is left as it is, only its mtime is refreshed so that
+    prune_shared_klines() evicts the least recently served coins first.
+    Returns whether a new blob was written."""
+    path: str = shared_klines_path(directory, symbol, date)
+    try:
+        os.utime(path)
+        return False
+    except FileNotFoundError:
+        pass
+    # write to a temporary file first and rename it into place, so that
+    # readers never map a partially written blob.
+    tmp_path: str = f"{path}.{getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(encode_klines(values))
+    replace(tmp_path, path)
+    return True
+
+
+def prune_shared_klines(directory: str, max_size: int) -> int:
+    """removes the least recently published or served klines blobs from a
+    shared directory until they take under max_size bytes, along with any
+    temporary blobs left behind. Returns how many blobs were removed."""
+    blobs: List[Tuple[float, int, str]] = []
+    now: float = time()
+    removed: int = 0
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    f_stat: os.stat_result = entry.stat()
+                    if entry.name.endswith(".klines"):
+                        blobs.append(
+                            (f_stat.st_mtime, f_stat.st_size, entry.path)
+                        )
+                    elif (
+                        entry.name.endswith(".tmp")
+                        and f_stat.st_mtime < now - TMP_BLOB_AGE
+                    ):
+                        os.remove(entry.path)
+                except FileNotFoundError:
+                    # removed by another service process pruning as well
+                    continue
+    except FileNotFoundError:
+        return 0
+
+    total: int = sum(size for _, size, _ in blobs)
+    for _, size, path in sorted(blobs):
+        if total <= max_size:
+            break
+        try:
+            # Bots which have it mapped keep reading it until they unmap it
+            os.remove(path)
+            removed = removed + 1
+        except FileNotFoundError:
+            pass
+        total = total - size
+    return removed
+
+
+def read_shared_klines(
+    directory: str, symbol: str, date: float
+) -> Optional[Dict[str, Dict[str, List[List[float]]]]]:
+    """maps and decodes the shared klines blob for a coin, if there is one"""
+    try:
+        with open(shared_klines_path(directory, symbol, date), "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as blob:
+                return decode_klines(blob)
+    except (OSError, ValueError, struct.error):
+        return None
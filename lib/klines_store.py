@@ -0,0 +1,93 @@
+""" per-symbol sqlite stores for the klines_caching_service cache/ files """
+import sqlite3
+from os.path import exists
+from time import time
+from typing import Iterable, List, Optional, Tuple
+
+CACHE_DIR: str = "cache"
+
+# how stale the access time of an entry gets before we update it on a read,
+# so that reads don't turn into writes every time.
+ATIME_RESOLUTION: float = 3600
+
+
+def store_path(symbol: str) -> str:
+    """returns the path of the sqlite store for a symbol"""
+    return f"{CACHE_DIR}/{symbol}/{symbol}.sqlite"
+
+
+def connect(symbol: str) -> sqlite3.Connection:
+    """opens, or creates, the sqlite store for a symbol"""
+    conn: sqlite3.Connection = sqlite3.connect(store_path(symbol), timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS klines ("
+        + "f_path TEXT PRIMARY KEY, klines TEXT NOT NULL, atime REAL NOT NULL"
+        + ")"
+    )
+    return conn
+
+
+def read_from_store(symbol: str, f_path: str) -> Optional[str]:
+    """returns the json klines for a cache file compacted into the symbol
+    store, or None if we don't have them"""
+    if not exists(store_path(symbol)):
+        return None
+    conn: sqlite3.Connection = connect(symbol)
+    try:
+        row: Optional[Tuple[str, float]] = conn.execute(
+            "SELECT klines, atime FROM klines WHERE f_path = ?", (f_path,)
+        ).fetchone()
+        if row is None:
+            return None
+        klines, atime = row
+        now: float = time()
+        if atime < now - ATIME_RESOLUTION:
+            with conn:
+                conn.execute(
+                    "UPDATE klines SET atime = ? WHERE f_path = ?",
+                    (now, f_path),
+                )
+        return klines
+    finally:
+        conn.close()
+
+
+def write_to_store(
+    symbol: str, entries: Iterable[Tuple[str, str, float]]
+) -> None:
+    """saves a list of (f_path, json klines, atime) into the symbol store"""
+    conn: sqlite3.Connection = connect(symbol)
+    try:
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO klines (f_path, klines, atime) "
+                + "VALUES (?, ?, ?)",
+                entries,
+            )
+    finally:
+        conn.close()
+
+
+def list_store(symbol: str) -> List[Tuple[str, int, float]]:
+    """returns the (f_path, size, atime) of every entry in the symbol store"""
+    conn: sqlite3.Connection = connect(symbol)
+    try:
+        return conn.execute(
+            "SELECT f_path, length(klines), atime FROM klines"
+        ).fetchall()
+    finally:
+        conn.close()
+
+
+def delete_from_store(symbol: str, f_paths: Iterable[str]) -> None:
+    """removes entries from the symbol store, and reclaims their space"""
+    conn: sqlite3.Connection = connect(symbol)
+    try:
+        with conn:
+            conn.executemany(
+                "DELETE FROM klines WHERE f_path = ?", [(f,) for f in f_paths]
+            )
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
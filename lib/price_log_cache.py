@@ -0,0 +1,231 @@
+""" local on-disk cache of the price logs downloaded by the Bot """
+import hashlib
+import json
+from os import replace, scandir, unlink, utime
+from tempfile import NamedTemporaryFile
+from time import time
+from typing import IO, Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+# every cached price log is a single file, holding a json header line with
+# the url, ETag, Last-Modified and expiry of the price log, followed by the
+# price log itself, already decompressed.
+SUFFIX: str = ".plog"
+# the symbols, dates and prices of a PAIRING parsed out of a cached price
+# log, saved as numpy arrays tagged with the ETag/Last-Modified of the price
+# log they came from.
+PARSED_SUFFIX: str = ".npz"
+# files being written, renamed into place once complete
+TMP_SUFFIX: str = ".tmp"
+# how old a temporary file gets before evict() takes it as left behind by a
+# Bot that died while writing it, rather than one still being written
+STALE_TMP_AGE: float = 3600
+
+# (symbols, dates, prices) of every line in a price log
+ParsedPriceLog = Tuple[List[str], List[float], List[float]]
+
+
+def cache_path(cache_dir: str, url: str) -> str:
+    """returns the path of the cached copy of a price log url"""
+    return f"{cache_dir}/{hashlib.md5(url.encode()).hexdigest()}{SUFFIX}"
+
+
+def parsed_path(cache_dir: str, url: str, pairing: str) -> str:
+    """returns the path of the parsed copy of a price log url, for the coins
+    of a pairing"""
+    return cache_path(cache_dir, url).replace(
+        SUFFIX, f".{pairing}{PARSED_SUFFIX}"
+    )
+
+
+def read_cached_header(cache_dir: str, url: str) -> Optional[Dict[str, Any]]:
+    """returns the header of a cached price log, without its contents"""
+    try:
+        with open(cache_path(cache_dir, url), "rb") as f:
+            header: Dict[str, Any] = json.loads(f.readline())
+    except (OSError, ValueError):
+        return None
+    if header.get("url") != url:
+        return None
+    return header
+
+
+def version_of(header: Dict[str, Any]) -> str:
+    """returns what identifies the contents of a cached price log, or an
+    empty string when the price-log-service gave us nothing to go by"""
+    if not (header.get("etag") or header.get("last_modified")):
+        return ""
+    return f"{header.get('etag')}|{header.get('last_modified')}"
+
+
+def write_into_place(
+    cache_dir: str, f_path: str, write: Callable[[IO[bytes]], Any]
+) -> None:
+    """writes a file into a temporary file, and renames it into place, so
+    that concurrent Bots never read a partial file. The temporary file is
+    removed if either fails."""
+    with NamedTemporaryFile(
+        dir=cache_dir, suffix=TMP_SUFFIX, delete=False
+    ) as f:
+        try:
+            write(f)
+        except BaseException:
+            f.close()
+            unlink(f.name)
+            raise
+    try:
+        replace(f.name, f_path)
+    except BaseException:
+        unlink(f.name)
+        raise
+
+
+def read_parsed(
+    cache_dir: str, url: str, version: str, pairing: str
+) -> Optional[ParsedPriceLog]:
+    """returns the parsed price log for this version of a price log and
+    pairing, or None if we don't have it"""
+    f_path: str = parsed_path(cache_dir, url, pairing)
+    try:
+        with np.load(f_path, allow_pickle=False) as parsed:
+            if str(parsed["version"]) != version:
+                return None
+            names: List[str] = np.asarray(parsed["names"]).tolist()
+            symbols: List[str] = [
+                names[i] for i in np.asarray(parsed["symbols"]).tolist()
+            ]
+            dates: List[float] = np.asarray(parsed["dates"]).tolist()
+            prices: List[float] = np.asarray(parsed["prices"]).tolist()
+        utime(f_path)
+    except (OSError, ValueError, KeyError):
+        return None
+    return (symbols, dates, prices)
+
+
+def write_parsed(
+    cache_dir: str,
+    url: str,
+    version: str,
+    pairing: str,
+    price_log: ParsedPriceLog,
+) -> None:
+    """saves a parsed price log of a pairing, tagged with the version it was
+    parsed from"""
+    symbols, dates, prices = price_log
+    names: Dict[str, int] = {}
+    for symbol in symbols:
+        names.setdefault(symbol, len(names))
+    write_into_place(
+        cache_dir,
+        parsed_path(cache_dir, url, pairing),
+        lambda f: np.savez(
+            f,
+            version=np.array(version),
+            names=np.array(list(names.keys()), dtype=str),
+            symbols=np.array([names[s] for s in symbols], dtype=np.int32),
+            dates=np.array(dates, dtype=np.float64),
+            prices=np.array(prices, dtype=np.float64),
+        ),
+    )
+
+
+def read_cached(
+    cache_dir: str, url: str
+) -> Optional[Tuple[Dict[str, Any], bytes]]:
+    """returns the (header, contents) of a cached price log, or None"""
+    f_path: str = cache_path(cache_dir, url)
+    try:
+        with open(f_path, "rb") as f:
+            header: Dict[str, Any] = json.loads(f.readline())
+            contents: bytes = f.read()
+        # mark it as recently used, for evict()
+        utime(f_path)
+    except (OSError, ValueError):
+        # a missing file, or one evicted while we were reading it
+        return None
+    if header.get("url") != url:
+        return None
+    return (header, contents)
+
+
+def is_fresh(header: Dict[str, Any]) -> bool:
+    """checks if a cached price log can be used without revalidating it"""
+    return float(header.get("expires", 0)) > time()
+
+
+def validators(header: Dict[str, Any]) -> Dict[str, str]:
+    """returns the conditional request headers for a cached price log"""
+    headers: Dict[str, str] = {}
+    if header.get("etag"):
+        headers["If-None-Match"] = header["etag"]
+    if header.get("last_modified"):
+        headers["If-Modified-Since"] = header["last_modified"]
+    return headers
+
+
+def max_age(cache_control: str) -> int:
+    """returns the max-age of a Cache-Control header"""
+    for directive in cache_control.split(","):
+        name, _, value = directive.strip().partition("=")
+        if name == "max-age" and value.isdigit():
+            return int(value)
+    return 0
+
+
+def write_cached(
+    cache_dir: str,
+    url: str,
+    headers: Any,
+    contents: bytes,
+    previous: Optional[Dict[str, Any]] = None,
+) -> None:
+    """saves a price log with the validators from its response headers, or
+    from its previous header when revalidated by a 304 without them.
+    Written to a temporary file and renamed into place, so that concurrent
+    Bots never read a partial price log."""
+    previous = previous or {}
+    header: Dict[str, Any] = {
+        "url": url,
+        "etag": headers.get("ETag", previous.get("etag", "")),
+        "last_modified": headers.get(
+            "Last-Modified", previous.get("last_modified", "")
+        ),
+        "expires": time() + max_age(headers.get("Cache-Control", "")),
+    }
+    write_into_place(
+        cache_dir,
+        cache_path(cache_dir, url),
+        lambda f: f.write(json.dumps(header).encode() + b"\n" + contents),
+    )
+
+
+def evict(cache_dir: str, max_bytes: int) -> None:
+    """removes the temporary files left behind by Bots that died while
+    writing them, then the least recently used price logs, and parsed price
+    logs, until we are within max_bytes"""
+    entries: List[Tuple[float, int, str]] = []
+    for entry in scandir(cache_dir):
+        if entry.name.endswith(TMP_SUFFIX):
+            try:
+                if entry.stat().st_mtime < time() - STALE_TMP_AGE:
+                    unlink(entry.path)
+            except OSError:
+                pass
+        elif entry.name.endswith((SUFFIX, PARSED_SUFFIX)):
+            try:
+                f_stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((f_stat.st_mtime, f_stat.st_size, entry.path))
+
+    total: int = sum(e[1] for e in entries)
+    for _, size, f_path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            unlink(f_path)
+        except OSError:
+            # another Bot got to it first
+            pass
+        total = total - size
@@ -0,0 +1,157 @@
+""" sqlite index of the price logs in the log/ dir, from which we write the
+index.json.gz and index_v2.json.gz files """
+import gzip
+import json
+import os
+import sqlite3
+from typing import Dict, Iterable, List, Set, Tuple
+
+# kept next to the price logs it indexes
+INDEX_NAME: str = "index.sqlite"
+
+
+def index_path(log_dir: str) -> str:
+    """returns the path of the price log index in a log dir"""
+    return f"{log_dir}/{INDEX_NAME}"
+
+
+def connect(f_path: str) -> sqlite3.Connection:
+    """opens, or creates, a price log index"""
+    conn: sqlite3.Connection = sqlite3.connect(f_path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    # the DATE.log.gz price logs with all the coins
+    conn.execute("CREATE TABLE IF NOT EXISTS days (date TEXT PRIMARY KEY)")
+    # the SYMBOL/DATE.log.gz price logs of each coin
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS logs ("
+        + "symbol TEXT NOT NULL, "
+        + "log TEXT NOT NULL, "
+        + "date TEXT NOT NULL, "
+        + "PRIMARY KEY (symbol, log)"
+        + ")"
+    )
+    return conn
+
+
+def scan_log_dir(log_dir: str) -> Tuple[Set[str], Set[Tuple[str, str]]]:
+    """returns the dates of every DATE.log.gz and the (symbol, log) of every
+    SYMBOL/DATE.log.gz found in the log dir"""
+    days: Set[str] = set()
+    logs: Set[Tuple[str, str]] = set()
+    with os.scandir(log_dir) as entries:
+        for entry in entries:
+            if (
+                entry.is_file()
+                and entry.name.startswith("20")
+                and entry.name.endswith(".log.gz")
+            ):
+                days.add(entry.name.split(".")[0])
+            elif entry.is_dir():
+                with os.scandir(entry.path) as symbol_logs:
+                    for symbol_log in symbol_logs:
+                        if symbol_log.is_file():
+                            logs.add((entry.name, symbol_log.name))
+    return (days, logs)
+
+
+def unindexed_logs(
+    conn: sqlite3.Connection, log_dir: str, days_written: Set[str]
+) -> Tuple[Set[str], Set[Tuple[str, str]]]:
+    """returns the dates of the DATE.log.gz and the (symbol, log) of their
+    SYMBOL/DATE.log.gz in the log dir which are missing from the index, as
+    left behind by a run that died before indexing them, other than the
+    days being indexed with the price logs written for them"""
+    indexed: Set[str] = days_written | {
+        date for (date,) in conn.execute("SELECT date FROM days")
+    }
+    days: Set[str] = set()
+    symbols: List[str] = []
+    with os.scandir(log_dir) as entries:
+        for entry in entries:
+            if (
+                entry.is_file()
+                and entry.name.startswith("20")
+                and entry.name.endswith(".log.gz")
+                and entry.name.split(".")[0] not in indexed
+            ):
+                days.add(entry.name.split(".")[0])
+            elif entry.is_dir():
+                symbols.append(entry.name)
+    logs: Set[Tuple[str, str]] = {
+        (symbol, f"{day}.log.gz")
+        for day in days
+        for symbol in symbols
+        if os.path.isfile(f"{log_dir}/{symbol}/{day}.log.gz")
+    }
+    return (days, logs)
+
+
+def update_index(
+    log_dir: str,
+    days: Iterable[str],
+    logs: Iterable[Tuple[str, str]],
+    rebuild: bool = False,
+) -> None:
+    """adds the dates and (symbol, log) price logs written in the log dir to
+    its index, along with any DATE.log.gz missing from it. The first time,
+    or when asked to rebuild, the whole log dir is scanned instead."""
+    f_path: str = index_path(log_dir)
+    if rebuild or not os.path.exists(f_path):
+        if os.path.exists(f_path):
+            os.remove(f_path)
+        days, logs = scan_log_dir(log_dir)
+
+    conn: sqlite3.Connection = connect(f_path)
+    try:
+        days = set(days)
+        missing_days, missing_logs = unindexed_logs(conn, log_dir, days)
+        with conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO days (date) VALUES (?)",
+                [(date,) for date in days | missing_days],
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO logs (symbol, log, date) "
+                + "VALUES (?, ?, ?)",
+                [
+                    (symbol, log, log.split(".")[0])
+                    for symbol, log in set(logs) | missing_logs
+                ],
+            )
+    finally:
+        conn.close()
+
+
+def read_index(log_dir: str) -> Dict[str, Dict[str, List[str]]]:
+    """returns the index_v2 of the log dir, as
+    {"DATES": {date: [coins]}, "COINS": {coin: [logs]}}"""
+    conn: sqlite3.Connection = connect(index_path(log_dir))
+    try:
+        index: Dict[str, Dict[str, List[str]]] = {"DATES": {}, "COINS": {}}
+        for (date,) in conn.execute("SELECT date FROM days ORDER BY date"):
+            index["DATES"][date] = []
+        for symbol, log, date in conn.execute(
+            "SELECT symbol, log, date FROM logs ORDER BY symbol, log"
+        ):
+            index["DATES"].setdefault(date, []).append(symbol)
+            index["COINS"].setdefault(symbol, []).append(log)
+        index["DATES"] = dict(sorted(index["DATES"].items()))
+        return index
+    finally:
+        conn.close()
+
+
+def write_json_gz(f_path: str, contents: Dict) -> None:
+    """writes a .json.gz file, replacing any existing one only when done so
+    that it is never served half written"""
+    with gzip.open(f"{f_path}.tmp", "wt", encoding="utf-8") as f:
+        f.write(json.dumps(contents, indent=4))
+    os.replace(f"{f_path}.tmp", f_path)
+
+
+def write_index_files(log_dir: str) -> None:
+    """writes the index.json.gz (v1, {date: [coins]}) and index_v2.json.gz
+    files of the log dir from its index"""
+    index: Dict[str, Dict[str, List[str]]] = read_index(log_dir)
+    write_json_gz(f"{log_dir}/index.json.gz", index["DATES"])
+    write_json_gz(f"{log_dir}/index_v2.json.gz", index)
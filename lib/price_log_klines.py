@@ -0,0 +1,205 @@
+""" builds binance klines out of the local log/SYMBOL/DATE.log.gz files """
+import gzip
+import json
+import threading
+from datetime import datetime, timedelta
+from functools import lru_cache
+from os import getpid, listdir, makedirs, replace
+from os.path import exists, getmtime
+from time import time
+from typing import Dict, List, Optional, Tuple
+
+LOG_DIR: str = "log"
+CACHE_DIR: str = "cache"
+
+# size in seconds of the m, h klines, these are aligned to the unix epoch
+# just like the binance ones. Daily klines are built from each daily price
+# log instead.
+UNIT_SECONDS: Dict[str, int] = {"m": 60, "h": 3600}
+
+
+def kline(
+    open_time: float, low: float, avg: float, high: float, close_time: float
+) -> list:
+    """returns a binance kline list, with only the open, high, low, close
+    and the open and close times populated"""
+    return [
+        int(open_time * 1000),
+        str(avg),
+        str(high),
+        str(low),
+        str(avg),
+        "0",
+        int(close_time * 1000) - 1,
+        "0",
+        0,
+        "0",
+        "0",
+        "0",
+    ]
+
+
+def day_start(day: str) -> float:
+    """returns the unix time a daily price log starts at"""
+    return datetime.strptime(day, "%Y%m%d").timestamp()
+
+
+def day_end(day: str) -> float:
+    """returns the unix time a daily price log ends at"""
+    return (datetime.strptime(day, "%Y%m%d") + timedelta(days=1)).timestamp()
+
+
+def read_price_log(symbol: str, day: str) -> List[Tuple[float, float]]:
+    """returns the [(date, price)] from a symbol daily price log"""
+    path: str = f"{LOG_DIR}/{symbol}/{day}.log.gz"
+    if not exists(path):
+        return []
+    return _read_price_log(path, getmtime(path))
+
+
+@lru_cache(256)
+def _read_price_log(path: str, _mtime: float) -> List[Tuple[float, float]]:
+    """reads a price log, cached for as long as the file doesn't change"""
+    prices: List[Tuple[float, float]] = []
+    with gzip.open(path, "rt") as f:
+        for line in f:
+            try:
+                day, hours, _, price = line.split(" ")
+                # like the bot, discard the microseconds
+                date: float = datetime.fromisoformat(
+                    f"{day} {hours[0:8]}"
+                ).timestamp()
+                prices.append((date, float(price)))
+            except ValueError:
+                continue
+    return prices
+
+
+def klines_from_prices(
+    prices: List[Tuple[float, float]],
+    seconds: int,
+    end_time: float,
+    limit: int,
+) -> List[list]:
+    """aggregates a sorted [(date, price)] into the last 'limit' klines of
+    'seconds' each, opened on or before end_time"""
+    last: int = int(end_time // seconds)
+    first: int = last - limit + 1
+
+    buckets: Dict[int, List[float]] = {}
+    previous: Optional[float] = None
+    for date, price in prices:
+        if date > end_time:
+            break
+        bucket: int = int(date // seconds)
+        if bucket < first:
+            previous = price
+            continue
+        buckets.setdefault(bucket, []).append(price)
+
+    # price logs only record a line when the price moves, so any gaps are
+    # filled with the last price we have seen.
+    klines: List[list] = []
+    for bucket in range(first, last + 1):
+        if bucket in buckets:
+            values: List[float] = buckets[bucket]
+            avg: float = sum(values) / len(values)
+            low, high = (min(values), max(values))
+            previous = values[-1]
+        elif previous is not None:
+            low, avg, high = (previous, previous, previous)
+        else:
+            # the coin wasn't listed yet
+            continue
+        klines.append(
+            kline(bucket * seconds, low, avg, high, (bucket + 1) * seconds)
+        )
+    return klines
+
+
+def summarise_price_log(symbol: str, day: str) -> Optional[List[float]]:
+    """returns the [low, avg, high] of a daily price log"""
+    prices: List[float] = [p for _, p in read_price_log(symbol, day)]
+    if not prices:
+        return None
+    return [min(prices), sum(prices) / len(prices), max(prices)]
+
+
+def daily_summary(symbol: str) -> Dict[str, List[float]]:
+    """returns the {day: [low, avg, high]} of all the symbol price logs,
+    summarising and saving any days not yet in cache/SYMBOL/SYMBOL.daily.json
+    """
+    path: str = f"{CACHE_DIR}/{symbol}/{symbol}.daily.json"
+    summary: Dict[str, List[float]] = {}
+    if exists(path):
+        summary = dict(_read_daily_summary(path, getmtime(path)))
+
+    changed: bool = False
+    for logfile in sorted(listdir(f"{LOG_DIR}/{symbol}")):
+        if not logfile.endswith(".log.gz"):
+            continue
+        day: str = logfile.split(".")[0]
+        # today's price log is still being written to
+        if day in summary or day_end(day) > time():
+            continue
+        values: Optional[List[float]] = summarise_price_log(symbol, day)
+        if values:
+            summary[day] = values
+            changed = True
+
+    if changed:
+        makedirs(f"{CACHE_DIR}/{symbol}", exist_ok=True)
+        tmp_path: str = f"{path}.{getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(json.dumps(summary))
+        replace(tmp_path, path)
+    return summary
+
+
+@lru_cache(256)
+def _read_daily_summary(path: str, _mtime: float) -> Dict[str, List[float]]:
+    """reads a daily summary, cached for as long as the file doesn't change"""
+    with open(path) as f:
+        return json.load(f)
+
+
+def klines_for(symbol: str, end_time: float, unit: str, limit: int) -> list:
+    """returns the last 'limit' klines in 'unit' opened on or before end_time
+    for a symbol, as binance would return them"""
+    if not exists(f"{LOG_DIR}/{symbol}"):
+        return []
+
+    if unit in UNIT_SECONDS:
+        seconds: int = UNIT_SECONDS[unit]
+        # read enough daily price logs to cover the klines window, plus the
+        # day before to find the price we start from
+        start: datetime = datetime.fromtimestamp(
+            end_time - seconds * limit
+        ) - timedelta(days=1)
+        prices: List[Tuple[float, float]] = []
+        for n in range((datetime.fromtimestamp(end_time) - start).days + 2):
+            day: str = (start + timedelta(days=n)).strftime("%Y%m%d")
+            prices.extend(read_price_log(symbol, day))
+        return klines_from_prices(prices, seconds, end_time, limit)
+
+    klines: List[list] = []
+    for day, (low, avg, high) in sorted(daily_summary(symbol).items()):
+        if day_end(day) <= end_time:
+            klines.append(kline(day_start(day), low, avg, high, day_end(day)))
+
+    # and the day end_time falls in, up to end_time
+    today: str = datetime.fromtimestamp(end_time).strftime("%Y%m%d")
+    partial: List[float] = [
+        p for d, p in read_price_log(symbol, today) if d <= end_time
+    ]
+    if partial:
+        klines.append(
+            kline(
+                day_start(today),
+                min(partial),
+                sum(partial) / len(partial),
+                max(partial),
+                day_end(today),
+            )
+        )
+    return klines[-limit:]
@@ -0,0 +1,229 @@
+""" sqlite store of the results of every backtesting run """
+import hashlib
+import json
+import sqlite3
+from os.path import basename
+from time import time
+from typing import Any, Dict, List, Optional
+
+# kept next to the backtesting.log in the bot logs dir
+STORE_NAME: str = "backtesting.sqlite"
+
+# the columns of a result, as saved by the bot
+COLUMNS: List[str] = [
+    "session",
+    "run",
+    "window",
+    "config",
+    "coin",
+    "strategy",
+    "days",
+    "wins",
+    "losses",
+    "stales",
+    "holds",
+    "profit",
+    "cut_off",
+    "ticker",
+    "cfg_hash",
+    "created",
+]
+
+# what sets apart the configs of the coin backtesting runs of a window, these
+# are kept in the ticker, session, run and window of each result, while the
+# rest of the config is kept once in the configs table.
+PER_RESULT_KEYS: List[str] = ["TICKERS", "RESULTS_TAGS"]
+
+
+def store_path(logs_dir: str) -> str:
+    """returns the path of the results store in a logs dir"""
+    return f"{logs_dir}/{STORE_NAME}"
+
+
+def connect(f_path: str) -> sqlite3.Connection:
+    """opens, or creates, a results store"""
+    conn: sqlite3.Connection = sqlite3.connect(f_path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS results ("
+        + "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+        + "session TEXT NOT NULL DEFAULT '', "
+        + "run TEXT NOT NULL DEFAULT '', "
+        + "window TEXT NOT NULL DEFAULT '', "
+        + "config TEXT NOT NULL, "
+        + "coin TEXT NOT NULL DEFAULT '', "
+        + "strategy TEXT NOT NULL DEFAULT '', "
+        + "days INTEGER NOT NULL, "
+        + "wins INTEGER NOT NULL, "
+        + "losses INTEGER NOT NULL, "
+        + "stales INTEGER NOT NULL, "
+        + "holds INTEGER NOT NULL, "
+        + "profit REAL NOT NULL, "
+        + "cut_off TEXT NOT NULL DEFAULT '', "
+        + "ticker TEXT NOT NULL, "
+        + "cfg_hash TEXT NOT NULL, "
+        + "created REAL NOT NULL"
+        + ")"
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS configs ("
+        + "cfg_hash TEXT PRIMARY KEY, cfg TEXT NOT NULL"
+        + ")"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS results_by_window "
+        + "ON results (session, window, coin, profit)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS results_by_coin "
+        + "ON results (coin, profit)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS results_by_cfg ON results (cfg_hash)"
+    )
+    return conn
+
+
+def make_result(
+    config: str, cfg: Dict[str, Any], **stats: Any
+) -> Dict[str, Any]:
+    """returns the row for the results of a backtesting run of a config,
+    tagged with its prove-backtesting RESULTS_TAGS, along with the rest of
+    the config as "cfg" """
+    tags: Dict[str, str] = cfg.get("RESULTS_TAGS", {})
+    tickers: Dict[str, Any] = dict(cfg.get("TICKERS", {}))
+    # coin backtesting runs have a single ticker, other configs are
+    # recorded without a coin and with all their tickers
+    coin: str = list(tickers)[0] if len(tickers) == 1 else ""
+    shared_cfg: Dict[str, Any] = {
+        k: v for k, v in cfg.items() if k not in PER_RESULT_KEYS
+    }
+    if "PRICE_LOGS" in cfg:
+        # coin runs read their SYMBOL/DATE.log.gz price logs, which are the
+        # same DATE.log.gz for every coin of a window
+        shared_cfg["PRICE_LOGS"] = [basename(p) for p in cfg["PRICE_LOGS"]]
+    shared: str = json.dumps(shared_cfg, sort_keys=True)
+    return {
+        "session": str(tags.get("SESSION", "")),
+        "run": str(tags.get("RUN", "")),
+        "window": str(tags.get("WINDOW", "")),
+        "config": config,
+        "coin": coin,
+        "strategy": cfg.get("STRATEGY", ""),
+        "ticker": json.dumps(tickers[coin] if coin else tickers),
+        "cfg": shared,
+        "cfg_hash": hashlib.md5(shared.encode()).hexdigest(),  # nosec
+        "created": time(),
+        "cut_off": "",
+        **stats,
+    }
+
+
+def save_result(f_path: str, result: Dict[str, Any]) -> None:
+    """adds a result to a results store"""
+    conn: sqlite3.Connection = connect(f_path)
+    try:
+        with conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO configs (cfg_hash, cfg) VALUES (?, ?)",
+                (result["cfg_hash"], result["cfg"]),
+            )
+            conn.execute(
+                f"INSERT INTO results ({', '.join(COLUMNS)}) "
+                + f"VALUES ({', '.join(['?'] * len(COLUMNS))})",
+                [result[c] for c in COLUMNS],
+            )
+    finally:
+        conn.close()
+
+
+def last_result(f_path: str, config: str) -> Optional[Dict[str, Any]]:
+    """returns the most recent result of a config, with its "cfg" """
+    conn: sqlite3.Connection = connect(f_path)
+    try:
+        row: Optional[sqlite3.Row] = conn.execute(
+            f"SELECT {', '.join('results.' + c for c in COLUMNS)}, cfg "
+            + "FROM results JOIN configs USING (cfg_hash) "
+            + "WHERE config = ? ORDER BY id DESC LIMIT 1",
+            (config,),
+        ).fetchone()
+        return dict(row) if row is not None else None
+    finally:
+        conn.close()
+
+
+def best_per_coin(
+    f_path: str, criteria: Dict[str, Any], **tags: str
+) -> List[Dict[str, Any]]:
+    """returns the most profitable result of every coin meeting the
+    MIN_WINS, MIN_PROFIT, MAX_LOSSES, MAX_STALES and MAX_HOLDS criteria,
+    restricted to the session, run or window given as tags, ordered by
+    wins and then by when the coin first met the criteria.
+    Ties in profit go to the earliest result."""
+    where: List[str] = [
+        "coin != ''",
+        "session != ''",
+        "wins >= :MIN_WINS",
+        "profit >= :MIN_PROFIT",
+        "losses <= :MAX_LOSSES",
+        "stales <= :MAX_STALES",
+        "holds <= :MAX_HOLDS",
+    ]
+    for tag in tags:
+        if tag not in ["session", "run", "window"]:
+            raise ValueError(f"unknown tag: {tag}")
+        where.append(f"{tag} = :{tag}")
+    if criteria.get("FILTER_BY"):
+        where.append("instr(config, :FILTER_BY) > 0")
+
+    conn: sqlite3.Connection = connect(f_path)
+    try:
+        rows: List[sqlite3.Row] = conn.execute(
+            "SELECT * FROM ("
+            + f"SELECT {', '.join(COLUMNS)}, "
+            + "ROW_NUMBER() OVER ("
+            + "PARTITION BY coin ORDER BY profit DESC, id ASC"
+            + ") AS rank, "
+            + "MIN(id) OVER (PARTITION BY coin) AS first_id "
+            + f"FROM results WHERE {' AND '.join(where)}"
+            + ") WHERE rank = 1 ORDER BY wins ASC, first_id ASC",
+            {
+                "MIN_WINS": 0,
+                "MIN_PROFIT": float("-inf"),
+                "MAX_LOSSES": 2**62,
+                "MAX_STALES": 2**62,
+                "MAX_HOLDS": 2**62,
+                **criteria,
+                **tags,
+            },
+        ).fetchall()
+        return [dict(row) for row in rows]
+    finally:
+        conn.close()
+
+
+def prune_sessions(f_path: str, keep: int) -> int:
+    """removes the results of all but the most recent keep sessions, and
+    the configs only those results used. Returns how many results were
+    removed."""
+    conn: sqlite3.Connection = connect(f_path)
+    try:
+        with conn:
+            removed: int = conn.execute(
+                "DELETE FROM results WHERE session NOT IN ("
+                + "SELECT session FROM results GROUP BY session "
+                + "ORDER BY MAX(created) DESC LIMIT ?"
+                + ")",
+                (keep,),
+            ).rowcount
+            conn.execute(
+                "DELETE FROM configs WHERE cfg_hash NOT IN ("
+                + "SELECT DISTINCT cfg_hash FROM results"
+                + ")"
+            )
+        # hand the space back to the filesystem
+        conn.execute("VACUUM")
+        return removed
+    finally:
+        conn.close()
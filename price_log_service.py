@@ -1,13 +1,339 @@
 """ price_log_service.py """
-from flask import send_from_directory, Flask
+import gzip
+import heapq
+import zlib
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timezone
+from functools import lru_cache
+from hashlib import md5
+from os.path import basename, exists, getmtime
+from typing import Any, BinaryIO, Iterator, List, Optional, Tuple
+
+from flask import Flask, Response, abort, request, send_from_directory
+from werkzeug.security import safe_join
+
+LOG_DIR: str = "log"
+
+# past daily price logs never change, so clients can hold on to them, while
+# today's price log, and the index files, are still being written to.
+PAST_LOGS_MAX_AGE: int = 86400
+
+# how far apart, in bytes of a compressed price log, we keep a copy of the
+# state of its decompressor, so that queries on a part of a .gz price log
+# start decompressing near that part instead of from its first byte.
+SEEK_POINT_SPACING: int = 1024 * 1024
+# how much of a compressed price log we read at a time
+CHUNK_SIZE: int = 64 * 1024
 
 app: Flask = Flask(__name__)
 
 
+def max_age_for(path: str) -> int:
+    """returns how long clients can cache a price log for"""
+    day: str = basename(path).split(".")[0]
+    if day.isdigit() and day < datetime.now().strftime("%Y%m%d"):
+        return PAST_LOGS_MAX_AGE
+    return 0
+
+
+def inflate(
+    f: BinaryIO, decompressor: Any
+) -> Iterator[Tuple[bytes, int, Any]]:
+    """decompresses a gzip file from its current position, yields every
+    chunk of decompressed data along with the offset in the gzip file after
+    it and the state of the decompressor at that offset"""
+    while True:
+        data: bytes = f.read(CHUNK_SIZE)
+        if not data:
+            return
+        chunks: List[bytes] = []
+        while data:
+            chunks.append(decompressor.decompress(data))
+            data = b""
+            if decompressor.eof:
+                # the end of a gzip member, another one may follow it
+                data = decompressor.unused_data
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        yield (b"".join(chunks), f.tell(), decompressor)
+
+
+@lru_cache(256)
+def minute_offsets(
+    path: str, _mtime: float
+) -> Tuple[List[str], List[int], int, List[Tuple[int, int, Any]]]:
+    """returns the offset of the first line of every minute in a price log,
+    as ([YYYY-MM-DD HH:MM], [offset], size, seek points) in the uncompressed
+    price log. For a .gz price log the seek points are the
+    (uncompressed offset, compressed offset, decompressor) every
+    SEEK_POINT_SPACING bytes, for query_price_log to start from.
+    Cached for as long as the file doesn't change."""
+    minutes: List[str] = []
+    offsets: List[int] = []
+    seek_points: List[Tuple[int, int, Any]] = []
+    offset: int = 0
+    for line in read_lines(path, seek_points):
+        minute: str = line[0:16].decode()
+        # price logs are sorted by date
+        if not minutes or minute > minutes[-1]:
+            minutes.append(minute)
+            offsets.append(offset)
+        offset = offset + len(line)
+    return (minutes, offsets, offset, seek_points)
+
+
+def read_lines(
+    path: str, seek_points: List[Tuple[int, int, Any]]
+) -> Iterator[bytes]:
+    """yields the lines of a price log, compressed or not, adding the seek
+    points of a .gz price log as it goes"""
+    if not path.endswith(".gz"):
+        with open(path, "rb") as f:
+            yield from f
+        return
+
+    rest: bytes = b""
+    size: int = 0
+    with open(path, "rb") as f:
+        for data, at, decompressor in inflate(
+            f, zlib.decompressobj(16 + zlib.MAX_WBITS)
+        ):
+            size = size + len(data)
+            if at - (seek_points[-1][1] if seek_points else 0) >= (
+                SEEK_POINT_SPACING
+            ):
+                seek_points.append((size, at, decompressor.copy()))
+            lines: List[bytes] = (rest + data).split(b"\n")
+            rest = lines.pop()
+            for line in lines:
+                yield line + b"\n"
+    if rest:
+        yield rest
+
+
+def read_price_log(
+    path: str, seek_points: List[Tuple[int, int, Any]], start: int, end: int
+) -> bytes:
+    """returns the bytes between two offsets of an uncompressed price log,
+    a .gz price log is decompressed from the closest seek point before them"""
+    with open(path, "rb") as f:
+        if not path.endswith(".gz"):
+            f.seek(start)
+            return f.read(end - start)
+
+        offset, at, decompressor = 0, 0, None
+        for seek_point in seek_points:
+            if seek_point[0] > start:
+                break
+            offset, at, decompressor = seek_point
+        f.seek(at)
+        chunks: List[bytes] = []
+        for data, _, _ in inflate(
+            f,
+            decompressor.copy()
+            if decompressor is not None
+            else zlib.decompressobj(16 + zlib.MAX_WBITS),
+        ):
+            chunks.append(data[max(start - offset, 0) : max(end - offset, 0)])
+            offset = offset + len(data)
+            if offset >= end:
+                break
+        return b"".join(chunks)
+
+
+def open_price_log(path: str):
+    """opens a price log, compressed or not"""
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+def query_price_log(path: str, symbol: str, _from: str, _to: str) -> bytes:
+    """returns the lines in a price log for a symbol between two dates,
+    decompressing only the part of the price log covering those dates"""
+    minutes, offsets, size, seek_points = minute_offsets(path, getmtime(path))
+    # offsets of the first line of a minute, or the end of the price log
+    offsets = offsets + [size]
+    start: int = offsets[bisect_left(minutes, _from[0:16])] if _from else 0
+    end: int = offsets[bisect_right(minutes, _to[0:16])] if _to else size
+
+    chunk: bytes = read_price_log(path, seek_points, start, end)
+
+    lines: List[bytes] = []
+    from_date: bytes = _from.encode()
+    to_date: bytes = _to.encode()
+    coin: List[bytes] = [symbol.encode()]
+    for line in chunk.splitlines(keepends=True):
+        if from_date and line[0:19] < from_date:
+            continue
+        if to_date and line[0:19] >= to_date:
+            continue
+        if symbol and line.split(b" ")[2:3] != coin:
+            continue
+        lines.append(line)
+    return b"".join(lines)
+
+
+def query_etag(
+    f_path: str, symbol: str, _from: str, _to: str, encoding: str
+) -> str:
+    """returns the ETag of a query on a price log"""
+    return md5(  # nosec
+        "-".join(
+            [f_path, str(getmtime(f_path)), symbol, _from, _to, encoding]
+        ).encode()
+    ).hexdigest()
+
+
+def price_logs_to_merge(
+    log_dir: str, symbols: List[str], dates: List[str]
+) -> List[List[str]]:
+    """returns the SYMBOL/DATE.log.gz price logs we hold for each date"""
+    paths: List[List[str]] = []
+    for date in dates:
+        paths.append([])
+        for symbol in symbols:
+            f_path = safe_join(log_dir, symbol, f"{date}.log.gz")
+            if f_path is not None and exists(f_path):
+                paths[-1].append(f_path)
+    return paths
+
+
+def price_log_to_query(log_dir: str, path: str, symbol: str) -> Optional[str]:
+    """returns the price log to read for a query, or None if we don't have
+    it. A single symbol is much cheaper to read from its own price log."""
+    f_path = safe_join(log_dir, path)
+    if f_path is None or not exists(f_path):
+        return None
+    if symbol and "/" not in path:
+        symbol_path = safe_join(log_dir, symbol, path)
+        if symbol_path is not None and exists(symbol_path):
+            return symbol_path
+    return f_path
+
+
+def merge_validators(
+    paths: List[List[str]], gzipped: bool
+) -> Tuple[str, float]:
+    """returns the ETag and Last-Modified time of a merge of price logs"""
+    mtimes: List[float] = [getmtime(p) for day in paths for p in day]
+    etag: str = md5(  # nosec
+        "-".join(
+            [str(p) for p in paths] + [str(mtimes), str(gzipped)]
+        ).encode()
+    ).hexdigest()
+    return (etag, max(mtimes))
+
+
+def merge_price_logs(paths: List[str]) -> Iterator[bytes]:
+    """k-way merges a list of sorted price logs into a single stream, ordered
+    by date"""
+    price_logs = [open_price_log(path) for path in paths]
+    try:
+        yield from heapq.merge(*price_logs, key=lambda line: line[0:19])
+    finally:
+        for price_log in price_logs:
+            price_log.close()
+
+
+def in_chunks(lines: Iterator[bytes], gzipped: bool) -> Iterator[bytes]:
+    """batches lines into larger chunks, gzip compressed if asked to"""
+    compressor = zlib.compressobj(1, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    chunk: List[bytes] = []
+    size: int = 0
+    for line in lines:
+        chunk.append(line)
+        size = size + len(line)
+        if size >= 65536:
+            data: bytes = b"".join(chunk)
+            yield compressor.compress(data) if gzipped else data
+            chunk, size = ([], 0)
+    data = b"".join(chunk)
+    if gzipped:
+        yield compressor.compress(data) + compressor.flush()
+    elif data:
+        yield data
+
+
+@app.route("/merge")
+def merge():
+    """returns a single time ordered stream of the price logs of a list of
+    symbols, over a list of dates. Built by merging the SYMBOL/DATE.log.gz
+    files of each symbol, so clients don't need to download the price logs
+    for all coins.
+
+    /merge?symbols=BTCUSDT,ETHUSDT&dates=20211201,20211202
+    """
+    symbols: List[str] = [
+        s for s in request.args.get("symbols", "").split(",") if s
+    ]
+    dates: List[str] = [
+        d for d in request.args.get("dates", "").split(",") if d
+    ]
+
+    paths: List[List[str]] = price_logs_to_merge(LOG_DIR, symbols, dates)
+    if not any(paths):
+        abort(404)
+
+    def generate() -> Iterator[bytes]:
+        # dates don't overlap, so we only merge the symbols within a date
+        for day_paths in paths:
+            yield from merge_price_logs(day_paths)
+
+    gzipped: bool = "gzip" in request.headers.get("Accept-Encoding", "")
+    response: Response = Response(
+        in_chunks(generate(), gzipped), mimetype="text/plain"
+    )
+    if gzipped:
+        response.headers["Content-Encoding"] = "gzip"
+    response.vary.add("Accept-Encoding")
+
+    etag, last_modified = merge_validators(paths, gzipped)
+    response.last_modified = datetime.fromtimestamp(
+        last_modified, tz=timezone.utc
+    )
+    response.set_etag(etag)
+    response.cache_control.max_age = min(max_age_for(d) for d in dates)
+    return response.make_conditional(request)
+
+
 @app.route("/<path:path>")
 def root(path):
     """root handler"""
-    return send_from_directory("log", path)
+    symbol: str = request.args.get("symbol", "")
+    _from: str = request.args.get("from", "").replace("T", " ")
+    _to: str = request.args.get("to", "").replace("T", " ")
+
+    if not (symbol or _from or _to):
+        # werkzeug takes care of the ETag, Last-Modified, and Range headers
+        # for us, and serves the .gz files as they are with a
+        # Content-Encoding: gzip.
+        return send_from_directory(
+            LOG_DIR,
+            path,
+            conditional=True,
+            etag=True,
+            max_age=max_age_for(path),
+        )
+
+    f_path = price_log_to_query(LOG_DIR, path, symbol)
+    if f_path is None:
+        abort(404)
+
+    response: Response = Response(
+        query_price_log(f_path, symbol, _from, _to), mimetype="text/plain"
+    )
+    encoding: str = ""
+    if "gzip" in request.headers.get("Accept-Encoding", ""):
+        encoding = "gzip"
+        response.set_data(gzip.compress(response.get_data(), 1))
+        response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    response.last_modified = datetime.fromtimestamp(
+        getmtime(f_path), tz=timezone.utc
+    )
+    response.set_etag(query_etag(f_path, symbol, _from, _to, encoding))
+    response.cache_control.max_age = max_age_for(path)
+    return response.make_conditional(request, accept_ranges=True)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,232 @@
+""" asyncio variant of price_log_service, serves the log/ directory """
+import asyncio
+import gzip
+import zlib
+from collections import OrderedDict
+from os import environ, stat
+from os.path import isfile
+from typing import List, Optional, Tuple
+
+from aiohttp import web
+from werkzeug.security import safe_join
+
+from price_log_service import (
+    max_age_for,
+    merge_price_logs,
+    merge_validators,
+    price_log_to_query,
+    price_logs_to_merge,
+    query_etag,
+    query_price_log,
+)
+
+LOG_DIR: str = "log"
+
+# how much memory to use for keeping the most requested price logs around,
+# during prove-backtesting every worker requests the same window of days.
+HOT_CACHE_SIZE: int = int(
+    environ.get("PRICE_LOG_HOT_CACHE_SIZE", 512 * 1024 * 1024)
+)
+# price logs larger than this are always sent straight from disk
+HOT_FILE_MAX_SIZE: int = int(
+    environ.get("PRICE_LOG_HOT_FILE_MAX_SIZE", 64 * 1024 * 1024)
+)
+
+# backtesting clients fetch one price log after another, keep their
+# connections open in between.
+KEEPALIVE_TIMEOUT: float = 75
+
+
+class HotFiles:
+    """LRU cache of the contents of the most requested price logs"""
+
+    def __init__(self, max_size: int, max_file_size: int) -> None:
+        """init"""
+        self.max_size: int = max_size
+        self.max_file_size: int = max_file_size
+        self.size: int = 0
+        # f_path: (etag, mtime, contents)
+        self.files: OrderedDict[str, Tuple[str, float, bytes]] = OrderedDict()
+
+    async def get(self, f_path: str) -> Optional[Tuple[str, float, bytes]]:
+        """returns the (etag, mtime, contents) of a price log, reading it
+        into the cache if it fits, or None if it doesn't"""
+        f_stat = stat(f_path)
+        size: int = f_stat.st_size
+        if size > self.max_file_size or size > self.max_size:
+            return None
+
+        # same ETag as aiohttp FileResponse, so clients can revalidate
+        # against either
+        etag: str = f"{f_stat.st_mtime_ns:x}-{size:x}"
+        if f_path in self.files and self.files[f_path][0] == etag:
+            self.files.move_to_end(f_path)
+            return self.files[f_path]
+
+        def read() -> bytes:
+            with open(f_path, "rb") as f:
+                return f.read()
+
+        contents: bytes = await asyncio.to_thread(read)
+        self.remove(f_path)
+        self.files[f_path] = (etag, f_stat.st_mtime, contents)
+        self.size = self.size + len(contents)
+        while self.size > self.max_size:
+            self.remove(next(iter(self.files)))
+        return self.files[f_path]
+
+    def remove(self, f_path: str) -> None:
+        """drops a price log from the cache"""
+        if f_path in self.files:
+            self.size = self.size - len(self.files.pop(f_path)[2])
+
+
+HOT_FILES: HotFiles = HotFiles(HOT_CACHE_SIZE, HOT_FILE_MAX_SIZE)
+
+
+def not_modified(request: web.Request, etag: str) -> bool:
+    """checks the If-None-Match request header against our ETag"""
+    return any(e.value in [etag, "*"] for e in request.if_none_match or ())
+
+
+def gzip_accepted(request: web.Request) -> bool:
+    """checks if the client accepts gzip compressed responses"""
+    return "gzip" in request.headers.get("Accept-Encoding", "")
+
+
+async def price_log(request: web.Request) -> web.StreamResponse:
+    """serves a price log, or the lines of a price log matching a query"""
+    path: str = request.match_info["path"]
+    symbol: str = request.query.get("symbol", "")
+    _from: str = request.query.get("from", "").replace("T", " ")
+    _to: str = request.query.get("to", "").replace("T", " ")
+
+    if symbol or _from or _to:
+        return await query(request, path, symbol, _from, _to)
+
+    f_path = safe_join(LOG_DIR, path)
+    if f_path is None or not isfile(f_path):
+        raise web.HTTPNotFound()
+
+    headers = {"Cache-Control": f"public, max-age={max_age_for(path)}"}
+    # like werkzeug does, .gz price logs are sent as they are, with a
+    # Content-Encoding: gzip, which requests decompresses for the Bot.
+    if f_path.endswith(".gz"):
+        headers["Content-Encoding"] = "gzip"
+        headers["Content-Type"] = "text/plain"
+
+    hot = None
+    if "Range" not in request.headers:
+        hot = await HOT_FILES.get(f_path)
+    if hot is None:
+        # FileResponse uses sendfile, and handles the Range, If-None-Match
+        # and If-Modified-Since headers.
+        return web.FileResponse(f_path, headers=headers)
+
+    etag, mtime, contents = hot
+    if not_modified(request, etag):
+        response = web.Response(status=304, headers=headers)
+    else:
+        response = web.Response(body=contents, headers=headers)
+    response.etag = etag
+    response.last_modified = mtime
+    return response
+
+
+async def query(
+    request: web.Request, path: str, symbol: str, _from: str, _to: str
+) -> web.Response:
+    """returns the lines in a price log for a symbol between two dates"""
+    f_path = price_log_to_query(LOG_DIR, path, symbol)
+    if f_path is None:
+        raise web.HTTPNotFound()
+
+    encoding: str = "gzip" if gzip_accepted(request) else ""
+    etag: str = query_etag(f_path, symbol, _from, _to, encoding)
+    headers = {
+        "Cache-Control": f"public, max-age={max_age_for(path)}",
+        "Vary": "Accept-Encoding",
+    }
+    if not_modified(request, etag):
+        response = web.Response(status=304, headers=headers)
+    else:
+        body: bytes = await asyncio.to_thread(
+            query_price_log, f_path, symbol, _from, _to
+        )
+        if encoding:
+            body = await asyncio.to_thread(gzip.compress, body, 1)
+            headers["Content-Encoding"] = encoding
+        response = web.Response(
+            body=body, content_type="text/plain", headers=headers
+        )
+    response.etag = etag
+    response.last_modified = stat(f_path).st_mtime
+    return response
+
+
+def merged(paths: List[str]) -> bytes:
+    """returns the merge of a list of price logs"""
+    return b"".join(merge_price_logs(paths))
+
+
+async def merge(request: web.Request) -> web.StreamResponse:
+    """returns a single time ordered stream of the price logs of a list of
+    symbols, over a list of dates, see price_log_service.merge"""
+    symbols: List[str] = [
+        s for s in request.query.get("symbols", "").split(",") if s
+    ]
+    dates: List[str] = [
+        d for d in request.query.get("dates", "").split(",") if d
+    ]
+    paths: List[List[str]] = price_logs_to_merge(LOG_DIR, symbols, dates)
+    if not any(paths):
+        raise web.HTTPNotFound()
+
+    gzipped: bool = gzip_accepted(request)
+    etag, last_modified = merge_validators(paths, gzipped)
+    headers = {
+        "Cache-Control": "public, max-age="
+        + f"{min(max_age_for(d) for d in dates)}",
+        "Content-Type": "text/plain",
+        "Vary": "Accept-Encoding",
+    }
+    if gzipped:
+        headers["Content-Encoding"] = "gzip"
+    if not_modified(request, etag):
+        response = web.Response(status=304, headers=headers)
+        response.etag = etag
+        return response
+
+    stream = web.StreamResponse(headers=headers)
+    stream.etag = etag
+    stream.last_modified = last_modified
+    await stream.prepare(request)
+
+    compressor = zlib.compressobj(1, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for day_paths in paths:
+        # dates don't overlap, so we only merge the symbols within a date
+        data: bytes = await asyncio.to_thread(merged, day_paths)
+        if gzipped:
+            data = await asyncio.to_thread(compressor.compress, data)
+        await stream.write(data)
+    if gzipped:
+        await stream.write(compressor.flush())
+    await stream.write_eof()
+    return stream
+
+
+def make_app() -> web.Application:
+    """returns the aiohttp application"""
+    _app = web.Application()
+    _app.router.add_get("/merge", merge)
+    _app.router.add_get("/{path:.+}", price_log)
+    return _app
+
+
+app = make_app()
+
+
+if __name__ == "__main__":
+    web.run_app(
+        app, host="0.0.0.0", port=8998, keepalive_timeout=KEEPALIVE_TIMEOUT
+    )
@@ -7,6 +7,8 @@
 from datetime import datetime
 from unittest import mock
 import json
+import os
+import time
 from flaky import flaky
 
 import pytest
@@ -14,6 +16,8 @@ import app
 import lib
 import lib.bot
 import lib.coin
+import lib.klines_codec
+import lib.price_log_cache
 
 
 @pytest.fixture()
@@ -689,6 +693,77 @@ class TestBot:
         assert coin.highest["h"][0] == [1638595.3856935161, 2]
         assert coin.highest["h"][23] == [1721395.3856935161, 25]
 
+    def test_prefetch_klines_for_coins(self, bot, coin):
+        klines = {"lowest": {"m": [[1, 1]]}, "averages": {}, "highest": {}}
+        response = mock.MagicMock()
+        response.__enter__.return_value.iter_lines.return_value = [
+            json.dumps(
+                {"symbol": "BTCUSDT", "date": coin.date, "klines": klines}
+            ).encode(),
+            b"",
+        ]
+
+        with mock.patch("lib.bot.requests.post", return_value=response) as m:
+            bot.prefetch_klines_for_coins([("BTCUSDT", coin.date)])
+        assert m.call_args.kwargs["json"]["coins"] == [("BTCUSDT", coin.date)]
+
+        # load_klines_for_coin consumes the prefetched klines without
+        # calling the klines_caching_service again
+        with mock.patch("lib.bot.requests.get") as get:
+            assert bot.load_klines_for_coin(coin) is True
+        get.assert_not_called()
+        assert coin.lowest == {"m": [[1, 1]]}
+        assert not bot.prefetched_klines
+
+    def test_load_klines_for_coin_decodes_binary_klines(self, bot, coin):
+        klines = {
+            "lowest": {"m": [[1.0, 2.0]], "h": [], "d": [], "s": []},
+            "averages": {"m": [[1.0, 3.0]], "h": [], "d": [], "s": []},
+            "highest": {"m": [[1.0, 4.0]], "h": [], "d": [], "s": []},
+        }
+        response = mock.MagicMock(
+            headers={"Content-Type": lib.bot.KLINES_BINARY},
+            content=lib.klines_codec.encode_klines(klines),
+        )
+
+        with mock.patch("lib.bot.requests.get", return_value=response) as m:
+            assert bot.load_klines_for_coin(coin) is True
+        assert m.call_args.kwargs["headers"]["Accept"].startswith(
+            lib.bot.KLINES_BINARY
+        )
+        response.json.assert_not_called()
+        assert coin.lowest == klines["lowest"]
+        assert coin.highest == klines["highest"]
+
+    def test_load_klines_for_coin_from_shared_memory(
+        self, bot, coin, tmp_path
+    ):
+        klines = {
+            "lowest": {"m": [[1.0, 2.0]], "h": [], "d": [], "s": []},
+            "averages": {"m": [[1.0, 3.0]], "h": [], "d": [], "s": []},
+            "highest": {"m": [[1.0, 4.0]], "h": [], "d": [], "s": []},
+        }
+        lib.klines_codec.publish_klines(
+            str(tmp_path), coin.symbol, coin.date, klines
+        )
+        bot.klines_shared_memory_dir = str(tmp_path)
+
+        with mock.patch("lib.bot.requests.get") as get, mock.patch(
+            "lib.bot.requests.post"
+        ) as post:
+            bot.prefetch_klines_for_coins([(coin.symbol, coin.date)])
+            assert bot.load_klines_for_coin(coin) is True
+        get.assert_not_called()
+        post.assert_not_called()
+        assert coin.averages == klines["averages"]
+
+    def test_prefetch_klines_for_new_coins(self, bot):
+        symbols = ["BTCUSDT", "BTCUSDT", "ETHBTC", "BTCUPUSDT", "ETHUSDT"]
+        dates = [1.0, 2.0, 3.0, 4.0, 5.0]
+        with mock.patch.object(bot, "prefetch_klines_for_coins") as m:
+            bot.prefetch_klines_for_new_coins(symbols, dates)
+        m.assert_called_once_with([("BTCUSDT", 1.0), ("ETHUSDT", 5.0)])
+
     def test_new_listing(self, bot, coin):
         for x in list(reversed(range(3600 * 24 * 2 + 3600 + 60 + 1))):
             coin_time = float(lib.bot.udatetime.now().timestamp() - x)
@@ -841,6 +916,193 @@ class TestBot:
             assert data[0] == "001 SYMBOL 100"
             assert ok is True
 
+    def test_get_price_log_from_the_local_cache(self, bot, tmp_path):
+        bot.price_log_cache_dir = str(tmp_path)
+        session = mock.MagicMock()
+        session.get.return_value.status_code = 200
+        session.get.return_value.content = b"001 SYMBOL 100\n002 SYMBOL 101"
+        session.get.return_value.headers = {
+            "ETag": '"abc"',
+            "Cache-Control": "public, max-age=86400",
+        }
+
+        assert bot.get_price_log(session, "http://log/20211201.log.gz") == (
+            True,
+            [b"001 SYMBOL 100", b"002 SYMBOL 101"],
+        )
+        # past price logs are fresh for a day, so we don't even ask again
+        assert bot.get_price_log(session, "http://log/20211201.log.gz") == (
+            True,
+            [b"001 SYMBOL 100", b"002 SYMBOL 101"],
+        )
+        assert session.get.call_count == 1
+
+    def test_get_price_log_revalidates_the_local_cache(self, bot, tmp_path):
+        bot.price_log_cache_dir = str(tmp_path)
+        session = mock.MagicMock()
+        session.get.return_value.status_code = 200
+        session.get.return_value.content = b"001 SYMBOL 100"
+        session.get.return_value.headers = {"ETag": '"abc"'}
+        bot.get_price_log(session, "http://log/20211201.log.gz")
+
+        session.get.return_value.status_code = 304
+        session.get.return_value.content = b""
+        session.get.return_value.headers = {}
+
+        assert bot.get_price_log(session, "http://log/20211201.log.gz") == (
+            True,
+            [b"001 SYMBOL 100"],
+        )
+        assert session.get.call_args.kwargs["headers"] == {
+            "If-None-Match": '"abc"'
+        }
+
+    def test_get_price_log_cache_is_bounded(self, bot, tmp_path):
+        bot.price_log_cache_dir = str(tmp_path)
+        bot.price_log_cache_size = 200
+        session = mock.MagicMock()
+        session.get.return_value.status_code = 200
+        session.get.return_value.content = b"0" * 60
+        session.get.return_value.headers = {}
+
+        bot.get_price_log(session, "http://log/20211201.log.gz")
+        for f in tmp_path.iterdir():
+            os.utime(f, (1000, 1000))
+        bot.get_price_log(session, "http://log/20211202.log.gz")
+
+        assert [f.name for f in tmp_path.iterdir()] == [
+            lib.price_log_cache.cache_path(
+                "", "http://log/20211202.log.gz"
+            ).lstrip("/")
+        ]
+
+    def test_price_log_cache_leaves_no_temporary_files_behind(self, tmp_path):
+        with mock.patch.object(
+            lib.price_log_cache, "replace", side_effect=OSError
+        ):
+            with pytest.raises(OSError):
+                lib.price_log_cache.write_cached(
+                    str(tmp_path), "http://log/1.log.gz", {}, b"lines"
+                )
+        assert not list(tmp_path.iterdir())
+
+        # but those of a Bot which died while writing them are evicted
+        (tmp_path / "stale.tmp").touch()
+        os.utime(tmp_path / "stale.tmp", (1000, 1000))
+        (tmp_path / "writing.tmp").touch()
+        lib.price_log_cache.evict(str(tmp_path), 200)
+        assert [f.name for f in tmp_path.iterdir()] == ["writing.tmp"]
+
+    def test_fetch_price_logs_prefetches_in_order(self, bot):
+        bot.price_logs = ["1.log.gz", "2.log.gz", "3.log.gz", "4.log.gz"]
+        bot.price_log_prefetch = 1
+        fetched = []
+
+        def get_price_log(_session, query):
+            fetched.append(query)
+            if query.endswith("/2.log.gz"):
+                return (False, [])
+            return (True, [b"2021-12-01 00:00:01.000000 BTCUSDT 100.0"])
+
+        bot.get_price_log = mock.MagicMock(side_effect=get_price_log)
+        price_logs = bot.fetch_price_logs(None)
+
+        logfile, response = next(price_logs)
+        assert logfile == "1.log.gz"
+        assert response == (
+            True,
+            (
+                ["BTCUSDT"],
+                [lib.bot.c_date_from("2021-12-01 00:00:01")],
+                [100.0],
+            ),
+        )
+        # never more than one price log waiting, plus one being downloaded
+        time.sleep(0.2)
+        assert len(fetched) <= 3
+
+        assert [(f, ok) for f, (ok, _) in price_logs] == [
+            ("2.log.gz", False),
+            ("3.log.gz", True),
+            ("4.log.gz", True),
+        ]
+
+    def test_get_parsed_price_log_reuses_the_parsed_price_log(
+        self, bot, tmp_path
+    ):
+        bot.price_log_cache_dir = str(tmp_path)
+        session = mock.MagicMock()
+        session.get.return_value.status_code = 200
+        session.get.return_value.content = (
+            b"2021-12-01 00:00:01.000000 BTCUSDT 100.0\n"
+            + b"2021-12-01 00:00:02.000000 BTCUSDT rubbish\n"
+            + b"2021-12-01 00:00:03.000000 ETHBTC 0.1\n"
+            + b"2021-12-01 00:00:04.000000 BTCUPUSDT 1.0\n"
+            + b"2021-12-01 00:00:05.000000 ETHUSDT 10.0\n"
+        )
+        session.get.return_value.headers = {
+            "ETag": '"abc"',
+            "Cache-Control": "public, max-age=86400",
+        }
+        # only the coins of our PAIRING, without any BULL/BEAR tokens
+        expected = (
+            True,
+            (
+                ["BTCUSDT", "ETHUSDT"],
+                [
+                    lib.bot.c_date_from("2021-12-01 00:00:01"),
+                    lib.bot.c_date_from("2021-12-01 00:00:05"),
+                ],
+                [100.0, 10.0],
+            ),
+        )
+
+        assert bot.get_parsed_price_log(session, "http://log/1.log.gz") == (
+            expected
+        )
+        with mock.patch.object(bot, "parse_lines") as parse_lines:
+            assert bot.get_parsed_price_log(
+                session, "http://log/1.log.gz"
+            ) == (expected)
+        parse_lines.assert_not_called()
+        assert session.get.call_count == 1
+
+        # a changed price log is parsed again
+        lib.price_log_cache.write_cached(
+            str(tmp_path),
+            "http://log/1.log.gz",
+            {"ETag": '"def"'},
+            b"2021-12-01 00:00:04.000000 ETHUSDT 10.0\n",
+        )
+        session.get.return_value.status_code = 304
+        session.get.return_value.headers = {}
+        assert bot.get_parsed_price_log(session, "http://log/1.log.gz") == (
+            True,
+            (
+                ["ETHUSDT"],
+                [lib.bot.c_date_from("2021-12-01 00:00:04")],
+                [10.0],
+            ),
+        )
+
+    def test_fetch_price_logs_stops_early(self, bot):
+        bot.price_logs = [f"{n}.log.gz" for n in range(100)]
+        bot.price_log_prefetch = 2
+        bot.get_price_log = mock.MagicMock(return_value=(True, []))
+
+        for logfile, _ in bot.fetch_price_logs(None):
+            if logfile == "1.log.gz":
+                break
+
+        assert bot.get_price_log.call_count < 100
+
+    def test_fetch_price_logs_raises_fetcher_errors(self, bot):
+        bot.price_logs = ["1.log.gz", "2.log.gz"]
+        bot.get_price_log = mock.MagicMock(side_effect=OSError("disk full"))
+
+        with pytest.raises(OSError):
+            list(bot.fetch_price_logs(None))
+
     def test_place_sell_order(self, bot, coin):
         bot.extract_order_data = mock.MagicMock()
         bot.client.get_order = mock.MagicMock()
@@ -1241,6 +1503,29 @@ class TestCoinStatus:
                 assert round(bot.investment, 2) == float(19.88)
                 assert bot.losses == 1
 
+    def test_cut_off_on_max_losses_and_max_stales(self, bot):
+        bot.max_losses = 1
+        bot.max_stales = 2
+
+        bot.losses = 1
+        bot.stales = 2
+        bot.check_cut_off()
+        assert bot.quit is False
+        assert bot.cut_off == ""
+
+        bot.stales = 3
+        bot.check_cut_off()
+        assert bot.quit is True
+        assert bot.cut_off == "MAX_STALES"
+
+    def test_no_cut_off_outside_backtesting(self, bot):
+        bot.mode = "live"
+        bot.max_losses = 0
+        bot.losses = 1
+        bot.check_cut_off()
+        assert bot.quit is False
+        assert bot.cut_off == ""
+
     def test_coin_gone_up_and_dropped(self, bot, coin):
         bot.wallet = ["BTCUSDT"]
         coin.bought_at = 100
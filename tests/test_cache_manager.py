@@ -0,0 +1,96 @@
+""" pytests tests for utils/cache_manager.py """
+# pylint: disable=missing-module-docstring
+# pylint: disable=missing-class-docstring
+# pylint: disable=missing-function-docstring
+# pylint: disable=redefined-outer-name
+# pylint: disable=import-outside-toplevel
+# pylint: disable=no-self-use
+import json
+import os
+from unittest import mock
+
+import pytest
+
+import klines_caching_service as kcs
+from lib import klines_store
+from tests.test_klines_caching_service import KLINE
+from utils import cache_manager
+
+
+@pytest.fixture()
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("cache/BTCUSDT")
+    with open("cache/BTCUSDT.precision", "w") as f:
+        f.write("2")
+    for n in range(4):
+        f_path = f"BTCUSDT.{n:032x}"
+        with open(f"cache/BTCUSDT/{f_path}", "w") as f:
+            f.write(json.dumps([KLINE] * (n + 1)))
+        os.utime(f"cache/BTCUSDT/{f_path}", (1000 + n, 1000 + n))
+    yield tmp_path
+
+
+class TestCacheManager:
+    def test_compact_moves_files_into_the_symbol_store(self, cache_dir):
+        cache_manager.compact()
+
+        assert cache_manager.cache_files("BTCUSDT") == []
+        assert len(klines_store.list_store("BTCUSDT")) == 4
+        assert os.path.exists("cache/BTCUSDT.precision")
+        assert kcs.read_from_local_cache(f"BTCUSDT.{2:032x}", "BTCUSDT") == (
+            True,
+            [KLINE] * 3,
+        )
+        # reading from the store marks the klines as recently used
+        assert max(e[2] for e in klines_store.list_store("BTCUSDT")) > 1003
+
+    def test_evict_removes_least_recently_used(self, cache_dir):
+        cache_manager.evict(max_bytes=0, max_files=2, max_age=0)
+
+        assert sorted(os.listdir("cache/BTCUSDT")) == [
+            f"BTCUSDT.{2:032x}",
+            f"BTCUSDT.{3:032x}",
+        ]
+        assert os.path.exists("cache/BTCUSDT.precision")
+
+    def test_evict_from_store_and_files_by_age(self, cache_dir):
+        cache_manager.compact()
+        with open(f"cache/BTCUSDT/BTCUSDT.{9:032x}", "w") as f:
+            f.write(json.dumps([KLINE]))
+
+        cache_manager.evict(max_bytes=0, max_files=0, max_age=86400)
+
+        assert klines_store.list_store("BTCUSDT") == []
+        assert [e[3] for e in cache_manager.all_entries()] == [
+            f"BTCUSDT.{9:032x}"
+        ]
+
+    def test_temporary_klines_files_are_never_left_behind(
+        self, cache_dir, monkeypatch
+    ):
+        monkeypatch.setattr(
+            kcs, "replace", mock.MagicMock(side_effect=OSError)
+        )
+        with pytest.raises(OSError):
+            kcs.save_binance_klines(
+                "query", f"BTCUSDT.{9:032x}", [KLINE], "backtesting", "BTCUSDT"
+            )
+        assert len(os.listdir("cache/BTCUSDT")) == 4
+
+        # but those of a service which died while writing them are evicted
+        for f_path in [f"BTCUSDT.{8:032x}", f"BTCUSDT.{9:032x}"]:
+            with open(f"cache/BTCUSDT/.{f_path}.1.2.tmp", "w") as f:
+                f.write("[")
+        os.utime(f"cache/BTCUSDT/.BTCUSDT.{8:032x}.1.2.tmp", (1000, 1000))
+
+        cache_manager.evict(max_bytes=0, max_files=4, max_age=0)
+
+        assert sorted(os.listdir("cache/BTCUSDT")) == [
+            f".BTCUSDT.{9:032x}.1.2.tmp",
+        ] + [f"BTCUSDT.{n:032x}" for n in range(4)]
+
+    def test_to_bytes(self):
+        assert cache_manager.to_bytes("512") == 512
+        assert cache_manager.to_bytes("2k") == 2048
+        assert cache_manager.to_bytes("1.5G") == 1.5 * 1024**3
@@ -5,8 +5,370 @@
 # pylint: disable=redefined-outer-name
 # pylint: disable=import-outside-toplevel
 # pylint: disable=no-self-use
+import gzip
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from unittest import mock
+
+import pytest
+
+import klines_caching_service as kcs
+from lib import price_log_klines
+from lib.klines_codec import (
+    KLINES_BINARY,
+    KLINES_BINARY_STREAM,
+    decode_klines,
+    decode_klines_frames,
+    encode_klines,
+    prune_shared_klines,
+    publish_klines,
+    read_shared_klines,
+    shared_klines_path,
+)
+
+
+KLINE = [
+    1640995140000,
+    "100.0",
+    "110.0",
+    "90.0",
+    "105.0",
+    "1.0",
+    1640995199999,
+    "1.0",
+    1,
+    "1.0",
+    "1.0",
+    "0",
+]
+
+
+@pytest.fixture()
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.mkdir("cache")
+    yield tmp_path
 
 
 class TestKlinesCaching_service:
     def test_placeholder(self):
         pass
+
+
+class TestFetchKlines:
+    def test_save_binance_klines_leaves_no_temporary_files(self, cache_dir):
+        kcs.save_binance_klines(
+            "q", "BTCUSDT.md5", [KLINE], "backtesting", "BTCUSDT"
+        )
+
+        assert os.listdir("cache/BTCUSDT") == ["BTCUSDT.md5"]
+        with open("cache/BTCUSDT/BTCUSDT.md5") as f:
+            assert json.load(f) == [KLINE]
+
+    def test_concurrent_misses_call_binance_once(self, cache_dir):
+        def slow_binance_call(_):
+            time.sleep(0.2)
+            return (True, [KLINE])
+
+        results = []
+        with mock.patch.object(
+            kcs, "call_binance_for_klines", side_effect=slow_binance_call
+        ) as binance:
+            threads = [
+                threading.Thread(
+                    target=lambda: results.append(
+                        kcs.fetch_klines(
+                            "q", "BTCUSDT.md5", "backtesting", "BTCUSDT"
+                        )
+                    )
+                )
+                for _ in range(5)
+            ]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+        assert binance.call_count == 1
+        assert results == [(True, [KLINE])] * 5
+        assert not kcs.INFLIGHT
+
+    def test_cache_hit_does_not_call_binance(self, cache_dir):
+        kcs.save_binance_klines(
+            "q", "BTCUSDT.md5", [KLINE], "backtesting", "BTCUSDT"
+        )
+
+        with mock.patch.object(kcs, "call_binance_for_klines") as binance:
+            assert kcs.fetch_klines(
+                "q", "BTCUSDT.md5", "backtesting", "BTCUSDT"
+            ) == (True, [KLINE])
+        binance.assert_not_called()
+
+
+class TestBatchEndpoint:
+    def test_batch_streams_one_line_per_coin(self):
+        def fake_load(symbol, date, mode):
+            return {"lowest": {"m": [[date, 1.0]]}, "mode": mode}
+
+        client = kcs.app.test_client()
+        with mock.patch.object(
+            kcs, "load_klines_for_coin", side_effect=fake_load
+        ):
+            response = client.post(
+                "/batch",
+                json={
+                    "mode": "backtesting",
+                    "coins": [["BTCUSDT", 1.5], ["ETHUSDT", 2.0]],
+                },
+            )
+            # results are streamed, so consume them while still mocked
+            lines = [json.loads(x) for x in response.data.splitlines()]
+
+        assert response.mimetype == kcs.NDJSON
+        assert [(x["symbol"], x["date"]) for x in lines] == [
+            ("BTCUSDT", 1.5),
+            ("ETHUSDT", 2.0),
+        ]
+        assert lines[0]["klines"] == {
+            "lowest": {"m": [[1, 1.0]]},
+            "mode": "backtesting",
+        }
+
+
+class TestConcurrentUnits:
+    def test_units_are_fetched_concurrently(self, cache_dir):
+        def slow_binance_call(_):
+            time.sleep(0.3)
+            return (True, [KLINE])
+
+        with mock.patch.object(
+            kcs, "call_binance_for_klines", side_effect=slow_binance_call
+        ) as binance:
+            start = time.time()
+            values = kcs.load_klines_for_coin(
+                "BTCUSDT", 1640995200, "backtesting"
+            )
+            elapsed = time.time() - start
+
+        assert binance.call_count == 3
+        # three lookups of 0.3s each, run concurrently
+        assert elapsed < 0.6
+        for unit in ["m", "h", "d"]:
+            assert len(values["averages"][unit]) == 1
+
+    def test_binance_ban_blocks_other_requests(self):
+        banned = mock.MagicMock(status_code=418, headers={"Retry-After": "0"})
+        banned.raise_for_status.side_effect = kcs.requests.HTTPError()
+        ok = mock.MagicMock(status_code=200)
+
+        with mock.patch.object(
+            kcs.requests, "get", side_effect=[banned, ok]
+        ) as get, mock.patch.object(kcs, "BACKOFF_UNTIL", {"binance": 0.0}):
+            assert kcs.requests_with_backoff("q") is ok
+            assert kcs.BACKOFF_UNTIL["binance"] > 0
+        assert get.call_count == 2
+
+
+class TestPopulateValues:
+    def test_populate_values_keeps_last_timeslice(self):
+        klines = []
+        for n in range(1200):
+            kline = list(KLINE)
+            kline[2] = str(110.0 + n)
+            kline[3] = str(90.0 + n)
+            kline[6] = KLINE[6] + n * 86400000
+            klines.append(kline)
+
+        ok, values = kcs.populate_values(klines, "d")
+
+        assert ok is True
+        for metric in ["lowest", "averages", "highest"]:
+            assert len(values[metric]) == 1000
+        assert values["lowest"][0] == [1640995199.999 + 200 * 86400, 290.0]
+        assert values["averages"][-1] == [
+            1640995199.999 + 1199 * 86400,
+            1299.0,
+        ]
+        assert values["highest"][-1] == [
+            1640995199.999 + 1199 * 86400,
+            1309.0,
+        ]
+
+    def test_populate_values_with_no_klines(self):
+        assert kcs.populate_values([], "m") == (
+            True,
+            {"lowest": [], "averages": [], "highest": []},
+        )
+
+
+class TestBinaryKlines:
+    def test_klines_survive_a_binary_round_trip(self):
+        values = kcs.empty_values()
+        kcs.add_klines_to_values(values, "m", [KLINE, KLINE])
+
+        assert decode_klines(encode_klines(values)) == values
+
+    def test_klines_are_json_unless_binary_is_accepted(self):
+        values = kcs.empty_values()
+        kcs.add_klines_to_values(values, "d", [KLINE])
+
+        client = kcs.app.test_client()
+        with mock.patch.object(
+            kcs, "load_klines_for_coin", return_value=values
+        ):
+            default = client.get(
+                "/?symbol=BTCUSDT&date=1&mode=backtesting",
+                headers={"Accept": "*/*"},
+            )
+            binary = client.get(
+                "/?symbol=BTCUSDT&date=1&mode=backtesting",
+                headers={"Accept": f"{KLINES_BINARY}, application/json"},
+            )
+
+        assert default.mimetype == "application/json"
+        assert default.get_json() == values
+        assert binary.mimetype == KLINES_BINARY
+        assert decode_klines(binary.data) == values
+
+    def test_batch_streams_binary_frames(self):
+        values = kcs.empty_values()
+        kcs.add_klines_to_values(values, "h", [KLINE])
+
+        client = kcs.app.test_client()
+        with mock.patch.object(
+            kcs, "load_klines_for_coin", return_value=values
+        ):
+            response = client.post(
+                "/batch",
+                json={
+                    "mode": "backtesting",
+                    "coins": [["BTCUSDT", 1.5], ["ETHUSDT", 2.0]],
+                },
+                headers={"Accept": KLINES_BINARY},
+            )
+            data = response.data
+
+        assert response.mimetype == KLINES_BINARY_STREAM
+        assert list(decode_klines_frames(data)) == [
+            ("BTCUSDT", 1.5, values),
+            ("ETHUSDT", 2.0, values),
+        ]
+
+
+class TestSharedMemory:
+    def test_load_klines_for_coin_publishes_klines(self, cache_dir):
+        with mock.patch.object(
+            kcs, "KLINES_SHARED_MEMORY_DIR", str(cache_dir)
+        ), mock.patch.object(
+            kcs, "call_binance_for_klines", return_value=(True, [KLINE])
+        ):
+            values = kcs.load_klines_for_coin(
+                "BTCUSDT", 1640995200, "backtesting"
+            )
+
+        assert (
+            read_shared_klines(str(cache_dir), "BTCUSDT", 1640995200.5)
+            == values
+        )
+
+    def test_publish_klines_keeps_published_blobs(self, cache_dir):
+        values = {"lowest": {"m": [[1.0, 2.0]]}}
+        assert publish_klines(str(cache_dir), "BTCUSDT", 1.0, values)
+        path = shared_klines_path(str(cache_dir), "BTCUSDT", 1.0)
+        os.utime(path, (1, 1))
+        assert not publish_klines(str(cache_dir), "BTCUSDT", 1.0, values)
+        # served again, so it is now the most recently used blob
+        assert os.stat(path).st_mtime > 1
+
+    def test_prune_shared_klines(self, cache_dir):
+        values = {"lowest": {"m": [[1.0, 2.0]] * 10}}
+        for n in range(4):
+            publish_klines(str(cache_dir), f"COIN{n}USDT", 1.0, values)
+            path = shared_klines_path(str(cache_dir), f"COIN{n}USDT", 1.0)
+            os.utime(path, (n + 1, n + 1))
+        size = os.stat(path).st_size
+        # a blob left behind by a writer that died
+        with open(f"{path}.1.1.tmp", "wb") as tmp:
+            tmp.write(b"KLN1")
+        os.utime(f"{path}.1.1.tmp", (1, 1))
+
+        assert prune_shared_klines(str(cache_dir), size * 2) == 2
+        assert sorted(
+            f for f in os.listdir(cache_dir) if f.endswith("klines")
+        ) == ["COIN2USDT.1.klines", "COIN3USDT.1.klines"]
+        assert not os.path.exists(f"{path}.1.1.tmp")
+
+
+def write_price_log(symbol, day, lines):
+    os.makedirs(f"log/{symbol}", exist_ok=True)
+    with gzip.open(f"log/{symbol}/{day}.log.gz", "wt") as f:
+        for date, price in lines:
+            f.write(f"{date}.999000 {symbol} {price}\n")
+
+
+class TestPriceLogsProvider:
+    def test_klines_from_prices_fills_gaps_with_last_price(self):
+        prices = [(0.0, 1.0), (60.0, 2.0), (70.0, 4.0), (190.0, 5.0)]
+
+        klines = price_log_klines.klines_from_prices(prices, 60, 179, 2)
+
+        # the first minute is only used as the price we start from
+        assert [(k[0], k[2], k[3], k[1]) for k in klines] == [
+            (60000, "4.0", "2.0", "3.0"),
+            (120000, "4.0", "4.0", "4.0"),
+        ]
+        assert [k[6] for k in klines] == [119999, 179999]
+
+    def test_load_klines_for_coin_from_price_logs(self, cache_dir):
+        write_price_log(
+            "BTCUSDT",
+            "20211201",
+            [("2021-12-01 10:00:59", 100.0), ("2021-12-01 20:00:59", 200.0)],
+        )
+        write_price_log(
+            "BTCUSDT",
+            "20211202",
+            [
+                ("2021-12-02 11:58:59", 300.0),
+                ("2021-12-02 11:59:59", 310.0),
+                ("2021-12-02 12:00:59", 320.0),
+            ],
+        )
+        date = int(datetime(2021, 12, 2, 13, 0, 0).timestamp())
+
+        with mock.patch.object(
+            kcs, "KLINES_PROVIDER", "price_logs"
+        ), mock.patch.object(kcs, "call_binance_for_klines") as binance:
+            values = kcs.load_klines_for_coin("BTCUSDT", date, "backtesting")
+            later = kcs.load_klines_for_coin(
+                "BTCUSDT", date + 86400, "backtesting"
+            )
+        binance.assert_not_called()
+
+        # the last 60 minutes, up to a minute before our date
+        assert len(values["averages"]["m"]) == 60
+        assert values["averages"]["m"][-1][1] == 320.0
+        # the last 24 hours, up to an hour before our date
+        assert len(values["averages"]["h"]) == 24
+        assert values["lowest"]["h"][-2][1] == 300.0
+        assert values["highest"]["h"][-2][1] == 310.0
+        # nothing moved in the last hour, so we keep the last price
+        assert values["averages"]["h"][-1][1] == 310.0
+        # days up to a day before our date, so only part of the first day
+        assert values["lowest"]["d"] == [
+            [datetime(2021, 12, 1, 23, 59, 59, 999000).timestamp(), 100.0],
+        ]
+        # and a day later, the first day out of the daily summary
+        assert later["lowest"]["d"] == [
+            [datetime(2021, 12, 1, 23, 59, 59, 999000).timestamp(), 100.0],
+            [datetime(2021, 12, 2, 23, 59, 59, 999000).timestamp(), 300.0],
+        ]
+        assert later["averages"]["d"][0][1] == 150.0
+        with open("cache/BTCUSDT/BTCUSDT.daily.json") as f:
+            assert json.load(f) == {
+                "20211201": [100.0, 150.0, 200.0],
+                "20211202": [300.0, 310.0, 320.0],
+            }
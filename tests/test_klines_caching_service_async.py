@@ -0,0 +1,105 @@
+""" pytests tests for klines_caching_service_async.py """
+# pylint: disable=missing-module-docstring
+# pylint: disable=missing-class-docstring
+# pylint: disable=missing-function-docstring
+# pylint: disable=redefined-outer-name
+# pylint: disable=import-outside-toplevel
+# pylint: disable=no-self-use
+import asyncio
+import os
+import time
+from unittest import mock
+
+import pytest
+
+import klines_caching_service_async as kcsa
+
+from tests.test_klines_caching_service import KLINE
+
+
+@pytest.fixture()
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.mkdir("cache")
+    yield tmp_path
+
+
+async def slow_binance_call(_session, _query):
+    await asyncio.sleep(0.3)
+    return (True, [KLINE])
+
+
+class TestAsyncFetchKlines:
+    def test_concurrent_misses_call_binance_once(self, cache_dir):
+        async def fetch_all():
+            return await asyncio.gather(
+                *[
+                    kcsa.fetch_klines(
+                        None, "q", "BTCUSDT.md5", "backtesting", "BTCUSDT"
+                    )
+                    for _ in range(10)
+                ]
+            )
+
+        with mock.patch.object(
+            kcsa, "call_binance_for_klines", side_effect=slow_binance_call
+        ) as binance:
+            results = asyncio.run(fetch_all())
+
+        assert binance.call_count == 1
+        assert results == [(True, [KLINE])] * 10
+        assert not kcsa.INFLIGHT
+        assert os.listdir("cache/BTCUSDT") == ["BTCUSDT.md5"]
+
+    def test_units_are_fetched_concurrently(self, cache_dir):
+        with mock.patch.object(
+            kcsa, "call_binance_for_klines", side_effect=slow_binance_call
+        ) as binance:
+            start = time.time()
+            values = asyncio.run(
+                kcsa.load_klines_for_coin(
+                    None, "BTCUSDT", 1640995200, "backtesting"
+                )
+            )
+            elapsed = time.time() - start
+
+        assert binance.call_count == 3
+        # three lookups of 0.3s each, run concurrently
+        assert elapsed < 0.6
+        for unit in ["m", "h", "d"]:
+            assert len(values["averages"][unit]) == 1
+
+    def test_binance_ban_blocks_other_requests(self):
+        class Response:
+            def __init__(self, status):
+                self.status = status
+                self.headers = {"Retry-After": "0"}
+
+            async def __aenter__(self):
+                return self
+
+            async def __aexit__(self, *args):
+                pass
+
+            def raise_for_status(self):
+                if self.status != 200:
+                    raise kcsa.aiohttp.ClientError()
+
+            async def json(self):
+                return [KLINE]
+
+        session = mock.MagicMock()
+        session.get.side_effect = [Response(418), Response(200)]
+        with mock.patch.object(kcsa, "BACKOFF_UNTIL", {"binance": 0.0}):
+            assert asyncio.run(kcsa.requests_with_backoff(session, "q")) == (
+                200,
+                [KLINE],
+            )
+            assert kcsa.BACKOFF_UNTIL["binance"] > 0
+
+            # other requests wait for the ban to be over
+            kcsa.BACKOFF_UNTIL["binance"] = time.time() + 0.3
+            session.get.side_effect = [Response(200)]
+            start = time.time()
+            asyncio.run(kcsa.requests_with_backoff(session, "q"))
+            assert time.time() - start >= 0.3
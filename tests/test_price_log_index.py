@@ -0,0 +1,89 @@
+""" pytests tests for lib/price_log_index.py """
+# pylint: disable=missing-module-docstring
+# pylint: disable=missing-class-docstring
+# pylint: disable=missing-function-docstring
+# pylint: disable=redefined-outer-name
+# pylint: disable=import-outside-toplevel
+# pylint: disable=no-self-use
+import gzip
+import json
+import os
+from pathlib import Path
+
+import pytest
+
+from lib import price_log_index as pli
+
+
+@pytest.fixture()
+def log_dir(tmp_path):
+    for day in ["20211201", "20211202"]:
+        (tmp_path / f"{day}.log.gz").touch()
+    for symbol, days in {
+        "BTCUSDT": ["20211201", "20211202"],
+        "ETHUSDT": ["20211202"],
+    }.items():
+        os.mkdir(tmp_path / symbol)
+        for day in days:
+            (tmp_path / symbol / f"{day}.log.gz").touch()
+    yield str(tmp_path)
+
+
+def read_json_gz(f_path):
+    with gzip.open(f_path, "rt", encoding="utf-8") as f:
+        return json.loads(f.read())
+
+
+class TestPriceLogIndex:
+    def test_first_update_scans_the_log_dir(self, log_dir):
+        pli.update_index(log_dir, [], [])
+        pli.write_index_files(log_dir)
+
+        assert read_json_gz(f"{log_dir}/index.json.gz") == {
+            "20211201": ["BTCUSDT"],
+            "20211202": ["BTCUSDT", "ETHUSDT"],
+        }
+        assert read_json_gz(f"{log_dir}/index_v2.json.gz") == {
+            "DATES": {
+                "20211201": ["BTCUSDT"],
+                "20211202": ["BTCUSDT", "ETHUSDT"],
+            },
+            "COINS": {
+                "BTCUSDT": ["20211201.log.gz", "20211202.log.gz"],
+                "ETHUSDT": ["20211202.log.gz"],
+            },
+        }
+
+    def test_updates_only_add_the_logs_written(self, log_dir):
+        pli.update_index(log_dir, [], [])
+
+        # a new day, and a log we don't tell the index about
+        Path(f"{log_dir}/20211203.log.gz").touch()
+        Path(f"{log_dir}/BTCUSDT/20211203.log.gz").touch()
+        Path(f"{log_dir}/ETHUSDT/20211203.log.gz").touch()
+        pli.update_index(
+            log_dir, ["20211203"], [("ETHUSDT", "20211203.log.gz")]
+        )
+        assert pli.read_index(log_dir)["DATES"] == {
+            "20211201": ["BTCUSDT"],
+            "20211202": ["BTCUSDT", "ETHUSDT"],
+            "20211203": ["ETHUSDT"],
+        }
+
+        # until it is rebuilt from the log dir
+        pli.update_index(log_dir, [], [], rebuild=True)
+        index = pli.read_index(log_dir)
+        assert index["DATES"]["20211203"] == ["BTCUSDT", "ETHUSDT"]
+        assert index["COINS"]["BTCUSDT"][-1] == "20211203.log.gz"
+
+    def test_updates_pick_up_days_a_dead_run_left_behind(self, log_dir):
+        pli.update_index(log_dir, [], [])
+
+        # written by a run that died before indexing them
+        Path(f"{log_dir}/20211203.log.gz").touch()
+        Path(f"{log_dir}/BTCUSDT/20211203.log.gz").touch()
+        pli.update_index(log_dir, [], [])
+
+        index = pli.read_index(log_dir)
+        assert index["DATES"]["20211203"] == ["BTCUSDT"]
+        assert index["COINS"]["BTCUSDT"][-1] == "20211203.log.gz"
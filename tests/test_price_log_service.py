@@ -0,0 +1,200 @@
+""" pytests tests for price_log_service.py """
+# pylint: disable=missing-module-docstring
+# pylint: disable=missing-class-docstring
+# pylint: disable=missing-function-docstring
+# pylint: disable=redefined-outer-name
+# pylint: disable=import-outside-toplevel
+# pylint: disable=no-self-use
+import gzip
+import os
+
+import pytest
+
+import price_log_service as pls
+
+LINES = [
+    b"2021-12-01 00:00:01.000000 BTCUSDT 100.0\n",
+    b"2021-12-01 00:00:02.000000 ETHUSDT 10.0\n",
+    b"2021-12-01 00:01:01.000000 BTCUSDT 101.0\n",
+    b"2021-12-01 00:01:30.000000 ETHUSDT 11.0\n",
+    b"2021-12-01 00:02:01.000000 BTCUSDT 102.0\n",
+    b"2021-12-01 00:03:01.000000 BTCUSDT 103.0\n",
+]
+
+
+@pytest.fixture()
+def client(tmp_path, monkeypatch):
+    os.makedirs(tmp_path / "log")
+    with gzip.open(tmp_path / "log" / "20211201.log.gz", "wb") as f:
+        f.write(b"".join(LINES))
+    monkeypatch.setattr(pls, "LOG_DIR", str(tmp_path / "log"))
+    yield pls.app.test_client()
+
+
+class TestPriceLogService:
+    def test_serves_price_logs_as_they_are(self, client):
+        response = client.get("/20211201.log.gz")
+
+        assert response.status_code == 200
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert gzip.decompress(response.data) == b"".join(LINES)
+        # past price logs never change
+        assert response.cache_control.max_age == pls.PAST_LOGS_MAX_AGE
+
+        cached = client.get(
+            "/20211201.log.gz",
+            headers={"If-None-Match": response.headers["ETag"]},
+        )
+        assert cached.status_code == 304
+
+        partial = client.get(
+            "/20211201.log.gz", headers={"Range": "bytes=0-9"}
+        )
+        assert partial.status_code == 206
+        assert partial.data == response.data[0:10]
+
+    def test_query_by_symbol_and_dates(self, client):
+        response = client.get(
+            "/20211201.log.gz?symbol=BTCUSDT"
+            + "&from=2021-12-01T00:00:30&to=2021-12-01T00:03:00"
+        )
+
+        assert response.status_code == 200
+        assert response.data == LINES[2] + LINES[4]
+
+        cached = client.get(
+            "/20211201.log.gz?symbol=BTCUSDT"
+            + "&from=2021-12-01T00:00:30&to=2021-12-01T00:03:00",
+            headers={"If-None-Match": response.headers["ETag"]},
+        )
+        assert cached.status_code == 304
+
+    def test_query_prefers_the_symbol_price_log(self, client):
+        os.makedirs(f"{pls.LOG_DIR}/ETHUSDT")
+        with gzip.open(f"{pls.LOG_DIR}/ETHUSDT/20211201.log.gz", "wb") as f:
+            f.write(LINES[1])
+
+        response = client.get("/20211201.log.gz?symbol=ETHUSDT")
+
+        assert response.data == LINES[1]
+
+    def test_query_is_compressed_when_accepted(self, client):
+        response = client.get(
+            "/20211201.log.gz?from=2021-12-01T00:03:00",
+            headers={"Accept-Encoding": "gzip"},
+        )
+
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert gzip.decompress(response.data) == LINES[5]
+
+    def test_minute_offsets(self, client):
+        minutes, offsets, size, _ = pls.minute_offsets(
+            f"{pls.LOG_DIR}/20211201.log.gz", 0
+        )
+
+        assert minutes == [
+            "2021-12-01 00:00",
+            "2021-12-01 00:01",
+            "2021-12-01 00:02",
+            "2021-12-01 00:03",
+        ]
+        assert offsets == [
+            0,
+            len(b"".join(LINES[0:2])),
+            len(b"".join(LINES[0:4])),
+            len(b"".join(LINES[0:5])),
+        ]
+        assert size == len(b"".join(LINES))
+
+    def test_query_decompresses_from_the_closest_seek_point(
+        self, client, monkeypatch
+    ):
+        lines = [
+            f"2021-12-01 {h:02}:{m:02}:01.000000 COIN{n}USDT {h * m * n}\n"
+            for h in range(24)
+            for m in range(60)
+            for n in range(5)
+        ]
+        # as two gzip members, as a price log appended to would be
+        with open(f"{pls.LOG_DIR}/20211202.log.gz", "wb") as f:
+            f.write(gzip.compress("".join(lines[0:3000]).encode()))
+            f.write(gzip.compress("".join(lines[3000:]).encode()))
+        monkeypatch.setattr(pls, "SEEK_POINT_SPACING", 4096)
+        monkeypatch.setattr(pls, "CHUNK_SIZE", 1024)
+        pls.minute_offsets.cache_clear()
+
+        path = f"{pls.LOG_DIR}/20211202.log.gz"
+        *_, seek_points = pls.minute_offsets(path, os.path.getmtime(path))
+        assert len(seek_points) > 4
+
+        # reading from the start would go over every line before the query
+        inflated = []
+        inflate = pls.inflate
+
+        def counting_inflate(f, decompressor):
+            for data, at, state in inflate(f, decompressor):
+                inflated.append(len(data))
+                yield (data, at, state)
+
+        monkeypatch.setattr(pls, "inflate", counting_inflate)
+        response = client.get(
+            "/20211202.log.gz?symbol=COIN3USDT"
+            + "&from=2021-12-01T20:00:00&to=2021-12-01T20:02:00"
+        )
+
+        assert (
+            response.data
+            == "".join(
+                line
+                for line in lines
+                if "COIN3USDT" in line and line[11:16] in ["20:00", "20:01"]
+            ).encode()
+        )
+        assert sum(inflated) < len("".join(lines)) / 4
+
+    def test_merge_symbols_over_dates(self, client):
+        for symbol in ["BTCUSDT", "ETHUSDT"]:
+            os.makedirs(f"{pls.LOG_DIR}/{symbol}")
+            for day in ["20211201", "20211202"]:
+                with gzip.open(
+                    f"{pls.LOG_DIR}/{symbol}/{day}.log.gz", "wb"
+                ) as f:
+                    f.write(
+                        b"".join(
+                            line.replace(b"2021-12-01", b"2021-12-02")
+                            if day == "20211202"
+                            else line
+                            for line in LINES
+                            if symbol.encode() in line
+                        )
+                    )
+        second_day = [
+            line.replace(b"2021-12-01", b"2021-12-02") for line in LINES
+        ]
+
+        response = client.get(
+            "/merge?symbols=BTCUSDT,ETHUSDT,XRPUSDT&dates=20211201,20211202"
+        )
+
+        assert response.status_code == 200
+        assert response.data == b"".join(LINES + second_day)
+        assert response.cache_control.max_age == pls.PAST_LOGS_MAX_AGE
+
+        gzipped = client.get(
+            "/merge?symbols=ETHUSDT&dates=20211202",
+            headers={"Accept-Encoding": "gzip"},
+        )
+        assert gzipped.headers["Content-Encoding"] == "gzip"
+        assert gzip.decompress(gzipped.data) == second_day[1] + second_day[3]
+
+        cached = client.get(
+            "/merge?symbols=ETHUSDT&dates=20211202",
+            headers={
+                "Accept-Encoding": "gzip",
+                "If-None-Match": gzipped.headers["ETag"],
+            },
+        )
+        assert cached.status_code == 304
+
+        missing = client.get("/merge?symbols=XRPUSDT&dates=20211201")
+        assert missing.status_code == 404
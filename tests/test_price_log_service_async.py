@@ -0,0 +1,110 @@
+""" pytests tests for price_log_service_async.py """
+# pylint: disable=missing-module-docstring
+# pylint: disable=missing-class-docstring
+# pylint: disable=missing-function-docstring
+# pylint: disable=redefined-outer-name
+# pylint: disable=import-outside-toplevel
+# pylint: disable=no-self-use
+import asyncio
+import gzip
+import os
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+import price_log_service_async as plsa
+from tests.test_price_log_service import LINES
+
+
+@pytest.fixture()
+def log_dir(tmp_path, monkeypatch):
+    os.makedirs(tmp_path / "log" / "ETHUSDT")
+    with gzip.open(tmp_path / "log" / "20211201.log.gz", "wb") as f:
+        f.write(b"".join(LINES))
+    with gzip.open(
+        tmp_path / "log" / "ETHUSDT" / "20211201.log.gz", "wb"
+    ) as f:
+        f.write(LINES[1] + LINES[3])
+    monkeypatch.setattr(plsa, "LOG_DIR", str(tmp_path / "log"))
+    monkeypatch.setattr(plsa, "HOT_FILES", plsa.HotFiles(1024, 1024))
+    yield tmp_path / "log"
+
+
+async def get(path, headers=None):
+    """returns the (status, headers, body) of a request to the service"""
+    async with TestClient(TestServer(plsa.make_app())) as client:
+        response = await client.get(
+            path, headers=headers, auto_decompress=False
+        )
+        return (response.status, response.headers, await response.read())
+
+
+class TestAsyncPriceLogService:
+    def test_serves_price_logs_from_the_hot_cache(self, log_dir):
+        status, headers, body = asyncio.run(get("/20211201.log.gz"))
+
+        assert status == 200
+        assert headers["Content-Encoding"] == "gzip"
+        assert gzip.decompress(body) == b"".join(LINES)
+        assert list(plsa.HOT_FILES.files) == [f"{log_dir}/20211201.log.gz"]
+
+        status, _, _ = asyncio.run(
+            get("/20211201.log.gz", {"If-None-Match": headers["ETag"]})
+        )
+        assert status == 304
+
+        status, _, partial = asyncio.run(
+            get("/20211201.log.gz", {"Range": "bytes=0-9"})
+        )
+        assert status == 206
+        assert partial == body[0:10]
+
+    def test_large_price_logs_are_sent_from_disk(self, log_dir, monkeypatch):
+        monkeypatch.setattr(plsa, "HOT_FILES", plsa.HotFiles(1024, 10))
+
+        status, headers, body = asyncio.run(get("/20211201.log.gz"))
+
+        assert status == 200
+        assert headers["Content-Encoding"] == "gzip"
+        assert gzip.decompress(body) == b"".join(LINES)
+        assert not plsa.HOT_FILES.files
+
+    def test_hot_cache_evicts_least_recently_used(self, log_dir):
+        hot = plsa.HotFiles(100, 100)
+        for name in ["a", "b", "c"]:
+            with open(log_dir / name, "wb") as f:
+                f.write(b"x" * 40)
+
+        async def read_all():
+            for name in ["a", "b", "a", "c"]:
+                await hot.get(f"{log_dir}/{name}")
+
+        asyncio.run(read_all())
+
+        assert list(hot.files) == [f"{log_dir}/a", f"{log_dir}/c"]
+        assert hot.size == 80
+
+    def test_query_and_merge(self, log_dir):
+        status, _, body = asyncio.run(
+            get(
+                "/20211201.log.gz?symbol=ETHUSDT&from=2021-12-01T00:01:00",
+                {"Accept-Encoding": "identity"},
+            )
+        )
+        assert status == 200
+        assert body == LINES[3]
+
+        status, headers, body = asyncio.run(
+            get(
+                "/merge?symbols=ETHUSDT,BTCUSDT&dates=20211201",
+                {"Accept-Encoding": "gzip"},
+            )
+        )
+        assert status == 200
+        assert headers["Content-Encoding"] == "gzip"
+        assert gzip.decompress(body) == LINES[1] + LINES[3]
+
+        status, _, _ = asyncio.run(
+            get("/merge?symbols=XRPUSDT&dates=20211201")
+        )
+        assert status == 404
@@ -7,6 +7,10 @@ from datetime import datetime
 
 import json
 import importlib
+import os
+import tempfile
+
+from lib import results_store
 
 pb = importlib.import_module("utils.prove-backtesting")
 
@@ -170,6 +174,388 @@ class TestProveBacktesting(unittest.TestCase):
         # Assert the result matches the expected output
         self.assertEqual(result, expected)
 
+    def test_availability_index(self):
+        """test the index lookups of a window and of the index age"""
+        index = pb.AvailabilityIndex(
+            {
+                "20220103": ["BTCUSDT"],
+                "20220101": ["BTCUSDT", "ETHUSDT"],
+                "20220102": [],
+                "20220105": ["ETHUSDT"],
+            }
+        )
+        self.assertEqual(
+            index.days_between("20220102", "20220104"),
+            ["20220102", "20220103"],
+        )
+        self.assertEqual(index.days_between("20220106", "20220107"), [])
+        self.assertEqual(index.age("20211231"), 0)
+        self.assertEqual(index.age("20220103"), 2)
+        self.assertEqual(index.age("20220110"), 3)
+
+        pb.get_index_json = mocked_get_index_json_call
+        instance = pb.ProveBacktesting(CONFIG)
+        self.assertEqual(
+            instance.filter_on_avail_days_with_log(
+                ["20220101", "20220102", "20220103"], index.dates
+            ),
+            {
+                "BTCUSDT": [
+                    "BTCUSDT/20220101.log.gz",
+                    "BTCUSDT/20220103.log.gz",
+                ],
+                "ETHUSDT": ["ETHUSDT/20220101.log.gz"],
+            },
+        )
+        # BULL/BEAR tokens and other pairings are left out
+        self.assertFalse(instance.is_eligible("BTCUPUSDT"))
+        self.assertFalse(instance.is_eligible("ETHBTC"))
+        self.assertTrue(instance.is_eligible("ETHUSDT"))
+
+    def test_merged_price_logs(self):
+        """test coin price logs merged with the extra symbols"""
+        pb.get_index_json = mocked_get_index_json_call
+        instance = pb.ProveBacktesting(CONFIG)
+        price_logs = ["ETHUSDT/20210101.log.gz", "ETHUSDT/20210102.log.gz"]
+
+        self.assertEqual(
+            instance.merged_price_logs("ETHUSDT", price_logs), price_logs
+        )
+
+        instance = pb.ProveBacktesting(
+            dict(CONFIG, EXTRA_PRICE_LOG_SYMBOLS=["BTCUSDT"])
+        )
+        self.assertEqual(
+            instance.merged_price_logs("ETHUSDT", price_logs),
+            [
+                "merge?symbols=ETHUSDT,BTCUSDT&dates=20210101",
+                "merge?symbols=ETHUSDT,BTCUSDT&dates=20210102",
+            ],
+        )
+        self.assertEqual(
+            instance.merged_price_logs("BTCUSDT", ["BTCUSDT/20210101.log.gz"]),
+            ["merge?symbols=BTCUSDT&dates=20210101"],
+        )
+
+    def test_coins_by_cost(self):
+        """test slowest coins are backtested first"""
+        pb.get_index_json = mocked_get_index_json_call
+        instance = pb.ProveBacktesting(CONFIG)
+        instance.runtimes = {"BTCUSDT": 2.0, "ETHUSDT": 1.0, "XRPUSDT": 0.1}
+        instance.coin_days = {
+            "BTCUSDT": 10,
+            "ETHUSDT": 30,
+            "XRPUSDT": 30,
+            "NEWUSDT": 5,
+        }
+
+        self.assertEqual(
+            instance.coins_by_cost(
+                {"BTCUSDT", "ETHUSDT", "XRPUSDT", "NEWUSDT"}
+            ),
+            ["ETHUSDT", "BTCUSDT", "NEWUSDT", "XRPUSDT"],
+        )
+
+    def test_save_runtimes(self):
+        """test runtimes are saved per day of price logs"""
+        pb.get_index_json = mocked_get_index_json_call
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            instance = pb.ProveBacktesting(CONFIG)
+            instance.runtimes_file = f"{tmp_dir}/runtimes.json"
+            instance.runtimes = {"ETHUSDT": 1.0}
+            instance.coin_days = {"BTCUSDT": 10}
+
+            instance.save_runtimes({"BTCUSDT": 50.0})
+
+            self.assertEqual(
+                instance.load_runtimes(), {"BTCUSDT": 5.0, "ETHUSDT": 1.0}
+            )
+
+    def test_result_cache(self):
+        """test coin backtests are only run once for the same inputs"""
+        pb.get_index_json = mocked_get_index_json_call
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            os.chdir(tmp_dir)
+            try:
+                for directory in ["configs", "log", "results", "state", "tmp"]:
+                    os.mkdir(directory)
+                instance = pb.ProveBacktesting(
+                    dict(CONFIG, RESULT_CACHE_DIR=f"{tmp_dir}/cache")
+                )
+                instance.result_cache.session = mock.MagicMock()
+                instance.result_cache.session.head.return_value = (
+                    mock.MagicMock(status_code=200, headers={"ETag": '"1"'})
+                )
+
+                def write_configs(session):
+                    instance.coin_configs = {
+                        f"coin.{coin}.yaml": {
+                            "PRICE_LOGS": ["20220101.log.gz"],
+                            "RESULTS_TAGS": {
+                                "SESSION": session,
+                                "RUN": "run1",
+                                "WINDOW": "20220101",
+                            },
+                            "TICKERS": {coin: {"BUY": 1}},
+                        }
+                        for coin in ["BTCUSDT", "ETHUSDT"]
+                    }
+
+                def backtest(coins, _):
+                    for coin in coins:
+                        conf = f"coin.{coin}.yaml"
+                        cfg = instance.coin_configs[conf]
+                        results_store.save_result(
+                            results_store.store_path("log"),
+                            results_store.make_result(
+                                conf,
+                                cfg,
+                                days=1,
+                                wins=2,
+                                losses=0,
+                                stales=0,
+                                holds=0,
+                                profit=10.0,
+                            ),
+                        )
+                        with open(f"results/backtesting.{conf}.txt", "w") as r:
+                            r.write(
+                                "INFO wins:2 losses:0 stales:0 holds:0\n"
+                                + "INFO final balance: 10.0\n"
+                            )
+                        with open("log/backtesting.log", "a") as b:
+                            b.write(f"profit:10.000|i|d|w2|cfg:{conf}|{{}}\n")
+                    return {coin: 1.0 for coin in coins}
+
+                with mock.patch.object(
+                    instance, "local_backtest_all_coins", side_effect=backtest
+                ) as local:
+                    write_configs("s1")
+                    first = instance.parallel_backtest_all_coins(
+                        {"BTCUSDT", "ETHUSDT"}, 1, "run1"
+                    )
+                    # as on a new prove-backtesting session
+                    write_configs("s2")
+                    instance.session = "s2"
+                    os.remove("log/backtesting.log")
+                    for coin in ["BTCUSDT", "ETHUSDT"]:
+                        os.remove(f"results/backtesting.coin.{coin}.yaml.txt")
+                    second = instance.parallel_backtest_all_coins(
+                        {"BTCUSDT", "ETHUSDT"}, 1, "run1"
+                    )
+                    self.assertEqual(local.call_args.args[0], set())
+                    self.assertEqual(first, second)
+                    self.assertEqual(second["total_wins"], 4)
+                    with open("log/backtesting.log") as b:
+                        self.assertEqual(len(b.readlines()), 2)
+                    # the cached results are in the store for this session
+                    self.assertEqual(
+                        instance.find_best_results("coincfg", "20220101"),
+                        {"BTCUSDT": {"BUY": 1}, "ETHUSDT": {"BUY": 1}},
+                    )
+
+                    # a new version of a price log is backtested again
+                    instance.result_cache.versions = {}
+                    instance.result_cache.session.head.return_value = (
+                        mock.MagicMock(
+                            status_code=200, headers={"ETag": '"2"'}
+                        )
+                    )
+                    instance.parallel_backtest_all_coins(
+                        {"BTCUSDT", "ETHUSDT"}, 1, "run1"
+                    )
+                    self.assertEqual(
+                        local.call_args.args[0], {"BTCUSDT", "ETHUSDT"}
+                    )
+            finally:
+                os.chdir(cwd)
+
+    def test_find_best_results(self):
+        """test the best config of each coin is picked from the store"""
+        pb.get_index_json = mocked_get_index_json_call
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            os.chdir(tmp_dir)
+            try:
+                os.mkdir("log")
+                instance = pb.ProveBacktesting(
+                    dict(CONFIG, MIN_WINS=1, MIN_PROFIT=0, MAX_LOSSES=0)
+                )
+                instance.session = "s1"
+                for coin, window, buy, wins, losses, profit in [
+                    ("BTCUSDT", "20220101", 1, 3, 0, 5.0),
+                    ("BTCUSDT", "20220101", 2, 2, 0, 7.0),
+                    # too many losses
+                    ("BTCUSDT", "20220101", 3, 9, 1, 9.0),
+                    ("ETHUSDT", "20220101", 1, 1, 0, 3.0),
+                    # same profit, the first one wins
+                    ("ETHUSDT", "20220101", 2, 1, 0, 3.0),
+                    # a different window
+                    ("XRPUSDT", "20220102", 1, 1, 0, 3.0),
+                ]:
+                    cfg = {
+                        "RESULTS_TAGS": {"SESSION": "s1", "WINDOW": window},
+                        "TICKERS": {coin: {"BUY": buy}},
+                    }
+                    results_store.save_result(
+                        results_store.store_path("log"),
+                        results_store.make_result(
+                            f"coin.{coin}.yaml",
+                            cfg,
+                            days=1,
+                            wins=wins,
+                            losses=losses,
+                            stales=0,
+                            holds=0,
+                            profit=profit,
+                        ),
+                    )
+
+                best = instance.find_best_results("coincfg", "20220101")
+                self.assertEqual(
+                    list(best.items()),
+                    [("ETHUSDT", {"BUY": 1}), ("BTCUSDT", {"BUY": 2})],
+                )
+                instance.session = "s2"
+                self.assertEqual(
+                    instance.find_best_results("coincfg", "20220101"), {}
+                )
+            finally:
+                os.chdir(cwd)
+
+    def test_results_store_keeps_configs_once(self):
+        """test the coins of a run share their config, and old sessions are
+        pruned along with their configs"""
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            os.chdir(tmp_dir)
+            try:
+                store = "backtesting.sqlite"
+                for session in ["s1", "s2", "s3"]:
+                    for coin in ["BTCUSDT", "ETHUSDT"]:
+                        conf = f"coin.{coin}.yaml"
+                        cfg = {
+                            "PAIRING": "USDT",
+                            "PRICE_LOGS": [f"{coin}/{session}.log.gz"],
+                            "RESULTS_TAGS": {"SESSION": session},
+                            "TICKERS": {coin: {"BUY": 1}},
+                        }
+                        results_store.save_result(
+                            store,
+                            results_store.make_result(
+                                conf,
+                                cfg,
+                                days=1,
+                                wins=1,
+                                losses=0,
+                                stales=0,
+                                holds=0,
+                                profit=1.0,
+                            ),
+                        )
+
+                row = results_store.last_result(store, "coin.ETHUSDT.yaml")
+                self.assertEqual(row["session"], "s3")
+                self.assertEqual(json.loads(row["ticker"]), {"BUY": 1})
+                self.assertEqual(
+                    json.loads(row["cfg"]),
+                    {"PAIRING": "USDT", "PRICE_LOGS": ["s3.log.gz"]},
+                )
+
+                conn = results_store.connect(store)
+                count = "SELECT COUNT(*) FROM configs"
+                # one config for both coins of each of the 3 sessions
+                self.assertEqual(conn.execute(count).fetchone()[0], 3)
+                self.assertEqual(results_store.prune_sessions(store, 1), 4)
+                self.assertEqual(conn.execute(count).fetchone()[0], 1)
+                self.assertEqual(
+                    conn.execute(
+                        "SELECT DISTINCT session FROM results"
+                    ).fetchall()[0]["session"],
+                    "s3",
+                )
+                conn.close()
+            finally:
+                os.chdir(cwd)
+
+    def test_write_single_coin_config(self):
+        """test coin configs are kept in memory, and written with DEBUG"""
+        pb.get_index_json = mocked_get_index_json_call
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            os.chdir(tmp_dir)
+            try:
+                os.mkdir("configs")
+                instance = pb.ProveBacktesting(CONFIG)
+                run = {key: 1.5 for key in pb.TICKER_KEYS}
+                instance.write_single_coin_config(
+                    "BTCUSDT", ["20220101.log.gz"], run, {"RUN": "run1"}
+                )
+                cfg = instance.coin_configs["coin.BTCUSDT.yaml"]
+                self.assertEqual(cfg["PRICE_LOGS"], ["20220101.log.gz"])
+                self.assertEqual(cfg["RESULTS_TAGS"], {"RUN": "run1"})
+                self.assertEqual(
+                    cfg["TICKERS"]["BTCUSDT"]["BUY_AT_PERCENTAGE"], "1.5"
+                )
+                self.assertEqual(os.listdir("configs"), [])
+
+                instance.debug = True
+                instance.write_single_coin_config(
+                    "BTCUSDT", ["20220101.log.gz"], run
+                )
+                self.assertEqual(
+                    pb.app.load_config("configs/coin.BTCUSDT.yaml"),
+                    instance.coin_configs["coin.BTCUSDT.yaml"],
+                )
+            finally:
+                os.chdir(cwd)
+
+    def test_backtest_in_process(self):
+        """test in-process backtests log into their results file"""
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            os.chdir(tmp_dir)
+            try:
+                for directory in ["results", "tests"]:
+                    os.mkdir(directory)
+                with open("tests/fake.yaml", "w") as f:
+                    f.write("ACCESS_KEY: x\nSECRET_KEY: y\n")
+
+                def backtest(config_file, cfg, secrets, logs_dir):
+                    self.assertEqual(config_file, "configs/coin.BTCUSDT.yaml")
+                    self.assertEqual(secrets["ACCESS_KEY"], "x")
+                    self.assertEqual(logs_dir, "log")
+                    pb.logging.debug("not in the results")
+                    pb.logging.info(f"wins:{cfg['WINS']} losses:0")
+                    if cfg["WINS"] == 0:
+                        raise ValueError("no wins")
+
+                with mock.patch.object(pb.app, "backtest", backtest):
+                    conf, took = pb.backtest_in_process(
+                        "coin.BTCUSDT.yaml", {"DEBUG": False, "WINS": 2}
+                    )
+                    self.assertEqual(conf, "coin.BTCUSDT.yaml")
+                    self.assertGreater(took, 0)
+                    with open(
+                        "results/backtesting.coin.BTCUSDT.yaml.txt"
+                    ) as r:
+                        self.assertEqual(r.read(), "[INFO] wins:2 losses:0\n")
+
+                    pb.backtest_in_process(
+                        "coin.BTCUSDT.yaml", {"DEBUG": False, "WINS": 0}
+                    )
+                    with open(
+                        "results/backtesting.coin.BTCUSDT.yaml.txt"
+                    ) as r:
+                        results_txt = r.read()
+                    self.assertTrue(
+                        results_txt.startswith("[INFO] wins:0 losses:0\n")
+                    )
+                    self.assertIn("ValueError: no wins", results_txt)
+            finally:
+                os.chdir(cwd)
+
     def test_filter_on_coins_with_min_age_logs(self):
         """test filter on coins win min age logs"""
 
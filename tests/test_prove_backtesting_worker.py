@@ -0,0 +1,175 @@
+""" pytests tests for utils/prove-backtesting-worker.py """
+# pylint: disable=missing-module-docstring
+# pylint: disable=missing-class-docstring
+# pylint: disable=missing-function-docstring
+# pylint: disable=redefined-outer-name
+# pylint: disable=import-outside-toplevel
+# pylint: disable=no-self-use
+import importlib
+import os
+import threading
+import time
+
+import pytest
+import zmq
+
+pbw = importlib.import_module("utils.prove-backtesting-worker")
+pb = pbw.pb
+
+COINS = [f"COIN{n}USDT" for n in range(12)]
+
+
+@pytest.fixture()
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for directory in ["configs", "log", "results", "tmp"]:
+        os.mkdir(directory)
+    yield tmp_path
+
+
+CONFIGS = {f"coin.{coin}.yaml": {"TICKERS": {coin: {}}} for coin in COINS}
+
+
+def fake_backtest(ran_by):
+    """a stand in for app.py, writing the same files a bot writes"""
+
+    def wrap_subprocessing(conf, timeout=0, logs_dir="log"):
+        del timeout
+        ran_by[conf] = threading.current_thread().name
+        time.sleep(0.05)
+        with open(f"configs/{conf}") as c:
+            cfg = c.read()
+        with open(f"results/backtesting.{conf}.txt", "w") as r:
+            r.write(f"{conf} final balance: 1.0\n")
+        with open(f"{logs_dir}/backtesting.log", "a") as b:
+            b.write(f"profit:1.000|{conf}|{cfg}\n")
+        with open(f"tmp/{conf}.coins.json", "w") as s:
+            s.write("{}")
+
+    return wrap_subprocessing
+
+
+class TestProveBacktestingWorker:
+    def test_workers_on_localhost(self, workdir, monkeypatch):
+        ran_by = {}
+        monkeypatch.setattr(pb, "wrap_subprocessing", fake_backtest(ran_by))
+        coordinator = pb.Coordinator("tcp://127.0.0.1:*", job_timeout=60)
+        address = coordinator.socket.getsockopt_string(zmq.LAST_ENDPOINT)
+
+        stop = threading.Event()
+        workers = [
+            threading.Thread(
+                target=pbw.work,
+                args=(address, stop, 1000),
+                name=f"worker-{n}",
+            )
+            for n in range(3)
+        ]
+        for worker in workers:
+            worker.start()
+        try:
+            confs = [f"coin.{coin}.yaml" for coin in COINS]
+            wall_times = coordinator.run_jobs(confs, CONFIGS)
+            # the same configs again, in a second round
+            assert coordinator.run_jobs(confs[0:2], CONFIGS).keys() == {
+                "coin.COIN0USDT.yaml",
+                "coin.COIN1USDT.yaml",
+            }
+        finally:
+            stop.set()
+            for worker in workers:
+                worker.join()
+            coordinator.close()
+
+        assert sorted(wall_times.keys()) == sorted(confs)
+        assert all(t > 0 for t in wall_times.values())
+        # the jobs were shared between the workers
+        assert len(set(ran_by.values())) > 1
+        for conf in confs:
+            with open(f"results/backtesting.{conf}.txt") as r:
+                assert r.read() == f"{conf} final balance: 1.0\n"
+            assert not os.path.exists(f"tmp/{conf}.coins.json")
+        with open("log/backtesting.log") as b:
+            lines = b.readlines()
+        assert len(lines) == len(confs) + 2
+        assert lines[0].startswith("profit:1.000|coin.")
+        # the workers logs dirs are cleaned up
+        assert os.listdir("tmp") == []
+
+    def test_jobs_of_lost_workers_are_handed_out_again(self, workdir):
+        coordinator = pb.Coordinator("tcp://127.0.0.1:*", job_timeout=0.5)
+        address = coordinator.socket.getsockopt_string(zmq.LAST_ENDPOINT)
+
+        # a worker that takes a job and is never heard of again
+        lost = zmq.Context.instance().socket(zmq.REQ)
+        lost.setsockopt(zmq.LINGER, 0)
+        lost.connect(address)
+        lost.send_json({"result": None})
+
+        stop = threading.Event()
+        worker = threading.Thread(target=pbw.work, args=(address, stop, 1000))
+        with pytest.MonkeyPatch.context() as m:
+            m.setattr(pb, "wrap_subprocessing", fake_backtest({}))
+            # only start the good worker once the lost one got its job
+            threading.Timer(0.2, worker.start).start()
+            try:
+                wall_times = coordinator.run_jobs(
+                    ["coin.COIN0USDT.yaml"], CONFIGS
+                )
+            finally:
+                stop.set()
+                time.sleep(0.3)
+                worker.join()
+                lost.close()
+                coordinator.close()
+
+        assert list(wall_times.keys()) == ["coin.COIN0USDT.yaml"]
+
+    def test_results_arriving_after_their_job_timed_out(self, workdir):
+        coordinator = pb.Coordinator("tcp://127.0.0.1:*", job_timeout=0.2)
+        address = coordinator.socket.getsockopt_string(zmq.LAST_ENDPOINT)
+        confs = ["coin.COIN0USDT.yaml", "coin.COIN1USDT.yaml"]
+
+        def result_for(job):
+            return {
+                "job_id": job["job_id"],
+                "conf": job["conf"],
+                "results_txt": "",
+                "backtesting_log": "",
+                "results_row": None,
+                "wall_time": 1.0,
+            }
+
+        def late_worker():
+            socket = zmq.Context.instance().socket(zmq.REQ)
+            socket.setsockopt(zmq.LINGER, 0)
+            socket.connect(address)
+            try:
+                result = None
+                for _ in range(2):
+                    socket.send_json({"result": result})
+                    job = socket.recv_json()
+                    # long enough for the coordinator to queue it again
+                    time.sleep(1.5)
+                    result = result_for(job)
+                socket.send_json({"result": result})
+                socket.poll(2000)
+            finally:
+                socket.close()
+
+        worker = threading.Thread(target=late_worker)
+        worker.start()
+        wall_times = {}
+        jobs = threading.Thread(
+            target=lambda: wall_times.update(
+                coordinator.run_jobs(confs, CONFIGS)
+            ),
+            daemon=True,
+        )
+        jobs.start()
+        jobs.join(timeout=10)
+        worker.join()
+        coordinator.close()
+
+        assert not jobs.is_alive()
+        assert sorted(wall_times.keys()) == confs
@@ -0,0 +1,91 @@
+""" pytests tests for utils/warm_klines_cache.py """
+# pylint: disable=missing-module-docstring
+# pylint: disable=missing-class-docstring
+# pylint: disable=missing-function-docstring
+# pylint: disable=redefined-outer-name
+# pylint: disable=import-outside-toplevel
+# pylint: disable=no-self-use
+import json
+from unittest import mock
+
+import pytest
+
+from tests.test_prove_backtesting import CONFIG
+from utils import warm_klines_cache as wkc
+
+INDEX = {
+    "DATES": {
+        "20211201": ["BTCUSDT", "ETHBTC"],
+        "20211202": ["BTCUSDT", "ETHUSDT", "ETHUPUSDT"],
+        "20211203": ["BTCUSDT", "ETHUSDT", "BNBUSDT"],
+    },
+    "COINS": {},
+}
+
+
+@pytest.fixture()
+def pv():
+    response = mock.MagicMock(content=json.dumps(INDEX))
+    with mock.patch.object(wkc.pb, "get_index_json", return_value=response):
+        yield wkc.pb.ProveBacktesting(
+            CONFIG
+            | {
+                "FROM_DATE": "20211202",
+                "END_DATE": "20211202",
+                "ROLL_BACKWARDS": 2,
+                "ROLL_FORWARD": 1,
+                "ENABLE_NEW_LISTING_CHECKS": False,
+            }
+        )
+
+
+class TestWarmKlinesCache:
+    def test_coin_days_for_run(self, pv):
+        assert wkc.coin_days_for_run(pv) == [
+            # backtesting 20211201..20211202, one run per coin
+            ("BTCUSDT", "20211201"),
+            ("ETHUSDT", "20211202"),
+            # forwardtesting 20211203, all coins on their first day
+            ("BTCUSDT", "20211203"),
+            ("ETHUSDT", "20211203"),
+            ("BNBUSDT", "20211203"),
+        ]
+
+    def test_warm_klines_cache_resumes_from_checkpoint(self, pv, tmp_path):
+        checkpoint = str(tmp_path / "checkpoint.json")
+        with open(checkpoint, "wt", encoding="utf-8") as c:
+            json.dump(["BTCUSDT/20211201", "BTCUSDT/20211203"], c)
+
+        with mock.patch.object(
+            wkc, "warm_coin_day", side_effect=[True, True, False]
+        ) as warm:
+            wkc.warm_klines_cache(pv, checkpoint, workers=1)
+
+        assert sorted(x.args[1:] for x in warm.call_args_list) == [
+            ("BNBUSDT", "20211203"),
+            ("ETHUSDT", "20211202"),
+            ("ETHUSDT", "20211203"),
+        ]
+        with open(checkpoint, encoding="utf-8") as c:
+            assert len(json.load(c)) == 4
+
+    def test_warm_coin_day_uses_first_price_log_line(self):
+        response = mock.MagicMock()
+        response.__enter__.return_value.status_code = 200
+        response.__enter__.return_value.iter_lines.return_value = [
+            b"2021-12-02 00:00:01.123456 ETHUSDT 4000.0",
+            b"2021-12-02 00:00:02.123456 ETHUSDT 4001.0",
+        ]
+
+        with mock.patch.object(
+            wkc.requests, "get", return_value=response
+        ), mock.patch.object(
+            wkc.klines_caching_service, "load_klines_for_coin"
+        ) as load:
+            assert wkc.warm_coin_day("http://price-log", "ETHUSDT", "20211202")
+
+        load.assert_called_once_with(
+            "ETHUSDT",
+            int(wkc.c_date_from("2021-12-02 00:00:01")),
+            "backtesting",
+        )
@@ -0,0 +1,202 @@
+""" load benchmark for the price_log_service variants """
+import asyncio
+import gzip
+import logging
+import random
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser, Namespace
+from datetime import datetime, timedelta
+from multiprocessing import Process
+from os import makedirs
+from typing import List, Tuple
+
+import aiohttp
+import requests
+
+SERVICES: List[str] = ["flask", "async"]
+
+
+def log_msg(msg: str) -> None:
+    """logs out message prefixed with timestamp"""
+    now: str = datetime.now().strftime("%H:%M:%S")
+    print(f"{now} BENCHMARK: {msg}")
+
+
+def make_price_logs(log_dir: str, days: int, lines: int) -> List[str]:
+    """writes a number of synthetic daily price logs, returns their names"""
+    makedirs(log_dir, exist_ok=True)
+    start: datetime = datetime(2022, 1, 1)
+    price_logs: List[str] = []
+    for day in range(days):
+        date: datetime = start + timedelta(days=day)
+        price_log: str = f"{date.strftime('%Y%m%d')}.log.gz"
+        with gzip.open(f"{log_dir}/{price_log}", "wt") as f:
+            for n in range(lines):
+                timestamp = date + timedelta(seconds=n * 86400 / lines)
+                f.write(
+                    f"{timestamp} COIN{n % 100}USDT "
+                    + f"{random.uniform(1, 1000):.4f}\n"  # nosec
+                )
+        price_logs.append(price_log)
+    return price_logs
+
+
+def serve(service: str, log_dir: str, port: int) -> None:
+    """runs one of the price_log_service variants on a local port"""
+    if service == "async":
+        from aiohttp import web  # pylint: disable=import-outside-toplevel
+
+        import price_log_service_async  # pylint: disable=import-outside-toplevel
+
+        price_log_service_async.LOG_DIR = log_dir
+        web.run_app(
+            price_log_service_async.app,
+            host="127.0.0.1",
+            port=port,
+            keepalive_timeout=price_log_service_async.KEEPALIVE_TIMEOUT,
+            print=None,
+        )
+    else:
+        import price_log_service  # pylint: disable=import-outside-toplevel
+
+        logging.getLogger("werkzeug").setLevel(logging.ERROR)
+        price_log_service.LOG_DIR = log_dir
+        price_log_service.app.run(host="127.0.0.1", port=port, threaded=True)
+
+
+def wait_for_service(url: str, price_log: str) -> None:
+    """waits until the service answers requests"""
+    for _ in range(100):
+        try:
+            requests.get(f"{url}/{price_log}", timeout=1)
+            return
+        except requests.exceptions.RequestException:
+            time.sleep(0.1)
+    log_msg(f"{url} didn't come up")
+    sys.exit(1)
+
+
+async def fetch(
+    session: aiohttp.ClientSession, url: str, latencies: List[float]
+) -> int:
+    """fetches a price log, returns the number of bytes received"""
+    start: float = time.time()
+    async with session.get(url) as response:
+        response.raise_for_status()
+        size: int = len(await response.read())
+    latencies.append(time.time() - start)
+    return size
+
+
+async def load(
+    url: str, price_logs: List[str], concurrency: int, total: int
+) -> Tuple[int, float, List[float]]:
+    """fires total requests over the price logs, concurrency at a time, as
+    a prove-backtesting run does, returns (bytes, seconds, latencies)"""
+    latencies: List[float] = []
+    queue: asyncio.Queue = asyncio.Queue()
+    for n in range(total):
+        queue.put_nowait(f"{url}/{price_logs[n % len(price_logs)]}")
+
+    async def worker(session: aiohttp.ClientSession) -> int:
+        received: int = 0
+        while not queue.empty():
+            received = received + await fetch(
+                session, queue.get_nowait(), latencies
+            )
+        return received
+
+    # one connection per worker, kept alive across requests
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(
+        connector=connector, auto_decompress=False
+    ) as session:
+        start: float = time.time()
+        received = await asyncio.gather(
+            *[worker(session) for _ in range(concurrency)]
+        )
+        took: float = time.time() - start
+    return (sum(received), took, latencies)
+
+
+def report(
+    service: str, total: int, size: int, took: float, latencies: List[float]
+) -> None:
+    """logs out the throughput and latencies of a benchmark run"""
+    latencies = sorted(latencies)
+    log_msg(
+        f"{service}: {total} requests in {took:.2f}s "
+        + f"{total / took:.1f} req/s "
+        + f"{size / took / 1024 / 1024:.1f} MB/s "
+        + f"p50: {latencies[len(latencies) // 2] * 1000:.1f}ms "
+        + f"p99: {latencies[int(len(latencies) * 0.99)] * 1000:.1f}ms"
+    )
+
+
+def main() -> None:
+    """runs the benchmark"""
+    parser: ArgumentParser = ArgumentParser()
+    parser.add_argument(
+        "--service",
+        help="price_log_service variant to start locally",
+        choices=SERVICES + ["all"],
+        default="all",
+    )
+    parser.add_argument(
+        "--url", help="benchmark a running service instead", default=""
+    )
+    parser.add_argument(
+        "--price-logs",
+        help="price logs to request from --url, such as 20220101.log.gz",
+        nargs="*",
+        default=[],
+    )
+    parser.add_argument("--days", help="price logs", default=14, type=int)
+    parser.add_argument(
+        "--lines", help="lines per price log", default=100000, type=int
+    )
+    parser.add_argument(
+        "--concurrency", help="concurrent clients", default=32, type=int
+    )
+    parser.add_argument(
+        "--requests", help="total requests", default=1000, type=int
+    )
+    parser.add_argument("--port", help="local port", default=18998, type=int)
+    args: Namespace = parser.parse_args()
+
+    if args.url:
+        if not args.price_logs:
+            log_msg("--url needs a list of --price-logs to request")
+            sys.exit(1)
+        size, took, latencies = asyncio.run(
+            load(args.url, args.price_logs, args.concurrency, args.requests)
+        )
+        report(args.url, args.requests, size, took, latencies)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        log_msg(f"writing {args.days} price logs of {args.lines} lines")
+        price_logs = make_price_logs(tmp_dir, args.days, args.lines)
+        for service in SERVICES if args.service == "all" else [args.service]:
+            process = Process(
+                target=serve, args=(service, tmp_dir, args.port), daemon=True
+            )
+            process.start()
+            try:
+                local_url: str = f"http://127.0.0.1:{args.port}"
+                wait_for_service(local_url, price_logs[0])
+                size, took, latencies = asyncio.run(
+                    load(
+                        local_url, price_logs, args.concurrency, args.requests
+                    )
+                )
+                report(service, args.requests, size, took, latencies)
+            finally:
+                process.terminate()
+                process.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -4,15 +4,26 @@ parses prove-backtesting result files and returns:
 
 223 BuyDropSellRecoveryStrategy backtesting.9029.yaml min:7 wins 20211108 20220919 f:7 b:7
 
+or with --store, queries the results store of the coin backtesting runs
+for the best config of each coin:
+ profit, coin, w,l,s,h, session, run, window, ticker
+
+12.345 BTCUSDT w3,l0,s0,h0 20230101120000 run1 20220131 {"BUY_AT_PERCENTAGE": ...}
+
+or with --store and --keep-sessions, removes all but the most recent
+sessions from the results store.
+
 """
 
 import re
+from argparse import ArgumentParser, Namespace
 from os import listdir
 from os.path import isfile, join
 from typing import Dict, List
 
+from lib.results_store import best_per_coin, prune_sessions, store_path
+
 mypath: str = "./results/"
-results_txt: List = [f for f in listdir(mypath) if isfile(join(mypath, f))]
 
 filename_regex_str: str = (
     r"^prove-backtesting\.(.*\.*\.yaml)\.min(\d+)"
@@ -23,57 +34,119 @@ final_balance_regex: str = (
     r".* PROVE-BACKTESTING: final balance for (.*): (\d+)"
 )
 
-proves_backtesting_files: Dict[str, Dict] = {}
-
-for result_txt in results_txt:
-    matches = re.search(filename_regex_str, result_txt)
-    if matches:
-        proves_backtesting_files[result_txt] = {}
-        proves_backtesting_files[result_txt]["strats"] = {}
-        proves_backtesting_files[result_txt]["config"] = matches.group(1)
-        proves_backtesting_files[result_txt]["min"] = matches.group(2)
-        proves_backtesting_files[result_txt]["wins_profit"] = matches.group(3)
-        proves_backtesting_files[result_txt]["start_date"] = matches.group(4)
-        proves_backtesting_files[result_txt]["end_date"] = matches.group(5)
-        proves_backtesting_files[result_txt]["forward"] = matches.group(6)
-        proves_backtesting_files[result_txt]["backward"] = matches.group(7)
-
-        with open(f"./results/{result_txt}") as f:
-            lines: List = f.readlines()
-
-            if len(lines[-1:]):
-                if "PROVE-BACKTESTING: FINISHED" not in lines[-1:][0]:
+
+def best_prove_backtesting_runs() -> None:
+    """prints the best strategy of every prove-backtesting results file"""
+    results_txt: List = [f for f in listdir(mypath) if isfile(join(mypath, f))]
+    proves_backtesting_files: Dict[str, Dict] = {}
+
+    for result_txt in results_txt:
+        matches = re.search(filename_regex_str, result_txt)
+        if matches:
+            proves_backtesting_files[result_txt] = {}
+            proves_backtesting_files[result_txt]["strats"] = {}
+            proves_backtesting_files[result_txt]["config"] = matches.group(1)
+            proves_backtesting_files[result_txt]["min"] = matches.group(2)
+            proves_backtesting_files[result_txt][
+                "wins_profit"
+            ] = matches.group(3)
+            proves_backtesting_files[result_txt]["start_date"] = matches.group(
+                4
+            )
+            proves_backtesting_files[result_txt]["end_date"] = matches.group(5)
+            proves_backtesting_files[result_txt]["forward"] = matches.group(6)
+            proves_backtesting_files[result_txt]["backward"] = matches.group(7)
+
+            with open(f"./results/{result_txt}") as f:
+                lines: List = f.readlines()
+
+                if len(lines[-1:]):
+                    if "PROVE-BACKTESTING: FINISHED" not in lines[-1:][0]:
+                        continue
+                else:
                     continue
-            else:
-                continue
-
-        with open(f"./results/{result_txt}") as f:
-            for line in f:
-                matches = re.search(final_balance_regex, line)
-                if matches:
-                    strategy: str = matches.group(1)
-                    balance: str = matches.group(2)
-                    proves_backtesting_files[result_txt]["strats"][
-                        strategy
-                    ] = balance
-
-        top_balance: float = float(0)
-        best_strat: str = ""
-        for strat in proves_backtesting_files[result_txt]["strats"].keys():
-            if (
-                float(proves_backtesting_files[result_txt]["strats"][strat])
-                > top_balance
-            ):
-                best_strat = strat
-                top_balance = float(
-                    proves_backtesting_files[result_txt]["strats"][strat]
+
+            with open(f"./results/{result_txt}") as f:
+                for line in f:
+                    matches = re.search(final_balance_regex, line)
+                    if matches:
+                        strategy: str = matches.group(1)
+                        balance: str = matches.group(2)
+                        proves_backtesting_files[result_txt]["strats"][
+                            strategy
+                        ] = balance
+
+            top_balance: float = float(0)
+            best_strat: str = ""
+            for strat in proves_backtesting_files[result_txt]["strats"].keys():
+                if (
+                    float(
+                        proves_backtesting_files[result_txt]["strats"][strat]
+                    )
+                    > top_balance
+                ):
+                    best_strat = strat
+                    top_balance = float(
+                        proves_backtesting_files[result_txt]["strats"][strat]
+                    )
+
+            proves_backtesting_files[result_txt]["best"] = best_strat
+            if proves_backtesting_files[result_txt]["best"] != "":
+                run = proves_backtesting_files[result_txt]
+                print(
+                    f"{run['strats'][best_strat]} {run['best']} {run['config']} "
+                    + f"min:{run['min']} {run['wins_profit']} {run['start_date']} "
+                    + f"{run['end_date']} f:{run['forward']} b:{run['backward']}"
                 )
 
-        proves_backtesting_files[result_txt]["best"] = best_strat
-        if proves_backtesting_files[result_txt]["best"] != "":
-            run = proves_backtesting_files[result_txt]
-            print(
-                f"{run['strats'][best_strat]} {run['best']} {run['config']} "
-                + f"min:{run['min']} {run['wins_profit']} {run['start_date']} "
-                + f"{run['end_date']} f:{run['forward']} b:{run['backward']}"
-            )
+
+def best_coin_configs(store: str, args: Namespace) -> None:
+    """prints the most profitable config of each coin in a results store"""
+    tags: Dict[str, str] = {
+        tag: getattr(args, tag)
+        for tag in ["session", "run", "window"]
+        if getattr(args, tag)
+    }
+    for best in best_per_coin(
+        store,
+        {"MIN_WINS": args.min_wins, "MIN_PROFIT": args.min_profit},
+        **tags,
+    ):
+        print(
+            f"{best['profit']:.3f} {best['coin']} "
+            + f"w{best['wins']},l{best['losses']},"
+            + f"s{best['stales']},h{best['holds']} "
+            + f"{best['session']} {best['run']} {best['window']} "
+            + f"{best['ticker']}"
+        )
+
+
+if __name__ == "__main__":
+    parser: ArgumentParser = ArgumentParser()
+    parser.add_argument(
+        "-s",
+        "--store",
+        help=f"results store to query, such as {store_path('log')}",
+        default="",
+    )
+    parser.add_argument("--session", help="only this session", default="")
+    parser.add_argument("--run", help="only this run", default="")
+    parser.add_argument("--window", help="only this window", default="")
+    parser.add_argument("--min-wins", default=0, type=int)
+    parser.add_argument("--min-profit", default=float("-inf"), type=float)
+    parser.add_argument(
+        "--keep-sessions",
+        help="prune the store down to the most recent N sessions",
+        default=0,
+        type=int,
+    )
+    cli: Namespace = parser.parse_args()
+
+    if cli.store and cli.keep_sessions:
+        print(
+            f"removed {prune_sessions(cli.store, cli.keep_sessions)} results"
+        )
+    elif cli.store:
+        best_coin_configs(cli.store, cli)
+    else:
+        best_prove_backtesting_runs()
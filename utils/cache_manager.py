@@ -0,0 +1,207 @@
+""" manages the klines cache/ directory: stats, evict, compact """
+import re
+import sys
+from argparse import ArgumentParser, Namespace
+from datetime import datetime
+from os import listdir, remove, scandir
+from os.path import exists, isdir
+from time import time
+from typing import Dict, List, Tuple
+
+from lib.klines_store import (
+    CACHE_DIR,
+    delete_from_store,
+    list_store,
+    store_path,
+    write_to_store,
+)
+
+# klines_caching_service cache files are named SYMBOL.<md5 of the query>,
+# anything else in cache/ such as the SYMBOL.precision files, the pickled
+# binance.client, or the daily summaries is left alone.
+KLINES_FILE: re.Pattern = re.compile(r"^[A-Z0-9]+\.[0-9a-f]{32}$")
+
+# klines_caching_service writes klines into a .SYMBOL.<md5>.PID.TID.tmp file
+# and renames it into place, these are only left behind when it dies while
+# writing one, which we take any older than STALE_TMP_AGE to have done.
+TMP_FILE: re.Pattern = re.compile(r"^\.[A-Z0-9]+\.[0-9a-f]{32}\..+\.tmp$")
+STALE_TMP_AGE: float = 3600
+
+UNITS: Dict[str, int] = {"K": 1024, "M": 1024**2, "G": 1024**3}
+
+
+def log_msg(msg: str) -> None:
+    """logs out message prefixed with timestamp"""
+    now: str = datetime.now().strftime("%H:%M:%S")
+    print(f"{now} CACHE-MANAGER: {msg}")
+
+
+def to_bytes(size: str) -> int:
+    """converts a size such as 512M or 10G into bytes"""
+    if size[-1].upper() in UNITS:
+        return int(float(size[:-1]) * UNITS[size[-1].upper()])
+    return int(size)
+
+
+def symbols() -> List[str]:
+    """returns the symbols with a directory in cache/"""
+    return sorted(s for s in listdir(CACHE_DIR) if isdir(f"{CACHE_DIR}/{s}"))
+
+
+def cache_files(symbol: str) -> List[Tuple[str, int, float]]:
+    """returns the (f_path, size, atime) of every klines file of a symbol"""
+    entries: List[Tuple[str, int, float]] = []
+    for entry in scandir(f"{CACHE_DIR}/{symbol}"):
+        if KLINES_FILE.match(entry.name) and entry.is_file():
+            f_stat = entry.stat()
+            entries.append((entry.name, f_stat.st_size, f_stat.st_atime))
+    return entries
+
+
+def all_entries() -> List[Tuple[float, int, str, str, bool]]:
+    """returns (atime, size, symbol, f_path, in_store) for every cached
+    klines query, either as a file or compacted into a symbol store"""
+    entries: List[Tuple[float, int, str, str, bool]] = []
+    for symbol in symbols():
+        for f_path, size, atime in cache_files(symbol):
+            entries.append((atime, size, symbol, f_path, False))
+        if exists(store_path(symbol)):
+            for f_path, size, atime in list_store(symbol):
+                entries.append((atime, size, symbol, f_path, True))
+    return entries
+
+
+def stats(top: int) -> None:
+    """prints out how much we hold in cache/"""
+    entries = all_entries()
+    files = [e for e in entries if not e[4]]
+    stored = [e for e in entries if e[4]]
+    per_symbol: Dict[str, int] = {}
+    for _, size, symbol, _, _ in entries:
+        per_symbol[symbol] = per_symbol.get(symbol, 0) + size
+
+    log_msg(f"symbols: {len(per_symbol)}")
+    log_msg(f"files: {len(files)} bytes: {sum(e[1] for e in files)}")
+    log_msg(f"compacted: {len(stored)} bytes: {sum(e[1] for e in stored)}")
+    if entries:
+        log_msg(
+            "oldest access: "
+            + f"{datetime.fromtimestamp(min(e[0] for e in entries))} "
+            + "newest access: "
+            + f"{datetime.fromtimestamp(max(e[0] for e in entries))}"
+        )
+    for symbol, size in sorted(
+        per_symbol.items(), key=lambda x: x[1], reverse=True
+    )[:top]:
+        log_msg(f" {symbol}: {size} bytes")
+
+
+def remove_stale_tmp_files() -> int:
+    """removes the temporary klines files left behind, returning how many"""
+    removed: int = 0
+    cutoff: float = time() - STALE_TMP_AGE
+    for symbol in symbols():
+        for entry in scandir(f"{CACHE_DIR}/{symbol}"):
+            if (
+                TMP_FILE.match(entry.name)
+                and entry.is_file()
+                and entry.stat().st_mtime < cutoff
+            ):
+                remove(entry.path)
+                removed = removed + 1
+    return removed
+
+
+def evict(max_bytes: int, max_files: int, max_age: float) -> None:
+    """removes the least recently used klines until we are within budget,
+    along with any temporary klines files left behind"""
+    removed: int = remove_stale_tmp_files()
+    if removed:
+        log_msg(f"removed {removed} stale temporary files")
+    entries = sorted(all_entries())
+    total_bytes: int = sum(e[1] for e in entries)
+    total_files: int = len(entries)
+    cutoff: float = time() - max_age if max_age else 0
+
+    from_stores: Dict[str, List[str]] = {}
+    evicted: int = 0
+    for atime, size, symbol, f_path, in_store in entries:
+        if (
+            atime >= cutoff
+            and (not max_bytes or total_bytes <= max_bytes)
+            and (not max_files or total_files <= max_files)
+        ):
+            break
+        if in_store:
+            from_stores.setdefault(symbol, []).append(f_path)
+        else:
+            remove(f"{CACHE_DIR}/{symbol}/{f_path}")
+        total_bytes = total_bytes - size
+        total_files = total_files - 1
+        evicted = evicted + 1
+
+    for symbol, f_paths in from_stores.items():
+        delete_from_store(symbol, f_paths)
+    log_msg(
+        f"evicted {evicted} klines, "
+        + f"{total_files} left using {total_bytes} bytes"
+    )
+
+
+def compact() -> None:
+    """moves the klines files of each symbol into its sqlite store"""
+    for symbol in symbols():
+        files = cache_files(symbol)
+        if not files:
+            continue
+        entries: List[Tuple[str, str, float]] = []
+        for f_path, _, atime in files:
+            with open(f"{CACHE_DIR}/{symbol}/{f_path}") as f:
+                entries.append((f_path, f.read(), atime))
+        write_to_store(symbol, entries)
+        # only remove the files once they are safely in the store
+        for f_path, _, _ in entries:
+            remove(f"{CACHE_DIR}/{symbol}/{f_path}")
+        log_msg(f"compacted {len(entries)} files into {store_path(symbol)}")
+
+
+if __name__ == "__main__":
+    parser: ArgumentParser = ArgumentParser()
+    commands = parser.add_subparsers(dest="command", required=True)
+    stats_parser = commands.add_parser("stats", help="cache/ usage")
+    stats_parser.add_argument(
+        "--top", help="number of symbols to list", default=10, type=int
+    )
+    evict_parser = commands.add_parser(
+        "evict", help="remove least recently used klines"
+    )
+    evict_parser.add_argument(
+        "--max-bytes", help="byte budget, such as 10G", default="0"
+    )
+    evict_parser.add_argument(
+        "--max-files", help="number of klines to keep", default=0, type=int
+    )
+    evict_parser.add_argument(
+        "--max-age-days",
+        help="remove klines not used for this long",
+        default=0,
+        type=float,
+    )
+    commands.add_parser(
+        "compact", help="move klines files into per-symbol stores"
+    )
+    args: Namespace = parser.parse_args()
+
+    if args.command == "stats":
+        stats(args.top)
+    elif args.command == "evict":
+        if not (args.max_bytes != "0" or args.max_files or args.max_age_days):
+            log_msg("evict needs a --max-bytes, --max-files or --max-age-days")
+            sys.exit(1)
+        evict(
+            to_bytes(args.max_bytes),
+            args.max_files,
+            args.max_age_days * 86400,
+        )
+    elif args.command == "compact":
+        compact()
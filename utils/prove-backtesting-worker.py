@@ -0,0 +1,146 @@
+""" runs coin backtesting jobs handed out by a prove-backtesting coordinator """
+import importlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from argparse import ArgumentParser, Namespace
+from datetime import datetime
+from time import sleep, time
+from typing import Any, Dict, Optional
+
+import zmq
+
+from lib.results_store import last_result, store_path
+
+pb = importlib.import_module("utils.prove-backtesting")
+
+# how long to wait on the coordinator before asking again, it doesn't answer
+# while prove-backtesting is busy between runs, such as on forwardtesting
+POLL_TIMEOUT: int = 60000
+
+
+def log_msg(msg: str) -> None:
+    """logs out message prefixed with timestamp"""
+    now: str = datetime.now().strftime("%H:%M:%S")
+    print(f"{now} PROVE-BACKTESTING-WORKER: {msg}")
+
+
+def read_file(f_path: str) -> str:
+    """returns the contents of a file, or an empty string"""
+    if not os.path.exists(f_path):
+        return ""
+    with open(f_path, encoding="utf-8") as f:
+        return f.read()
+
+
+def run_job(job: Dict[str, Any]) -> Dict[str, Any]:
+    """backtests a coin config, returns its results"""
+    conf: str = job["conf"]
+    with open(f"configs/{conf}", "w", encoding="utf-8") as c:
+        c.write(job["config"])
+
+    # the bot appends its results to the backtesting.log in its logs dir,
+    # we want only the results of this job
+    logs_dir: str = tempfile.mkdtemp(dir="tmp", prefix="worker.")
+    start: float = time()
+    pb.wrap_subprocessing(conf, logs_dir=logs_dir)
+    took: float = time() - start
+
+    result: Dict[str, Any] = {
+        "job_id": job["job_id"],
+        "conf": conf,
+        "results_txt": read_file(f"results/backtesting.{conf}.txt"),
+        "backtesting_log": read_file(f"{logs_dir}/backtesting.log"),
+        "results_row": (
+            last_result(store_path(logs_dir), conf)
+            if os.path.exists(store_path(logs_dir))
+            else None
+        ),
+        "wall_time": took,
+        # why the bot stopped the backtest early, such as on MAX_LOSSES
+        "cut_off": json.loads(
+            read_file(f"tmp/{conf}.results.json") or "{}"
+        ).get("cut_off", ""),
+    }
+    shutil.rmtree(logs_dir, ignore_errors=True)
+    # a bot would otherwise pick up the state of this run on the next run
+    for state in ["coins", "wallet", "results"]:
+        if os.path.exists(f"tmp/{conf}.{state}.json"):
+            os.remove(f"tmp/{conf}.{state}.json")
+    return result
+
+
+def work(
+    coordinator: str,
+    stop: threading.Event,
+    poll_timeout: int = POLL_TIMEOUT,
+) -> None:
+    """asks the coordinator for jobs, and sends back their results, until
+    told to stop"""
+    context: zmq.Context = zmq.Context.instance()
+    socket: Optional[zmq.Socket] = None
+    result: Optional[Dict[str, Any]] = None
+    while not stop.is_set():
+        if socket is None:
+            socket = context.socket(zmq.REQ)
+            socket.setsockopt(zmq.LINGER, 0)
+            socket.connect(coordinator)
+
+        # every request carries the results of our previous job
+        socket.send_json({"result": result})
+        if not socket.poll(poll_timeout):
+            # a REQ socket can't send again until it gets a reply, start
+            # over with a new one, sending the same result again.
+            socket.close()
+            socket = None
+            continue
+        reply: Dict[str, Any] = socket.recv_json()  # type: ignore
+        result = None
+
+        if "conf" in reply:
+            log_msg(f"backtesting {reply['conf']}")
+            result = run_job(reply)
+            log_msg(f"{reply['conf']} took {result['wall_time']:.1f}s")
+        else:
+            sleep(float(reply.get("wait", 1)))
+
+    if socket is not None:
+        socket.close()
+
+
+if __name__ == "__main__":
+    parser: ArgumentParser = ArgumentParser()
+    parser.add_argument(
+        "-c",
+        "--coordinator",
+        help="prove-backtesting coordinator, such as tcp://host:5560",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        help="number of concurrent backtests",
+        default=os.cpu_count(),
+        type=int,
+    )
+    args: Namespace = parser.parse_args()
+
+    for directory in ["configs", "log", "results", "tmp"]:
+        os.makedirs(directory, exist_ok=True)
+
+    stop_workers: threading.Event = threading.Event()
+    threads = [
+        threading.Thread(
+            target=work, args=(args.coordinator, stop_workers), daemon=True
+        )
+        for _ in range(args.workers)
+    ]
+    log_msg(f"running {args.workers} workers for {args.coordinator}")
+    for t in threads:
+        t.start()
+    try:
+        for t in threads:
+            t.join()
+    except KeyboardInterrupt:
+        stop_workers.set()
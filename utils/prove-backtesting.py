@@ -1,6 +1,9 @@
 """ prove backtesting """
 import glob
+from bisect import bisect_left, bisect_right
+import hashlib
 import json
+import logging
 import os
 import re
 import subprocess
@@ -8,17 +11,40 @@ import sys
 from argparse import ArgumentParser, Namespace
 from datetime import datetime, timedelta
 from itertools import islice
+from os.path import basename
 from multiprocessing import Pool
-from string import Template
-from time import sleep
-from typing import Any, Dict, List, Optional, Set
-from collections import OrderedDict
+from time import sleep, time
+from typing import Any, Dict, List, Optional, Set, Tuple
 
 import pandas as pd
 import requests
 import yaml
+import zmq
 from tenacity import retry, wait_fixed, stop_after_attempt
 
+import app
+from lib.results_store import (
+    best_per_coin,
+    last_result,
+    save_result,
+    store_path,
+)
+
+
+# the parameters of each run that go into the ticker of a coin config
+TICKER_KEYS: List[str] = [
+    "BUY_AT_PERCENTAGE",
+    "SELL_AT_PERCENTAGE",
+    "STOP_LOSS_AT_PERCENTAGE",
+    "TRAIL_TARGET_SELL_PERCENTAGE",
+    "TRAIL_RECOVERY_PERCENTAGE",
+    "SOFT_LIMIT_HOLDING_TIME",
+    "HARD_LIMIT_HOLDING_TIME",
+    "NAUGHTY_TIMEOUT",
+    "KLINES_TREND_PERIOD",
+    "KLINES_SLICE_PERCENTAGE_CHANGE",
+]
+
 
 @retry(wait=wait_fixed(30), stop=stop_after_attempt(3))
 def get_index_json(query: str) -> requests.Response:
@@ -57,19 +83,271 @@ def flag_checks() -> None:
         sleep(60)
 
 
-def wrap_subprocessing(conf: str, timeout: Optional[int] = 0) -> None:
+def wrap_subprocessing(
+    conf: str, timeout: Optional[int] = 0, logs_dir: str = "log"
+) -> None:
     """wraps subprocess call"""
     if timeout == 0:
         timeout = None
     subprocess.run(
         "python app.py -m backtesting -s tests/fake.yaml "
-        + f"-c configs/{conf} >results/backtesting.{conf}.txt 2>&1",
+        + f"-c configs/{conf} -ld {logs_dir} "
+        + f">results/backtesting.{conf}.txt 2>&1",
         shell=True,
         timeout=timeout,
         check=False,
     )
 
 
+def backtest_in_process(
+    conf: str, cfg: Dict[str, Any], logs_dir: str = "log"
+) -> Tuple[str, float]:
+    """runs a backtest of an in-memory config in this process, logging into
+    results/backtesting.{conf}.txt as an app.py run would, returns its wall
+    time. Meant for pool workers, as it takes over the root logger."""
+    start: float = time()
+    with open("tests/fake.yaml", encoding="utf-8") as _s:
+        secrets: Dict[str, Any] = yaml.safe_load(_s.read())
+
+    output: logging.Handler = logging.FileHandler(
+        f"results/backtesting.{conf}.txt", mode="w"
+    )
+    output.setFormatter(logging.Formatter("[%(levelname)s] %(message)s"))
+    output.setLevel(logging.INFO)
+    handlers: List[logging.Handler] = [output]
+    if cfg["DEBUG"]:
+        debug: logging.Handler = logging.FileHandler(f"{logs_dir}/debug.log")
+        debug.setFormatter(
+            logging.Formatter(
+                f"(%(asctime)s) ({os.getpid()}) (%(lineno)d) (%(funcName)s) "
+                + "[%(levelname)s] %(message)s",
+                datefmt="%Y-%m-%d %H:%M:%S",
+            )
+        )
+        handlers.append(debug)
+
+    root: logging.Logger = logging.getLogger()
+    root.setLevel(logging.DEBUG if cfg["DEBUG"] else logging.INFO)
+    for handler in handlers:
+        root.addHandler(handler)
+    try:
+        app.backtest(f"configs/{conf}", cfg, secrets, logs_dir=logs_dir)
+    except Exception:  # pylint: disable=broad-except
+        # as a crashed app.py would leave its traceback in its results
+        logging.exception(f"backtesting {conf} failed")
+    finally:
+        for handler in handlers:
+            root.removeHandler(handler)
+            handler.close()
+    return (conf, time() - start)
+
+
+class AvailabilityIndex:
+    """the DATES of an index_v2.json.gz, sorted once, so that looking up the
+    coins of a window or the age of the index doesn't scan every day"""
+
+    def __init__(self, dates: Dict[str, List[str]]) -> None:
+        """init"""
+        self.dates: Dict[str, List[str]] = dates
+        self.days: List[str] = sorted(dates.keys())
+        # days with any price logs, empty days don't count towards the age
+        self.non_empty_days: List[str] = [d for d in self.days if dates[d]]
+
+    def days_between(self, first_day: str, last_day: str) -> List[str]:
+        """returns the days in the index from first_day to last_day"""
+        return self.days[
+            bisect_left(self.days, first_day) : bisect_right(
+                self.days, last_day
+            )
+        ]
+
+    def age(self, last_day: str) -> int:
+        """returns the number of days with price logs up to last_day"""
+        return bisect_right(self.non_empty_days, last_day)
+
+
+class Coordinator:
+    """serves coin backtesting jobs to prove-backtesting-worker processes
+    over zeromq, and collects their results"""
+
+    def __init__(self, bind: str, job_timeout: float) -> None:
+        """init"""
+        self.socket: zmq.Socket = zmq.Context.instance().socket(zmq.ROUTER)
+        # raise instead of silently dropping a job sent to a worker that
+        # has gone away, so that we can hand it over to another worker
+        self.socket.setsockopt(zmq.ROUTER_MANDATORY, 1)
+        self.socket.bind(bind)
+        self.job_timeout: float = job_timeout
+        # results of a previous round arriving late are discarded
+        self.round: int = 0
+
+    def run_jobs(
+        self, confs: List[str], configs: Dict[str, Dict[str, Any]]
+    ) -> Dict[str, float]:
+        """hands out the backtesting of each config, in order, to the
+        workers asking for jobs, returns the wall time of each config"""
+        self.round = self.round + 1
+        pending: List[str] = list(confs)
+        in_flight: Dict[str, float] = {}
+        wall_times: Dict[str, float] = {}
+
+        while pending or in_flight:
+            for conf, started in list(in_flight.items()):
+                if time() - started > self.job_timeout:
+                    log_msg(f"no results for {conf}, handing it out again")
+                    del in_flight[conf]
+                    pending.insert(0, conf)
+
+            if not self.socket.poll(1000):
+                continue
+            identity, _, payload = self.socket.recv_multipart()
+            request: Dict[str, Any] = json.loads(payload)
+            if request.get("result"):
+                self.save_result(
+                    request["result"], pending, in_flight, wall_times
+                )
+
+            reply: Dict[str, Any] = {"wait": 1}
+            # never hand out a job again once we have its results
+            while pending and pending[0] in wall_times:
+                pending.pop(0)
+            if pending:
+                conf = pending.pop(0)
+                reply = {
+                    "job_id": f"{self.round}:{conf}",
+                    "conf": conf,
+                    "config": json.dumps(configs[conf]),
+                }
+                in_flight[conf] = time()
+            try:
+                self.socket.send_multipart(
+                    [identity, b"", json.dumps(reply).encode()]
+                )
+            except zmq.ZMQError:
+                if "conf" in reply:
+                    del in_flight[reply["conf"]]
+                    pending.insert(0, reply["conf"])
+        return wall_times
+
+    def save_result(
+        self,
+        result: Dict[str, Any],
+        pending: List[str],
+        in_flight: Dict[str, float],
+        wall_times: Dict[str, float],
+    ) -> None:
+        """saves the results of a job as if it had been run locally"""
+        conf: str = result["conf"]
+        if result["job_id"] != f"{self.round}:{conf}":
+            return
+        # a job that timed out might have been queued, or handed out, again
+        # by the time its results arrive, either way we're done with it.
+        in_flight.pop(conf, None)
+        while conf in pending:
+            pending.remove(conf)
+        if conf in wall_times:
+            return
+        with open(
+            f"results/backtesting.{conf}.txt", "w", encoding="utf-8"
+        ) as r:
+            r.write(result["results_txt"])
+        with open("log/backtesting.log", "a", encoding="utf-8") as b:
+            b.write(result["backtesting_log"])
+        if result.get("results_row"):
+            save_result(store_path("log"), result["results_row"])
+        wall_times[conf] = float(result["wall_time"])
+
+    def close(self) -> None:
+        """closes the coordinator socket"""
+        self.socket.close(linger=0)
+
+
+def code_version(strategy: str) -> str:
+    """returns a hash of the bot and strategy code a backtest runs"""
+    digest = hashlib.sha256()
+    for f_path in [f"strategies/{strategy}.py", "app.py"] + sorted(
+        glob.glob("lib/*.py")
+    ):
+        if os.path.exists(f_path):
+            with open(f_path, "rb") as source:
+                digest.update(f_path.encode() + b"\0" + source.read())
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """persistent cache of coin backtesting results, keyed by a hash of
+    the code, the coin config and the versions of its price logs"""
+
+    def __init__(
+        self, cache_dir: str, price_log_service_url: str, code: str
+    ) -> None:
+        """init"""
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir: str = cache_dir
+        self.price_log_service_url: str = price_log_service_url
+        self.code: str = code
+        # the ETag of every price log we have asked about in this session
+        self.versions: Dict[str, str] = {}
+        self.session: requests.Session = requests.Session()
+
+    def price_log_version(self, price_log: str) -> str:
+        """returns the ETag or Last-Modified of a price log, or an empty
+        string if the price-log-service didn't give us one"""
+        if price_log not in self.versions:
+            try:
+                response: requests.Response = self.session.head(
+                    f"{self.price_log_service_url}/{price_log}", timeout=15
+                )
+                version: str = ""
+                if response.status_code == 200:
+                    version = response.headers.get(
+                        "ETag", response.headers.get("Last-Modified", "")
+                    )
+            except requests.exceptions.RequestException:
+                # don't remember it, we might get it on the next run
+                return ""
+            self.versions[price_log] = version
+        return self.versions[price_log]
+
+    def key(self, coin_config: Dict[str, Any]) -> str:
+        """returns the cache key of a coin config, or an empty string when
+        we can't tell which version of its price logs it would run on"""
+        cfg: Dict[str, Any] = dict(coin_config)
+        # the same backtest in another session, run or window
+        cfg.pop("RESULTS_TAGS", None)
+        digest = hashlib.sha256(
+            self.code.encode()
+            + b"\0"
+            + json.dumps(cfg, sort_keys=True).encode()
+        )
+        for price_log in cfg["PRICE_LOGS"]:
+            version: str = self.price_log_version(price_log)
+            if not version:
+                return ""
+            digest.update(f"{price_log}|{version}".encode())
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """returns the results_txt, backtesting_log and results_row of a
+        cached result"""
+        try:
+            with open(f"{self.cache_dir}/{key}.json", encoding="utf-8") as c:
+                return json.load(c)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key: str, result: Dict[str, Any]) -> None:
+        """saves a result, written to a temporary file and renamed into
+        place so that a crash never leaves a partial result behind"""
+        with open(
+            f"{self.cache_dir}/{key}.json.tmp", "w", encoding="utf-8"
+        ) as c:
+            json.dump(result, c)
+        os.replace(
+            f"{self.cache_dir}/{key}.json.tmp", f"{self.cache_dir}/{key}.json"
+        )
+
+
 class ProveBacktesting:
     """ProveBacktesting"""
 
@@ -111,6 +389,13 @@ class ProveBacktesting:
         self.klines_caching_service_url: str = cfg[
             "KLINES_CACHING_SERVICE_URL"
         ]
+        self.klines_shared_memory_dir: str = cfg.get(
+            "KLINES_SHARED_MEMORY_DIR", ""
+        )
+        self.price_log_cache_dir: str = cfg.get("PRICE_LOG_CACHE_DIR", "")
+        self.price_log_cache_size: int = int(
+            cfg.get("PRICE_LOG_CACHE_SIZE", 10 * 1024**3)
+        )
         self.price_log_service_url: str = cfg["PRICE_LOG_SERVICE_URL"]
         self.concurrency: int = int(cfg["CONCURRENCY"])
         self.start_dates: List[str] = self.generate_start_dates(
@@ -122,12 +407,53 @@ class ProveBacktesting:
         self.max_stales: int = int(cfg["MAX_STALES"])
         self.max_holds: int = int(cfg["MAX_HOLDS"])
         self.valid_tokens: list[str] = cfg.get("VALID_TOKENS", [])
+        # built on first use from the index DATES
+        self.availability: Optional[AvailabilityIndex] = None
+        # coins we have already checked for their pairing and FILTER_BY
+        self.eligible: Dict[str, bool] = {}
+        # runs the forwardtesting of a window in the background, while we
+        # backtest the next window.
+        self.overlap_forward_testing: bool = bool(
+            cfg.get("OVERLAP_FORWARD_TESTING", False)
+        )
+        # symbols such as BTCUSDT whose prices are merged into the price logs
+        # of every coin run, for strategies that look at BTC as well.
+        self.extra_price_log_symbols: List[str] = cfg.get(
+            "EXTRA_PRICE_LOG_SYMBOLS", []
+        )
 
         self.index_json: Dict[str, Any] = json.loads(
             get_index_json(
                 f"{self.price_log_service_url}/index_v2.json.gz"
             ).content
         )
+        # hands out the coin backtests to prove-backtesting-worker processes
+        # instead of running them here, such as tcp://*:5560
+        self.coordinator_bind: str = cfg.get("COORDINATOR_BIND", "")
+        self.job_timeout: float = float(cfg.get("JOB_TIMEOUT", 3600))
+        self.coordinator: Optional[Coordinator] = None
+        # past runtimes of each coin backtest, in seconds per day of price
+        # logs, used to backtest the slowest coins first.
+        self.runtimes_file: str = "state/prove-backtesting.runtimes.json"
+        self.runtimes: Dict[str, float] = self.load_runtimes()
+        # days of price logs each coin is backtested over in this window
+        self.coin_days: Dict[str, int] = {}
+        # the configs of the coin backtesting runs, and of the last
+        # forwardtesting run, kept in memory and handed over to the
+        # backtests. Only written to configs/ with DEBUG.
+        self.coin_configs: Dict[str, Dict[str, Any]] = {}
+        self.optimized_config: Dict[str, Any] = {}
+        # tags the results of this session in the results store
+        self.session: str = datetime.now().strftime("%Y%m%d%H%M%S")
+        # keeps the results of every coin backtest across prove-backtesting
+        # sessions, so that only new windows or changed parameters are run
+        self.result_cache: Optional[ResultCache] = None
+        if cfg.get("RESULT_CACHE_DIR", ""):
+            self.result_cache = ResultCache(
+                cfg["RESULT_CACHE_DIR"],
+                self.price_log_service_url,
+                code_version(self.strategy),
+            )
         self.cfg: Dict[str, Any] = cfg
 
     def generate_start_dates(
@@ -189,111 +515,60 @@ class ProveBacktesting:
                 urls.append(f"{day}.log.gz")
         return urls
 
+    def write_config(self, conf: str, cfg: Dict[str, Any]) -> None:
+        """writes a config into configs/, for debugging. JSON is valid
+        YAML, so it can be backtested on its own with app.py"""
+        with open(f"configs/{conf}", "wt", encoding="utf-8") as c:
+            json.dump(cfg, c, indent=2)
+
     def write_single_coin_config(
-        self, symbol: str, _price_logs: List[str], thisrun: Dict[str, Any]
+        self,
+        symbol: str,
+        _price_logs: List[str],
+        thisrun: Dict[str, Any],
+        tags: Optional[Dict[str, str]] = None,
     ) -> None:
-        """generates a config.yaml for a coin"""
+        """generates the config for a coin"""
 
         if self.filter_by not in symbol:
             return
 
-        tmpl: Template = Template(
-            """{
-        "CLEAR_COIN_STATS_AT_BOOT": $CLEAR_COIN_STATS_AT_BOOT,
-        "CLEAR_COIN_STATS_AT_SALE": $CLEAR_COIN_STATS_AT_SALE,
-        "DEBUG": $DEBUG,
-        "ENABLE_NEW_LISTING_CHECKS": $ENABLE_NEW_LISTING_CHECKS,
-        "ENABLE_NEW_LISTING_CHECKS_AGE_IN_DAYS": $ENABLE_NEW_LISTING_CHECKS_AGE_IN_DAYS,
-        "INITIAL_INVESTMENT": $INITIAL_INVESTMENT,
-        "KLINES_CACHING_SERVICE_URL": "$KLINES_CACHING_SERVICE_URL",
-        "MAX_COINS": 1,
-        "PAIRING": "$PAIRING",
-        "PAUSE_FOR": $PAUSE_FOR,
-        "PRICE_LOGS": $PRICE_LOGS,
-        "PRICE_LOG_SERVICE_URL": "$PRICE_LOG_SERVICE_URL",
-        "RE_INVEST_PERCENTAGE": $RE_INVEST_PERCENTAGE,
-        "SELL_AS_SOON_IT_DROPS": $SELL_AS_SOON_IT_DROPS,
-        "STOP_BOT_ON_LOSS": $STOP_BOT_ON_LOSS,
-        "STOP_BOT_ON_STALE": $STOP_BOT_ON_STALE,
-        "STRATEGY": "$STRATEGY",
-        "TICKERS": {
-          "$COIN": {
-              "BUY_AT_PERCENTAGE": "$BUY_AT_PERCENTAGE",
-              "SELL_AT_PERCENTAGE": "$SELL_AT_PERCENTAGE",
-              "STOP_LOSS_AT_PERCENTAGE": "$STOP_LOSS_AT_PERCENTAGE",
-              "TRAIL_TARGET_SELL_PERCENTAGE": "$TRAIL_TARGET_SELL_PERCENTAGE",
-              "TRAIL_RECOVERY_PERCENTAGE": "$TRAIL_RECOVERY_PERCENTAGE",
-              "SOFT_LIMIT_HOLDING_TIME": "$SOFT_LIMIT_HOLDING_TIME",
-              "HARD_LIMIT_HOLDING_TIME": "$HARD_LIMIT_HOLDING_TIME",
-              "NAUGHTY_TIMEOUT": "$NAUGHTY_TIMEOUT",
-              "KLINES_TREND_PERIOD": "$KLINES_TREND_PERIOD",
-              "KLINES_SLICE_PERCENTAGE_CHANGE": "$KLINES_SLICE_PERCENTAGE_CHANGE"
-          }
-         },
-        "TRADING_FEE": $TRADING_FEE,
-        }"""
-        )
-
-        # on our coin backtesting runs, we want to quit early if we are using
-        # a mode that discards runs with STALES or LOSSES
-        stop_bot_on_loss = False
-        stop_bot_on_stale = False
-
-        if self.max_losses == 0:
-            stop_bot_on_loss = True
-        if self.max_stales == 0:
-            stop_bot_on_stale = True
-
-        with open(f"configs/coin.{symbol}.yaml", "wt") as c:
-            c.write(
-                tmpl.substitute(
-                    {
-                        "CLEAR_COIN_STATS_AT_BOOT": True,
-                        "CLEAR_COIN_STATS_AT_SALE": self.clear_coin_stats_at_sale,
-                        "COIN": symbol,
-                        "DEBUG": self.debug,
-                        "ENABLE_NEW_LISTING_CHECKS": False,
-                        "ENABLE_NEW_LISTING_CHECKS_AGE_IN_DAYS": 1,
-                        "INITIAL_INVESTMENT": self.initial_investment,
-                        "KLINES_CACHING_SERVICE_URL": self.klines_caching_service_url,
-                        # each coin backtesting run should only use one coin
-                        # MAX_COINS will only be applied to the final optimized run
-                        "MAX_COINS": 1,
-                        "PAIRING": self.pairing,
-                        "PAUSE_FOR": self.pause_for,
-                        "PRICE_LOGS": _price_logs,
-                        "PRICE_LOG_SERVICE_URL": self.price_log_service_url,
-                        "RE_INVEST_PERCENTAGE": 100,
-                        "SELL_AS_SOON_IT_DROPS": self.sell_as_soon_it_drops,
-                        "STOP_BOT_ON_LOSS": stop_bot_on_loss,
-                        "STOP_BOT_ON_STALE": stop_bot_on_stale,
-                        "STRATEGY": self.strategy,
-                        "TRADING_FEE": self.trading_fee,
-                        "BUY_AT_PERCENTAGE": thisrun["BUY_AT_PERCENTAGE"],
-                        "SELL_AT_PERCENTAGE": thisrun["SELL_AT_PERCENTAGE"],
-                        "STOP_LOSS_AT_PERCENTAGE": thisrun[
-                            "STOP_LOSS_AT_PERCENTAGE"
-                        ],
-                        "TRAIL_TARGET_SELL_PERCENTAGE": thisrun[
-                            "TRAIL_TARGET_SELL_PERCENTAGE"
-                        ],
-                        "TRAIL_RECOVERY_PERCENTAGE": thisrun[
-                            "TRAIL_RECOVERY_PERCENTAGE"
-                        ],
-                        "SOFT_LIMIT_HOLDING_TIME": thisrun[
-                            "SOFT_LIMIT_HOLDING_TIME"
-                        ],
-                        "HARD_LIMIT_HOLDING_TIME": thisrun[
-                            "HARD_LIMIT_HOLDING_TIME"
-                        ],
-                        "NAUGHTY_TIMEOUT": thisrun["NAUGHTY_TIMEOUT"],
-                        "KLINES_TREND_PERIOD": thisrun["KLINES_TREND_PERIOD"],
-                        "KLINES_SLICE_PERCENTAGE_CHANGE": thisrun[
-                            "KLINES_SLICE_PERCENTAGE_CHANGE"
-                        ],
-                    }
-                )
-            )
+        conf: str = f"coin.{symbol}.yaml"
+        self.coin_configs[conf] = {
+            "CLEAR_COIN_STATS_AT_BOOT": True,
+            "CLEAR_COIN_STATS_AT_SALE": self.clear_coin_stats_at_sale,
+            "DEBUG": self.debug,
+            "ENABLE_NEW_LISTING_CHECKS": False,
+            "ENABLE_NEW_LISTING_CHECKS_AGE_IN_DAYS": 1,
+            "INITIAL_INVESTMENT": self.initial_investment,
+            "KLINES_CACHING_SERVICE_URL": self.klines_caching_service_url,
+            "KLINES_SHARED_MEMORY_DIR": self.klines_shared_memory_dir,
+            "PRICE_LOG_CACHE_DIR": self.price_log_cache_dir,
+            "PRICE_LOG_CACHE_SIZE": self.price_log_cache_size,
+            # each coin backtesting run should only use one coin
+            # MAX_COINS will only be applied to the final optimized run
+            "MAX_COINS": 1,
+            # on our coin backtesting runs, we want to quit as soon as a run
+            # has more LOSSES or STALES than we accept, as those runs are
+            # discarded anyway
+            "MAX_LOSSES": self.max_losses,
+            "MAX_STALES": self.max_stales,
+            "PAIRING": self.pairing,
+            "PAUSE_FOR": self.pause_for,
+            "PRICE_LOGS": list(_price_logs),
+            "PRICE_LOG_SERVICE_URL": self.price_log_service_url,
+            "RE_INVEST_PERCENTAGE": 100,
+            # where this result belongs in the results store
+            "RESULTS_TAGS": dict(tags or {}),
+            "SELL_AS_SOON_IT_DROPS": self.sell_as_soon_it_drops,
+            "STRATEGY": self.strategy,
+            "TICKERS": {
+                symbol: {key: str(thisrun[key]) for key in TICKER_KEYS}
+            },
+            "TRADING_FEE": self.trading_fee,
+        }
+        if self.debug:
+            self.write_config(conf, self.coin_configs[conf])
 
     def write_optimized_strategy_config(
         self,
@@ -301,23 +576,16 @@ class ProveBacktesting:
         _tickers: Dict[str, Any],
         s_balance: float,
     ) -> None:
-        """generates a config.yaml for forwardtesting optimized run"""
-
-        # we keep "state" between optimized runs, by soaking up an existing
-        # optimized config file and an existing wallet.json file
-        # while this could cause the bot as it starts to run  to pull old
-        # optimized config files from old runs, we only consume those for
-        # matching ticker info to the contents of our wallet.json, and we clean
-        # up the json files at the start and end of the prove-backtesting.
-        # so we don't expect to ever consume old tickers info from an old
-        # config file.
-        old_tickers: Dict[str, Any] = {}
+        """generates the config for forwardtesting optimized run"""
+
+        # we keep "state" between optimized runs, by soaking up the previous
+        # optimized config and an existing wallet.json file. We only consume
+        # those for matching ticker info to the contents of our wallet.json,
+        # and we clean up the json files at the start and end of the
+        # prove-backtesting, so we don't expect to ever consume old tickers
+        # info from an old session.
+        old_tickers: Dict[str, Any] = self.optimized_config.get("TICKERS", {})
         old_wallet: List[str] = []
-        if os.path.exists(f"configs/optimized.{self.strategy}.yaml"):
-            with open(
-                f"configs/optimized.{self.strategy}.yaml", encoding="utf-8"
-            ) as c:
-                old_tickers = yaml.safe_load(c.read())["TICKERS"]
 
         if os.path.exists(f"tmp/optimized.{self.strategy}.yaml.wallet.json"):
             with open(f"tmp/optimized.{self.strategy}.yaml.wallet.json") as w:
@@ -335,56 +603,58 @@ class ProveBacktesting:
         _tickers = z
         log_msg(f" tickers: {_tickers}")
 
-        tmpl: Template = Template(
-            """{
-        "CLEAR_COIN_STATS_AT_BOOT": $CLEAR_COIN_STATS_AT_BOOT,
-        "CLEAR_COIN_STATS_AT_SALE": $CLEAR_COIN_STATS_AT_SALE,
-        "DEBUG": $DEBUG,
-        "ENABLE_NEW_LISTING_CHECKS": $ENABLE_NEW_LISTING_CHECKS,
-        "ENABLE_NEW_LISTING_CHECKS_AGE_IN_DAYS": $ENABLE_NEW_LISTING_CHECKS_AGE_IN_DAYS,
-        "INITIAL_INVESTMENT": $INITIAL_INVESTMENT,
-        "KLINES_CACHING_SERVICE_URL": "$KLINES_CACHING_SERVICE_URL",
-        "MAX_COINS": $MAX_COINS,
-        "PAIRING": "$PAIRING",
-        "PAUSE_FOR": $PAUSE_FOR,
-        "PRICE_LOGS": $PRICE_LOGS,
-        "PRICE_LOG_SERVICE_URL": "$PRICE_LOG_SERVICE_URL",
-        "RE_INVEST_PERCENTAGE": $RE_INVEST_PERCENTAGE,
-        "SELL_AS_SOON_IT_DROPS": $SELL_AS_SOON_IT_DROPS,
-        "STOP_BOT_ON_LOSS": $STOP_BOT_ON_LOSS,
-        "STOP_BOT_ON_STALE": $STOP_BOT_ON_STALE,
-        "STRATEGY": "$STRATEGY",
-        "TICKERS": $TICKERS,
-        "TRADING_FEE": $TRADING_FEE
-        }"""
-        )
-
-        with open(f"configs/optimized.{self.strategy}.yaml", "wt") as c:
-            c.write(
-                tmpl.substitute(
-                    {
-                        "CLEAR_COIN_STATS_AT_BOOT": self.clear_coin_stats_at_boot,
-                        "CLEAR_COIN_STATS_AT_SALE": self.clear_coin_stats_at_sale,
-                        "DEBUG": self.debug,
-                        "ENABLE_NEW_LISTING_CHECKS": self.enable_new_listing_checks,
-                        "ENABLE_NEW_LISTING_CHECKS_AGE_IN_DAYS": self.enable_new_listing_checks_age_in_days,  # pylint: disable=line-too-long
-                        "INITIAL_INVESTMENT": s_balance,
-                        "KLINES_CACHING_SERVICE_URL": self.klines_caching_service_url,
-                        "MAX_COINS": self.max_coins,
-                        "PAIRING": self.pairing,
-                        "PAUSE_FOR": self.pause_for,
-                        "PRICE_LOGS": _price_logs,
-                        "PRICE_LOG_SERVICE_URL": self.price_log_service_url,
-                        "RE_INVEST_PERCENTAGE": self.re_invest_percentage,
-                        "SELL_AS_SOON_IT_DROPS": self.sell_as_soon_it_drops,
-                        "STOP_BOT_ON_LOSS": self.stop_bot_on_loss,
-                        "STOP_BOT_ON_STALE": self.stop_bot_on_stale,
-                        "STRATEGY": self.strategy,
-                        "TICKERS": _tickers,
-                        "TRADING_FEE": self.trading_fee,
-                    }
+        self.optimized_config = {
+            "CLEAR_COIN_STATS_AT_BOOT": self.clear_coin_stats_at_boot,
+            "CLEAR_COIN_STATS_AT_SALE": self.clear_coin_stats_at_sale,
+            "DEBUG": self.debug,
+            "ENABLE_NEW_LISTING_CHECKS": self.enable_new_listing_checks,
+            "ENABLE_NEW_LISTING_CHECKS_AGE_IN_DAYS": self.enable_new_listing_checks_age_in_days,  # pylint: disable=line-too-long
+            "INITIAL_INVESTMENT": s_balance,
+            "KLINES_CACHING_SERVICE_URL": self.klines_caching_service_url,
+            "KLINES_SHARED_MEMORY_DIR": self.klines_shared_memory_dir,
+            "PRICE_LOG_CACHE_DIR": self.price_log_cache_dir,
+            "PRICE_LOG_CACHE_SIZE": self.price_log_cache_size,
+            "MAX_COINS": self.max_coins,
+            "PAIRING": self.pairing,
+            "PAUSE_FOR": self.pause_for,
+            "PRICE_LOGS": list(_price_logs),
+            "PRICE_LOG_SERVICE_URL": self.price_log_service_url,
+            "RE_INVEST_PERCENTAGE": self.re_invest_percentage,
+            "SELL_AS_SOON_IT_DROPS": self.sell_as_soon_it_drops,
+            "STOP_BOT_ON_LOSS": self.stop_bot_on_loss,
+            "STOP_BOT_ON_STALE": self.stop_bot_on_stale,
+            "STRATEGY": self.strategy,
+            "TICKERS": _tickers,
+            "TRADING_FEE": self.trading_fee,
+        }
+        if self.debug:
+            self.write_config(
+                f"optimized.{self.strategy}.yaml", self.optimized_config
+            )
+
+    def availability_of(self, data: Dict[str, Any]) -> AvailabilityIndex:
+        """returns the AvailabilityIndex of the index DATES, built once"""
+        if self.availability is None or self.availability.dates is not data:
+            self.availability = AvailabilityIndex(data)
+        return self.availability
+
+    def is_eligible(self, coin: str) -> bool:
+        """checks if a coin is one of our pairing, and not a BULL/BEAR token"""
+        if coin not in self.eligible:
+            self.eligible[coin] = (
+                not any(
+                    f"{w}{self.pairing}" in coin
+                    for w in ["UP", "DOWN", "BULL", "BEAR"]
+                )
+                and not any(
+                    f"{self.pairing}{w}" in coin
+                    for w in ["UP", "DOWN", "BULL", "BEAR"]
                 )
+                and self.filter_by in coin
+                and self.pairing in coin
+                and coin.endswith(self.pairing)
             )
+        return self.eligible[coin]
 
     def filter_on_avail_days_with_log(
         self, dates: List[str], data: Dict[str, Any]
@@ -395,27 +665,21 @@ class ProveBacktesting:
         """
 
         next_run_coins: Dict[str, Any] = {}
-
-        for day in data.keys():
-            if day in dates:
-                for coin in data[day]:
-                    # discard any BULL/BEAR tokens
-                    if any(
-                        f"{w}{self.pairing}" in coin
-                        for w in ["UP", "DOWN", "BULL", "BEAR"]
-                    ) or any(
-                        f"{self.pairing}{w}" in coin
-                        for w in ["UP", "DOWN", "BULL", "BEAR"]
-                    ):
-                        continue
-                    if (
-                        self.filter_by in coin
-                        and self.pairing in coin
-                        and coin.endswith(self.pairing)
-                    ):
-                        if coin not in next_run_coins:
-                            next_run_coins[coin] = []
-                        next_run_coins[coin].append(f"{coin}/{day}.log.gz")
+        if not dates:
+            return next_run_coins
+
+        wanted: Set[str] = set(dates)
+        for day in self.availability_of(data).days_between(
+            min(dates), max(dates)
+        ):
+            if day not in wanted:
+                continue
+            for coin in data[day]:
+                # discard any BULL/BEAR tokens, and other pairings
+                if self.is_eligible(coin):
+                    if coin not in next_run_coins:
+                        next_run_coins[coin] = []
+                    next_run_coins[coin].append(f"{coin}/{day}.log.gz")
 
         return next_run_coins
 
@@ -430,39 +694,19 @@ class ProveBacktesting:
         as per the enable_new_listing_checks_age_in_days setting
         """
 
-        all_logs: Dict[str, Any] = {}
-
-        # from the dict containing all the coins and the price logs to test,
-        # drop any coin that doesn't have the required number of logs
-        # as per the enable_new_listing_checks_age_in_days setting
-        for day in index.keys():
-            # skip any empty dates in index.json.gz
-            if not index[day]:
-                continue
-            # we need to make sure we don't keep dates past the last day
-            # we're backtesting
-            if datetime.strptime(day, "%Y%m%d") > datetime.strptime(
-                last_day, "%Y%m%d"
-            ):
-                continue
+        # every coin is given the number of days with price logs in the
+        # index up to the last day we're backtesting, skipping empty days
+        if (
+            self.availability_of(index).age(last_day)
+            <= self.enable_new_listing_checks_age_in_days
+        ):
             for coin in list(next_run_coins.keys()):
-                if coin not in all_logs:
-                    all_logs[coin] = []
-                all_logs[coin].append(f"{coin}/{day}.log.gz")
-
-        for coin in list(next_run_coins.keys()):
-            if (
-                len(all_logs[coin])
-                <= self.enable_new_listing_checks_age_in_days
-            ):
                 del next_run_coins[coin]
 
         return next_run_coins
 
-    def write_all_coin_configs(
-        self, dates: List[str], thisrun: Dict[str, Any]
-    ) -> Set[str]:
-        """generate all coinfiles"""
+    def coins_to_backtest(self, dates: List[str]) -> Dict[str, Any]:
+        """returns the coins and their price logs to backtest for these dates"""
 
         index_dates = self.index_json["DATES"]
 
@@ -483,9 +727,42 @@ class ProveBacktesting:
             next_run_coins = self.filter_on_coins_with_min_age_logs(
                 index_dates, dates[-1], next_run_coins
             )
+        return next_run_coins
+
+    def merged_price_logs(
+        self, coin: str, _price_logs: List[str]
+    ) -> List[str]:
+        """returns the price_log_service /merge queries for the price logs of
+        a coin together with the EXTRA_PRICE_LOG_SYMBOLS, one per day"""
+        if not self.extra_price_log_symbols:
+            return _price_logs
+
+        symbols: str = ",".join(
+            [coin] + [s for s in self.extra_price_log_symbols if s != coin]
+        )
+        return [
+            f"merge?symbols={symbols}&dates={basename(log).split('.')[0]}"
+            for log in _price_logs
+        ]
 
+    def write_all_coin_configs(
+        self, dates: List[str], thisrun: Dict[str, Any], _run: str = ""
+    ) -> Set[str]:
+        """generate all coinfiles"""
+
+        next_run_coins: Dict[str, Any] = self.coins_to_backtest(dates)
+        self.coin_days = {}
+        self.coin_configs = {}
+        tags: Dict[str, str] = {
+            "SESSION": self.session,
+            "RUN": _run,
+            "WINDOW": dates[-1],
+        }
         for coin, _price_logs in next_run_coins.items():
-            self.write_single_coin_config(coin, _price_logs, thisrun)
+            self.coin_days[coin] = len(_price_logs)
+            self.write_single_coin_config(
+                coin, self.merged_price_logs(coin, _price_logs), thisrun, tags
+            )
 
         return set(next_run_coins.keys())
 
@@ -494,24 +771,31 @@ class ProveBacktesting:
     ) -> Dict[str, Any]:
         """parallel_backtest_all_coins"""
 
-        tasks: List[Any] = []
-        with Pool(processes=n_tasks) as pool:
-            for coin in _coin_list:
-                if self.filter_by in coin and self.pairing in coin:
-                    # then we backtesting this strategy run against each coin
-                    # ocasionally we get stuck runs, so we timeout a coin run
-                    # to a maximum of 15 minutes
-                    job: Any = pool.apply_async(
-                        wrap_subprocessing,
-                        (f"coin.{coin}.yaml",),
-                    )
-                    tasks.append(job)
-
-            for t in tasks:
-                try:
-                    t.get()
-                except subprocess.TimeoutExpired as excp:
-                    log_msg(f"timeout while running: {excp}")
+        start: float = time()
+        keys: Dict[str, str] = {}
+        to_backtest: Set[str] = _coin_list
+        if self.result_cache is not None:
+            keys = {
+                coin: self.result_cache.key(
+                    self.coin_configs[f"coin.{coin}.yaml"]
+                )
+                for coin in self.coins_to_run(_coin_list)
+            }
+            cached: Set[str] = self.restore_cached_results(keys)
+            to_backtest = _coin_list - cached
+            log_msg(f" {_run}: {len(cached)} coins from the result cache")
+
+        if self.coordinator_bind:
+            wall_times = self.distributed_backtest_all_coins(to_backtest)
+        else:
+            wall_times = self.local_backtest_all_coins(to_backtest, n_tasks)
+
+        self.log_wall_times(_run, wall_times, time() - start)
+        self.save_runtimes(wall_times)
+        if self.result_cache is not None:
+            self.cache_results(
+                {coin: keys[coin] for coin in wall_times if keys.get(coin)}
+            )
 
         for coin in _coin_list:
             try:
@@ -523,6 +807,185 @@ class ProveBacktesting:
 
         return self.sum_of_results_from_run(_coin_list, _run)
 
+    def restore_cached_results(self, keys: Dict[str, str]) -> Set[str]:
+        """writes the cached results of coins as if they had just been
+        backtested, returns the coins found in the cache"""
+        assert self.result_cache is not None
+        cached: Set[str] = set()
+        with open("log/backtesting.log", "a", encoding="utf-8") as b:
+            for coin, key in keys.items():
+                result = self.result_cache.get(key) if key else None
+                if result is None or "results_row" not in result:
+                    continue
+                with open(
+                    f"results/backtesting.coin.{coin}.yaml.txt",
+                    "w",
+                    encoding="utf-8",
+                ) as r:
+                    r.write(result["results_txt"])
+                b.write(result["backtesting_log"])
+                # the cached result, as if it came from this run
+                tags: Dict[str, str] = self.results_tags(f"coin.{coin}.yaml")
+                save_result(
+                    store_path("log"),
+                    dict(
+                        result["results_row"],
+                        session=tags.get("SESSION", ""),
+                        run=tags.get("RUN", ""),
+                        window=tags.get("WINDOW", ""),
+                        created=time(),
+                    ),
+                )
+                cached.add(coin)
+        return cached
+
+    def results_tags(self, conf: str) -> Dict[str, str]:
+        """returns the RESULTS_TAGS of a coin config"""
+        return self.coin_configs[conf].get("RESULTS_TAGS", {})
+
+    def cache_results(self, keys: Dict[str, str]) -> None:
+        """saves the results of the coins we have just backtested"""
+        assert self.result_cache is not None
+        # the last line of each coin config in the backtesting.log
+        log_lines: Dict[str, str] = {}
+        if os.path.exists("log/backtesting.log"):
+            with open("log/backtesting.log", encoding="utf-8") as b:
+                for line in b:
+                    for field in line.split("|")[0:5]:
+                        if field.startswith("cfg:"):
+                            log_lines[field[4:]] = line
+        for coin, key in keys.items():
+            conf: str = f"coin.{coin}.yaml"
+            tags: Dict[str, str] = self.results_tags(conf)
+            row: Optional[Dict[str, Any]] = last_result(
+                store_path("log"), conf
+            )
+            # a bot that crashed never got to write its results, and the
+            # last ones in the store belong to an earlier run
+            if (
+                conf not in log_lines
+                or row is None
+                or row["session"] != tags.get("SESSION", "")
+                or row["run"] != tags.get("RUN", "")
+                or row["window"] != tags.get("WINDOW", "")
+            ):
+                continue
+            with open(
+                f"results/backtesting.{conf}.txt", encoding="utf-8"
+            ) as r:
+                results_txt: str = r.read()
+            self.result_cache.put(
+                key,
+                {
+                    "results_txt": results_txt,
+                    "backtesting_log": log_lines[conf],
+                    "results_row": row,
+                },
+            )
+
+    def coins_to_run(self, _coin_list: Set[str]) -> List[str]:
+        """returns the coins to backtest in this run, slowest first"""
+        return [
+            coin
+            for coin in self.coins_by_cost(_coin_list)
+            if self.filter_by in coin and self.pairing in coin
+        ]
+
+    def local_backtest_all_coins(
+        self, _coin_list: Set[str], n_tasks: int
+    ) -> Dict[str, float]:
+        """backtests each coin on a local pool, returns their wall times"""
+        tasks: List[Any] = []
+        wall_times: Dict[str, float] = {}
+        # a worker per coin run, as the Bots of a run are kept alive by
+        # their lru_cache'd methods, such as get_step_size(), and would
+        # otherwise pile up in the workers for the whole session.
+        with Pool(processes=n_tasks, maxtasksperchild=1) as pool:
+            # idle workers pick up the next job in the order they were
+            # submitted, so submitting the slowest coins first avoids
+            # having a few large coins finishing long after all others.
+            for coin in self.coins_to_run(_coin_list):
+                # then we backtesting this strategy run against each coin
+                job: Any = pool.apply_async(
+                    backtest_in_process,
+                    (
+                        f"coin.{coin}.yaml",
+                        self.coin_configs[f"coin.{coin}.yaml"],
+                    ),
+                )
+                tasks.append((coin, job))
+
+            for coin, t in tasks:
+                _, wall_times[coin] = t.get()
+        return wall_times
+
+    def distributed_backtest_all_coins(
+        self, _coin_list: Set[str]
+    ) -> Dict[str, float]:
+        """hands out the backtesting of each coin to the workers connected
+        to our coordinator, returns their wall times"""
+        if self.coordinator is None:
+            self.coordinator = Coordinator(
+                self.coordinator_bind, self.job_timeout
+            )
+            log_msg(f"coordinator listening on {self.coordinator_bind}")
+        wall_times: Dict[str, float] = self.coordinator.run_jobs(
+            [f"coin.{coin}.yaml" for coin in self.coins_to_run(_coin_list)],
+            self.coin_configs,
+        )
+        # coin.<symbol>.yaml
+        return {conf[5:-5]: took for conf, took in wall_times.items()}
+
+    def load_runtimes(self) -> Dict[str, float]:
+        """loads the past runtimes of each coin backtest"""
+        if not os.path.exists(self.runtimes_file):
+            return {}
+        try:
+            with open(self.runtimes_file, encoding="utf-8") as rf:
+                return json.load(rf)
+        except ValueError:
+            return {}
+
+    def save_runtimes(self, wall_times: Dict[str, float]) -> None:
+        """records the runtime of each coin backtest, per day of price logs"""
+        for coin, wall_time in wall_times.items():
+            self.runtimes[coin] = wall_time / max(
+                self.coin_days.get(coin, 1), 1
+            )
+        with open(f"{self.runtimes_file}.tmp", "w", encoding="utf-8") as rf:
+            json.dump(self.runtimes, rf)
+        os.replace(f"{self.runtimes_file}.tmp", self.runtimes_file)
+
+    def coins_by_cost(self, _coin_list: Set[str]) -> List[str]:
+        """returns the coins ordered by their expected backtesting runtime,
+        slowest first. Coins we haven't backtested before are assumed to be
+        as slow as the slowest coin, so that they don't end up last."""
+        default: float = max(self.runtimes.values(), default=1.0)
+        return sorted(
+            _coin_list,
+            key=lambda coin: (
+                -self.runtimes.get(coin, default)
+                * self.coin_days.get(coin, 1),
+                coin,
+            ),
+        )
+
+    def log_wall_times(
+        self, _run: str, wall_times: Dict[str, float], took: float
+    ) -> None:
+        """logs out how long the coin backtests of a run took"""
+        slowest: List[Tuple[str, float]] = sorted(
+            wall_times.items(), key=lambda x: x[1], reverse=True
+        )
+        log_msg(
+            f" {_run}: backtested {len(wall_times)} coins in {took:.1f}s, "
+            + "slowest: "
+            + ", ".join(f"{c}:{t:.1f}s" for c, t in slowest[:5])
+        )
+        if self.debug:
+            for coin, wall_time in slowest:
+                log_msg(f" {_run}: {coin} took {wall_time:.1f}s")
+
     def sum_of_results_from_run(
         self, _coin_list: Set[str], run_id: str
     ) -> Dict[str, Any]:
@@ -588,74 +1051,27 @@ class ProveBacktesting:
         )
         return _run
 
-    def find_best_results_from_backtesting_log(
-        self, kind: str
-    ) -> Dict[str, Any]:
-        """parses backtesting.log for the best result for a coin"""
-
-        coins: OrderedDict = OrderedDict()
+    def find_best_results(self, kind: str, window: str) -> Dict[str, Any]:
+        """queries the results store for the best result for each coin
+        backtested in this window"""
         _results: dict = {}
-        log: str = "log/backtesting.log"
-        if os.path.exists(log):
-            with open(log, encoding="utf-8") as lines:
-                for line in lines:
-                    _profit, _, _, wls, cfgname, _cfg = line[7:].split("|")
-                    if not self.filter_by in cfgname:
-                        continue
-                    profit = float(_profit)
-
-                    coin = cfgname[9:].split(".")[0]
-                    w, l, s, h = [int(x[1:]) for x in wls.split(",")]
-
-                    if (
-                        (int(w) < self.min_wins)
-                        or (float(profit) < self.min_profit)
-                        or (int(l) > self.max_losses)
-                        or (int(s) > self.max_stales)
-                        or (int(h) > self.max_holds)
-                    ):
-                        continue
-
-                    blob = json.loads(_cfg)
-                    if "TICKERS" in blob.keys():
-                        coincfg = blob["TICKERS"][
-                            coin
-                        ]  # pylint: disable=W0123
-                    else:
-                        continue
-
-                    if coin not in coins:
-                        coins[coin] = {
-                            "profit": profit,
-                            "wls": wls,
-                            "w": w,
-                            "l": l,
-                            "s": s,
-                            "h": h,
-                            "cfgname": cfgname,
-                            "coincfg": coincfg,
-                        }
-
-                    if coin in coins:
-                        if profit > coins[coin]["profit"]:
-                            coins[coin] = {
-                                "profit": profit,
-                                "wls": wls,
-                                "w": w,
-                                "l": l,
-                                "s": s,
-                                "h": h,
-                                "cfgname": cfgname,
-                                "coincfg": coincfg,
-                            }
-
-            _coins: dict = coins
-            coins = OrderedDict(
-                sorted(_coins.items(), key=lambda x: x[1]["w"])
-            )
-            for coin in coins:
-                if kind == "coincfg":
-                    _results[coin] = coins[coin]["coincfg"]
+        if not os.path.exists(store_path("log")):
+            return _results
+        for best in best_per_coin(
+            store_path("log"),
+            {
+                "MIN_WINS": self.min_wins,
+                "MIN_PROFIT": self.min_profit,
+                "MAX_LOSSES": self.max_losses,
+                "MAX_STALES": self.max_stales,
+                "MAX_HOLDS": self.max_holds,
+                "FILTER_BY": self.filter_by,
+            },
+            session=self.session,
+            window=window,
+        ):
+            if kind == "coincfg":
+                _results[best["coin"]] = json.loads(best["ticker"])
         return _results
 
     def log_best_run_results(self, this: Dict[str, Any]) -> None:
@@ -670,12 +1086,31 @@ class ProveBacktesting:
             f"{self.strategy} best run {best_run} profit: {best_profit_in_runs:.3f}"
         )
 
-    def run_optimized_config(self) -> float:
-        """runs optimized config"""
-        with open(f"configs/optimized.{self.strategy}.yaml") as cf:
-            _tickers: Dict[str, Any] = yaml.safe_load(cf.read())["TICKERS"]
-
-        wrap_subprocessing(f"optimized.{self.strategy}.yaml")
+    def start_optimized_config(self, logs_dir: str = "log") -> Tuple[Any, Any]:
+        """starts the optimized config run on a pool of its own, returns the
+        pool and its job. Only call this from the main thread, as a process
+        forked from any other can deadlock on a lock held at the time of the
+        fork by one of the threads it leaves behind."""
+        # on its own process, as the backtest takes over its logging
+        # closed by finish_optimized_config()
+        pool: Any = Pool(processes=1)  # pylint: disable=R1732
+        job: Any = pool.apply_async(
+            backtest_in_process,
+            (
+                f"optimized.{self.strategy}.yaml",
+                self.optimized_config,
+                logs_dir,
+            ),
+        )
+        return (pool, job)
+
+    def finish_optimized_config(self, pool: Any, job: Any) -> float:
+        """waits for an optimized config run, returns its final investment"""
+        try:
+            job.get()
+        finally:
+            pool.close()
+            pool.join()
         with open(
             f"results/backtesting.optimized.{self.strategy}.yaml.txt"
         ) as results_txt:
@@ -691,6 +1126,12 @@ class ProveBacktesting:
 
         return end_investment
 
+    def run_optimized_config(self, logs_dir: str = "log") -> float:
+        """runs optimized config"""
+        return self.finish_optimized_config(
+            *self.start_optimized_config(logs_dir)
+        )
+
 
 if __name__ == "__main__":
     for f in glob.glob("tmp/*"):
@@ -727,6 +1168,13 @@ if __name__ == "__main__":
     )
     final_investment: float = pv.initial_investment
     starting_investment: float = pv.initial_investment
+    # the forwardtesting of a window only depends on the final investment
+    # of the previous window, so with OVERLAP_FORWARD_TESTING it runs here
+    # while the next window is backtested. Its backtesting.log goes into
+    # tmp/ as the log/backtesting.log belongs to the coin backtesting runs.
+    # It is started from here, on the main thread, as the Pool it runs on
+    # forks its process.
+    forward_run: Optional[Tuple[Any, Any]] = None
     for date in pv.start_dates:
         cleanup()
 
@@ -740,7 +1188,7 @@ if __name__ == "__main__":
             flag_checks()
             # TODO: do we consume the price_logs ?
             coin_list: Set[str] = pv.write_all_coin_configs(
-                rollbackward_dates, pv.runs[run]
+                rollbackward_dates, pv.runs[run], run
             )
             results[run] = pv.parallel_backtest_all_coins(
                 coin_list, pv.concurrency, run
@@ -750,7 +1198,7 @@ if __name__ == "__main__":
 
         # using the backtesting.log, we now build the list of tickers
         # we will be using in forwardtesting
-        tickers = pv.find_best_results_from_backtesting_log("coincfg")
+        tickers = pv.find_best_results("coincfg", rollbackward_dates[-1])
         cleanup()
 
         # figure out the next block of dates for our forwadtesting
@@ -759,6 +1207,10 @@ if __name__ == "__main__":
         # and generate the list of price logs to use from those dates
         price_logs = pv.generate_price_log_list(rollforward_dates)
 
+        if forward_run is not None:
+            final_investment = pv.finish_optimized_config(*forward_run)
+            starting_investment = final_investment
+
         log_msg(
             f"now forwardtesting {rollforward_dates[0]}...{rollforward_dates[-1]}"
         )
@@ -769,8 +1221,16 @@ if __name__ == "__main__":
         pv.write_optimized_strategy_config(
             price_logs, tickers, starting_investment
         )
-        final_investment = pv.run_optimized_config()
-        starting_investment = final_investment
+        if pv.overlap_forward_testing:
+            forward_run = pv.start_optimized_config("tmp")
+        else:
+            final_investment = pv.run_optimized_config()
+            starting_investment = final_investment
+
+    if forward_run is not None:
+        final_investment = pv.finish_optimized_config(*forward_run)
+    if pv.coordinator is not None:
+        pv.coordinator.close()
 
     log_msg("COMPLETED WITH RESULTS:")
     log_msg(f" {pv.strategy}: {final_investment}")
@@ -3,12 +3,14 @@
 import argparse
 import gzip
 import os
-import json
 import time
 from datetime import datetime, timedelta
+from typing import List, Tuple
 
 from binance.client import Client  # pylint: disable=E0401
 
+from lib.price_log_index import update_index, write_index_files
+
 client = Client("FAKE", "FAKE")
 
 
@@ -49,82 +51,12 @@ def daterange(date1, date2):
     return dates
 
 
-def gather_symbols_and_logs(log_dir="log") -> tuple[set[str], set[str]]:
-    """returns lists of symbols and dates"""
-    date_list = set()
-    symbols_list = set()
-
-    # gather all date.log.gz logs and
-    # all symbol dirs
-    for dir_item in sorted(os.listdir(log_dir)):
-        if (
-            os.path.isfile(f"{log_dir}/{dir_item}")
-            and dir_item.startswith("20")
-            and dir_item.endswith(".log.gz")
-        ):
-            date: str = dir_item.split(".")[0]
-            date_list.add(date)
-        if os.path.isdir(f"{log_dir}/{dir_item}"):
-            symbols_list.add(dir_item)
-
-    return (set(symbols_list), set(date_list))
-
-
-def gather_symbols_per_date(
-    log_dir, symbols_list, date_list
-) -> dict[str, list[str]]:
-    """returns map of dates containing symbols available on that date"""
-    dates_idx: dict[str, list[str]] = {}
-
-    # we'll store all symbol logs in each date
-    for date in sorted(date_list):
-        if date not in dates_idx:
-            dates_idx[date] = []
-
-    for _symbol in sorted(symbols_list):
-        logs: list[str] = os.listdir(f"{log_dir}/{_symbol}")
-        for _log in sorted(logs):
-            if not os.path.isfile(f"{log_dir}/{_symbol}/{_log}"):
-                continue
-            _date: str = _log.split(".")[0]
-            dates_idx[_date].append(_symbol)
-    return dates_idx
-
-
-def generate_index(log_dir="log") -> None:
-    """generates index.json with dates <- [coins]"""
-
-    print("generating index...")
-    symbols_list, date_list = gather_symbols_and_logs(log_dir)
-
-    dates_index: dict[str, list[str]] = gather_symbols_per_date(
-        log_dir, symbols_list, date_list
-    )
-
-    # generate index_v1
-    print("writing index.json.gz...")
-
-    with gzip.open(
-        f"{log_dir}/index.json.gz", "wt", encoding="utf-8"
-    ) as index_json:
-        index_json.write(json.dumps(dates_index, indent=4))
-
-    # generate index_v2
-    print("generating index_v2.json.gz...")
-    index: dict[str, dict] = {"DATES": {}, "COINS": {}}
-    for date in dates_index.keys():  # pylint: disable=C0206,C0201
-        index["DATES"][date] = list(dates_index[date])
-
-    for _symbol in sorted(os.listdir(log_dir)):
-        if os.path.isdir(f"{log_dir}/{_symbol}"):
-            logs: list[str] = os.listdir(f"{log_dir}/{_symbol}")
-            index["COINS"][_symbol] = sorted(logs)
+def generate_index(log_dir: str) -> None:
+    """writes out index.json.gz and index_v2.json.gz from the price log
+    index"""
 
-    print("writing index_v2.json.gz...")
-    with gzip.open(
-        f"{log_dir}/index_v2.json.gz", "wt", encoding="utf-8"
-    ) as index_json:
-        index_json.write(json.dumps(index, indent=4))
+    print("writing index.json.gz and index_v2.json.gz...")
+    write_index_files(log_dir)
 
 
 if __name__ == "__main__":
@@ -136,6 +68,11 @@ if __name__ == "__main__":
     parser.add_argument(
         "-u", "--unit", help="Unit to use 1m/5m/1h/1d", default="1m"
     )
+    parser.add_argument(
+        "--reindex",
+        help="rebuild the index from all the logs in log/",
+        action="store_true",
+    )
 
     args = parser.parse_args()
     s = args.start
@@ -152,6 +89,10 @@ if __name__ == "__main__":
     print("getting list of all binance tickers")
     tickers = get_all_tickers()
     ignore_list = []
+    # build the index the first time, or pick up any price logs left behind
+    # by a previous run that died before indexing them
+    print("updating index...")
+    update_index("log", [], [], args.reindex)
 
     # iterate over the date range, so that we generate one price.log.gz file
     # per day.
@@ -175,6 +116,8 @@ if __name__ == "__main__":
         )
 
         log = []
+        # the price logs written for this day, to be added to the index
+        day_logs: List[Tuple[str, str]] = []
 
         # iterate over the current (as of from today) list of available
         # tickers on binance, and retrieve the klines for each one for this
@@ -246,6 +189,7 @@ if __name__ == "__main__":
                     z.write(f.read())
             if os.path.exists(f"log/{ticker}/{day}.log"):
                 os.remove(f"log/{ticker}/{day}.log")
+            day_logs.append((ticker, f"{day}.log.gz"))
 
         # now that we have all klines for all tickers for this day,
         # we're going to dedup the results and discard any lines that haven't
@@ -276,6 +220,9 @@ if __name__ == "__main__":
         if os.path.exists(f"log/{day}.log"):
             os.remove(f"log/{day}.log")
 
-    # and generate and index.json for all the dates and which coin files
+        # index this day straight away, as any later run skips it
+        update_index("log", [day], day_logs)
+
+    # and generate the index.json for all the dates and which coin files
     # are available for those dates
     generate_index("log")
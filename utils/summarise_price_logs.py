@@ -0,0 +1,11 @@
+""" precomputes the daily klines summary of every symbol in log/ """
+from os import listdir
+from os.path import isdir
+
+from lib.price_log_klines import LOG_DIR, daily_summary
+
+if __name__ == "__main__":
+    for symbol in sorted(listdir(LOG_DIR)):
+        if not isdir(f"{LOG_DIR}/{symbol}"):
+            continue
+        print(f"summarising {symbol}: {len(daily_summary(symbol))} days")
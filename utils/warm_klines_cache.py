@@ -0,0 +1,180 @@
+""" warms up the klines cache/ for an upcoming prove-backtesting run """
+import importlib
+import json
+import os
+import sys
+from argparse import ArgumentParser, Namespace
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from time import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import requests
+import yaml
+
+import klines_caching_service
+from lib.helpers import c_date_from, is_leveraged_token
+
+pb = importlib.import_module("utils.prove-backtesting")
+
+
+def log_msg(msg: str) -> None:
+    """logs out message prefixed with timestamp"""
+    now: str = datetime.now().strftime("%H:%M:%S")
+    print(f"{now} WARM-KLINES-CACHE: {msg}")
+
+
+def first_seen_in_window(pv: Any, dates: List[str]) -> Dict[str, str]:
+    """returns the first day each coin appears in the index for these dates"""
+    first_seen: Dict[str, str] = {}
+    index_dates: Dict[str, List[str]] = pv.index_json["DATES"]
+    for day in dates:
+        for coin in index_dates.get(day, []):
+            if coin in first_seen or not coin.endswith(pv.pairing):
+                continue
+            # the bot discards any BULL/BEAR tokens
+            if is_leveraged_token(coin, pv.pairing):
+                continue
+            first_seen[coin] = day
+    return first_seen
+
+
+def coin_days_for_run(pv: Any) -> List[Tuple[str, str]]:
+    """returns every (symbol, day) a prove-backtesting run will initialise a
+    coin on, in the order the run will get to them"""
+    coin_days: Dict[Tuple[str, str], None] = {}
+    for date in pv.start_dates:
+        # each coin backtesting run starts a bot on the coin price logs
+        # within the roll backwards window, the coin klines are loaded
+        # from the first line of its first price log.
+        rollbackward_dates: List[str] = pv.rollback_dates_from(date)
+        for coin, price_logs in pv.coins_to_backtest(
+            rollbackward_dates
+        ).items():
+            day: str = price_logs[0].split("/")[1].split(".")[0]
+            coin_days[(coin, day)] = None
+            # and so are any EXTRA_PRICE_LOG_SYMBOLS merged into its run
+            for symbol in pv.extra_price_log_symbols:
+                coin_days[(symbol, day)] = None
+
+        # the forwardtesting run consumes the full daily price logs, where
+        # any coin is initialised as soon as we first see it.
+        for coin, day in first_seen_in_window(
+            pv, pv.rollforward_dates_from(date)
+        ).items():
+            coin_days[(coin, day)] = None
+    return list(coin_days.keys())
+
+
+def first_price_log_date(
+    price_log_service_url: str, logfile: str
+) -> Optional[float]:
+    """returns the timestamp of the first line in a price log, as the bot
+    would parse it"""
+    with requests.get(
+        f"{price_log_service_url}/{logfile}", timeout=30, stream=True
+    ) as response:
+        if response.status_code != 200:
+            return None
+        # we only need the first line, so we stream the price log and
+        # stop reading as soon as we have it
+        for item in response.iter_lines():
+            line: str = item.decode()
+            if len(line) > 27:
+                return c_date_from(line[0:19])
+    return None
+
+
+def load_checkpoint(checkpoint: str) -> Set[str]:
+    """returns the coin days we already warmed up on a previous run"""
+    if not os.path.exists(checkpoint):
+        return set()
+    with open(checkpoint, encoding="utf-8") as c:
+        return set(json.load(c))
+
+
+def save_checkpoint(checkpoint: str, done: Set[str]) -> None:
+    """saves the coin days we warmed up so far"""
+    tmp_path: str = f"{checkpoint}.tmp"
+    with open(tmp_path, "wt", encoding="utf-8") as c:
+        json.dump(sorted(done), c)
+    os.replace(tmp_path, checkpoint)
+
+
+def warm_coin_day(price_log_service_url: str, symbol: str, day: str) -> bool:
+    """populates the klines cache for a coin as the bot would request it"""
+    date: Optional[float] = first_price_log_date(
+        price_log_service_url, f"{symbol}/{day}.log.gz"
+    )
+    if date is None:
+        return False
+    klines_caching_service.load_klines_for_coin(
+        symbol, int(date), "backtesting"
+    )
+    return True
+
+
+def warm_klines_cache(
+    pv: Any, checkpoint: str, workers: int, every: int = 50
+) -> None:
+    """warms up the klines cache for all coins in a prove-backtesting run,
+    resuming from a checkpoint of the coin days already done"""
+    done: Set[str] = load_checkpoint(checkpoint)
+    todo: List[Tuple[str, str]] = [
+        (symbol, day)
+        for symbol, day in coin_days_for_run(pv)
+        if f"{symbol}/{day}" not in done
+    ]
+    log_msg(f"{len(done)} coin days already warm, {len(todo)} to go")
+
+    start: float = time()
+    failed: int = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        jobs: Dict[Any, str] = {
+            pool.submit(
+                warm_coin_day, pv.price_log_service_url, symbol, day
+            ): f"{symbol}/{day}"
+            for symbol, day in todo
+        }
+        for n, job in enumerate(as_completed(jobs), start=1):
+            try:
+                ok: bool = job.result()
+            except Exception as err:  # pylint: disable=broad-except
+                log_msg(f"failed to warm up {jobs[job]}: {err}")
+                ok = False
+            if ok:
+                done.add(jobs[job])
+            else:
+                failed = failed + 1
+
+            if n % every == 0 or n == len(todo):
+                save_checkpoint(checkpoint, done)
+                elapsed: float = time() - start
+                eta: float = elapsed / n * (len(todo) - n)
+                log_msg(
+                    f"{n}/{len(todo)} coin days, {failed} failed, "
+                    + f"{n / elapsed:.1f}/s, eta {eta:.0f}s"
+                )
+    log_msg(f"completed with {failed} failures")
+
+
+if __name__ == "__main__":
+    parser: ArgumentParser = ArgumentParser()
+    parser.add_argument("-c", "--cfgs", help="prove-backtesting cfg")
+    parser.add_argument(
+        "-w", "--workers", help="concurrent coin days", default=8, type=int
+    )
+    args: Namespace = parser.parse_args()
+
+    with open(args.cfgs, encoding="utf-8") as _c:
+        config: Any = yaml.safe_load(_c.read())
+
+    if config["KIND"] != "PROVE_BACKTESTING":
+        log_msg("Incorrect KIND: type")
+        sys.exit(1)
+
+    warm_klines_cache(
+        pb.ProveBacktesting(config),
+        f"state/warm_klines_cache.{os.path.basename(args.cfgs)}.json",
+        args.workers,
+    )